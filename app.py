@@ -1,22 +1,107 @@
 from fastapi import FastAPI, Request, Query
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from pydantic import BaseModel
 import os
 import json
-import requests
+import sqlite3
+import logging
+import time
+import asyncio
 import secrets
 import hashlib
 import base64
 import httpx
 import uvicorn
-from typing import List
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import List, Optional
 from dotenv import load_dotenv
 from urllib.parse import quote
-from scraper import download_pdf, extract_title
-from searchbook import search_book_by_title_openlibrary
+from scraper import download_pdf_from_page, resolve_download, scrape_book_page
+from searchbook import (search_book_by_title_openlibrary, search_book_by_isbn_openlibrary, search_book_for_pdf,
+                        metadata_cache, openlibrary_client, aclose_client as aclose_openlibrary)
+from pdf_metadata import extract_pdf_metadata
+from metadata_cache import OPENLIBRARY_CACHE_PURGE_INTERVAL, normalize_title
+from openlibrary_dump import dump_index
+from jobs import JobQueue
+from etsy_client import EtsyClient
+from tokens import TokenManager, TokenError
+from pdf_store import pdf_store
+from listing_index import listing_index
+from checkpoints import STEPS as CHECKPOINT_STEPS, pipeline_checkpoints
+from shop_mirror import shop_mirror
+from bulk_listings import BULK_MAX_LISTINGS, OPERATIONS as BULK_OPERATIONS, run_bulk, resolve_listing_ids
+from cover_pipeline import cover_pipeline
+from descriptions import description_engine
+from pdf_transfer import PDF_TRANSFER_MODE, TransferError, stream_pdf_to_etsy, upload_pdf_file_to_etsy
+from progress import JobCancelled, progress_tracker, run_tracked
+from crawler import CRAWL_MAX_PAGES, Crawler, search_url
+from taxonomy import etsy_taxonomy
+from metrics import (HTTP_IN_FLIGHT, HTTP_REQUESTS, PIPELINE_STAGES, PIPELINE_STAGES_IN_FLIGHT, configure_logging,
+                     new_request_id, registry, request_id)
 from fastapi.middleware.cors import CORSMiddleware  # Add this import
 # ...existing imports...
 
-app = FastAPI()
+async def _purge_metadata_cache():
+    """Delete expired Open Library cache rows at startup and then every OPENLIBRARY_CACHE_PURGE_INTERVAL seconds"""
+    while True:
+        try:
+            purged = await asyncio.to_thread(metadata_cache.purge_expired)
+            if purged:
+                logger.info("Purged %d expired Open Library cache entries", purged)
+        except sqlite3.Error as e:
+            logger.warning("Purging the Open Library cache failed: %s", e)
+        await asyncio.sleep(OPENLIBRARY_CACHE_PURGE_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_queue.start()
+    await asyncio.to_thread(pdf_store.prune_partial)
+    # Runs cut short by the last shutdown pick up from their last checkpointed step
+    interrupted = await asyncio.to_thread(pipeline_checkpoints.interrupted)
+    if interrupted:
+        logger.info("Resuming %d interrupted listing runs", len(interrupted))
+        job_queue.submit([run["book_url"] for run in interrupted])
+    # A crawl cut short by the last shutdown continues from its saved frontier
+    if await crawler.resume():
+        logger.info("Resuming catalog crawl")
+    purge_task = asyncio.create_task(_purge_metadata_cache())
+    yield
+    purge_task.cancel()
+    await asyncio.gather(purge_task, return_exceptions=True)
+    await crawler.stop()
+    await job_queue.stop()
+    await etsy.aclose()
+    await cover_pipeline.aclose()
+    await aclose_openlibrary()
+
+app = FastAPI(lifespan=lifespan)
+
+configure_logging()
+logger = logging.getLogger("booking")
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Tag every request with an ID (honouring an incoming X-Request-ID), time it and log it"""
+    token = request_id.set(request.headers.get("x-request-id") or new_request_id())
+    start = time.perf_counter()
+    status = 500
+    HTTP_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id.get()
+        return response
+    finally:
+        duration = time.perf_counter() - start
+        HTTP_IN_FLIGHT.dec()
+        # The route template keeps ids out of the label values
+        route = request.scope.get("route")
+        HTTP_REQUESTS.observe(duration, method=request.method, route=route.path if route else "unmatched",
+                              status=str(status))
+        logger.info("%s %s -> %s in %.3fs", request.method, request.url.path, status, duration)
+        request_id.reset(token)
+
 
 # Add CORS middleware
 app.add_middleware(
@@ -35,8 +120,18 @@ CLIENT_ID = os.getenv("ETSY_CLIENT_ID")
 REDIRECT_URI = "http://localhost:8000/callback"  # Always use localhost
 SCOPES = ["shops_r", "shops_w", "listings_r", "listings_w", "listings_d"]
 
+# OAuth tokens are kept in memory and only written back to .env on change
+tokens = TokenManager(CLIENT_ID)
+
+# Shared, pooled Etsy API client used by every Etsy endpoint
+etsy = EtsyClient(
+    CLIENT_ID,
+    access_token=tokens.get_access_token,
+    refresh_token=lambda stale_token: tokens.refresh(force=True, stale_token=stale_token),
+)
+
 @app.get("/")
-def start_auth():
+async def start_auth():
     """Start the OAuth flow"""
     # Generate new PKCE values
     code_verifier = secrets.token_urlsafe(32)
@@ -59,12 +154,12 @@ def start_auth():
         f'&state={state}'
     )
     
-    print(f"Auth URL: {auth_url}")  # Debug print
+    logger.debug("Auth URL: %s", auth_url)
     return RedirectResponse(auth_url)
 
 @app.get("/callback")
 async def callback(code: str = None, state: str = None, error: str = None):
-    print(f"Callback received: code={code}, state={state}, error={error}")
+    logger.info("OAuth callback received (error=%s)", error)
     if error:
         return {"error": error}
         
@@ -78,173 +173,128 @@ async def callback(code: str = None, state: str = None, error: str = None):
     
     try:
         # Exchange authorization code for access token
-        token_url = 'https://openapi.etsy.com/v3/public/oauth/token'
-        data = {
-            'grant_type': 'authorization_code',
-            'client_id': CLIENT_ID,
-            'redirect_uri': REDIRECT_URI,
-            'code': code,
-            'code_verifier': code_verifier
-        }
-        
-        response = requests.post(token_url, data=data)
-        response.raise_for_status()
-        
-        tokens = response.json()
-        print(f"Tokens: {tokens}")
-        # Update tokens in .env file
-        try:
-            with open('.env', 'r') as file:
-                lines = file.readlines()
-            
-            # Remove existing tokens
-            lines = [line for line in lines if not line.startswith(('ETSY_ACCESS_TOKEN=', 'ETSY_REFRESH_TOKEN='))]
-            
-            # Add new tokens
-            with open('.env', 'w') as file:
-                file.writelines(lines)
-                file.write(f'ETSY_ACCESS_TOKEN={tokens["access_token"]}\n')
-                file.write(f'ETSY_REFRESH_TOKEN={tokens["refresh_token"]}\n')
-        except:
-            pass
+        await tokens.exchange_code(code, code_verifier, REDIRECT_URI)
         
         return {"message": "Authorization successful! rj3 fin knti w dir refresh."}
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return {"error": str(e), "details": e.response.text if hasattr(e, 'response') else None}
     
 @app.get("/refresh")
 async def refresh_token():
     try:
-        # Load refresh token from .env file
-        with open('.env', 'r') as file:
-            lines = file.readlines()
-        
-        refresh_token = next(line for line in lines if line.startswith('ETSY_REFRESH_TOKEN=')).split('=')[1].strip()
-        
         # Exchange refresh token for new access token
-        token_url = 'https://api.etsy.com/v3/public/oauth/token'
-        data = {
-            'grant_type': 'refresh_token',
-            'client_id': CLIENT_ID,
-            'refresh_token': refresh_token
-        }
-        
-        response = requests.post(token_url, data=data)
-        response.raise_for_status()
-        
-        tokens = response.json()
-        
-        # Update access token in .env file
-        try:
-            with open('.env', 'r') as file:
-                lines = file.readlines()
-            
-            # Remove existing access token
-            lines = [line for line in lines if not line.startswith('ETSY_ACCESS_TOKEN=')]
-            
-            # Add new access token
-            with open('.env', 'w') as file:
-                file.writelines(lines)
-                file.write(f'ETSY_ACCESS_TOKEN={tokens["access_token"]}\n')
-        except:
-            pass
+        await tokens.refresh(force=True)
         
         return {"message": "Token refreshed successfully!"}
         
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, TokenError) as e:
         return {"error": str(e), "details": e.response.text if hasattr(e, 'response') else None}
 
 @app.get("/get-user")
-def get_user():
+async def get_user():
     try:
-        
-        # Load access token from .env file
-        with open('.env', 'r') as file:
-            lines = file.readlines()
-
-        access_token = next(line for line in lines if line.startswith('ETSY_ACCESS_TOKEN=')).split('=')[1].strip()
-        x_api_key = os.getenv("ETSY_CLIENT_ID")
-        print('access_token: ', access_token, '\nx_api_key: ', x_api_key)
-        
         # Get user details
-        user_url = 'https://openapi.etsy.com/v3/application/users/me'
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'x-api-key': x_api_key
-        }
-        
-        response = requests.get(user_url, headers=headers)
-        response.raise_for_status()
-        
+        response = await etsy.get('/users/me')
         user = response.json()
         
         return {"shop_id": user['shop_id']}
         
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, TokenError) as e:
         return {"error": str(e), "details": e.response.text if hasattr(e, 'response') else None}
     
-# @app.get("/get-taxonomy")
-# def get_taxonomy():
-#     try:
-#         x_api_key = os.getenv("ETSY_CLIENT_ID")
-        
-#         # Get taxonomy details
-#         taxonomy_url = 'https://openapi.etsy.com/v3/application/seller-taxonomy/nodes'
-#         headers = {'x-api-key': x_api_key}
-        
-#         response = requests.get(taxonomy_url, headers=headers)
-#         response.raise_for_status()
-        
-#         taxonomy = response.json()
-        
-#         return taxonomy
-        
-#     except requests.exceptions.RequestException as e:
-#         return {"error": str(e), "details": e.response.text if hasattr(e, 'response') else None}
+@app.get("/get-taxonomy")
+async def get_taxonomy(refresh: bool = False):
+    """The Etsy seller taxonomy tree, served from the local copy (refetched when stale or with refresh=true)"""
+    index = await etsy_taxonomy.ensure(etsy, force=refresh)
+    if index is None:
+        return {"error": "Etsy taxonomy unavailable", "details": etsy_taxonomy.summary()}
+    return {**etsy_taxonomy.summary(), "results": etsy_taxonomy.tree}
+
+
+@app.get("/taxonomy/match")
+async def match_taxonomy(subjects: List[str] = Query(None)):
+    """The taxonomy node and tags a listing for a book with these Open Library subjects would get"""
+    return await etsy_taxonomy.classify(etsy, subjects)
+
+@asynccontextmanager
+async def _keyed_lock(locks, key):
+    """
+    Hold the asyncio.Lock for `key` in `locks`. The entry counts its holder and
+    waiters and is only dropped when the last of them leaves, so a newcomer can
+    never get a second lock for a key someone is still waiting on.
+    """
+    entry = locks.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            locks.pop(key, None)
+
+
+@asynccontextmanager
+async def _keyed_locks(locks, keys):
+    """Hold the `_keyed_lock` of every key, taken in sorted order so overlapping key sets can't deadlock"""
+    async with AsyncExitStack() as stack:
+        for key in sorted(set(keys)):
+            await stack.enter_async_context(_keyed_lock(locks, key))
+        yield
+
+
+# One lock per shop and dedup key so concurrent duplicates wait for the first create
+_listing_locks = {}
+
 
 @app.get("/create-listing")
-def create_listing(shop_id, title, description):
+async def create_listing(shop_id, title, description, source_url: str = None, isbn: str = None,
+                         idempotency_key: str = None, subjects: List[str] = Query(None)):
+    # Every key the lookup could match on is locked: requests for one book may be keyed differently
+    # (an idempotency key here, a source URL there, two URLs with one ISBN)
+    keys = [f"{shop_id}:{key}" for key in listing_index.keys(idempotency_key, source_url, isbn, title)]
     try:
-        # Load access token from .env file
-        with open('.env', 'r') as file:
-            lines = file.readlines()
-        
-        access_token = next(line for line in lines if line.startswith('ETSY_ACCESS_TOKEN=')).split('=')[1].strip()
-        
-        # Create a new listing
-        listing_url = f'https://openapi.etsy.com/v3/application/shops/{shop_id}/listings'
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'x-api-key': CLIENT_ID,
-            'Content-Type': 'application/json'
-        }
-        
-        data = {
-            'title': title,
-            'description': description,
-            'price': 99999,
-            'quantity': 999,
-            'who_made': 'i_did',
-            'when_made': 'made_to_order',
-            'is_supply': False,
-            'type': 'download',
-            'materials': ['digital', 'PDF'],
-            'tags': ['digital', 'ebook', 'PDF', 'instant download'],
-            'should_auto_renew': False,
-            'taxonomy_id': 324,
-            'state': 'draft'
-        }
-        
-        response = requests.post(listing_url, headers=headers, json=data)
-        response.raise_for_status()
-        
-        listing = response.json()
-        
-        return {"listing_id": listing['listing_id']}
+        async with _keyed_locks(_listing_locks, keys or [f"shop:{shop_id}"]):
+            # A repeated request resolves to the listing we already created
+            existing = await asyncio.to_thread(listing_index.find, shop_id, idempotency_key, source_url, isbn, title)
+            if existing:
+                return {"listing_id": existing["listing_id"], "existing": True, "matched_on": existing["matched_on"]}
+
+            listing = await _create_etsy_listing(shop_id, title, description, subjects)
+            await asyncio.to_thread(
+                listing_index.record, shop_id, listing['listing_id'], idempotency_key, source_url, isbn, title
+            )
+
+            return {"listing_id": listing['listing_id']}
         
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, TokenError) as e:
         return {"error": str(e), "details": e.response.text if hasattr(e, 'response') else None}
+
+
+async def _create_etsy_listing(shop_id, title, description, subjects=None):
+    # Category and tags come from the book's subjects, matched against the cached taxonomy
+    category = await etsy_taxonomy.classify(etsy, subjects)
+
+    # Create a new listing
+    data = {
+        'title': title,
+        'description': description,
+        'price': 99999,
+        'quantity': 999,
+        'who_made': 'i_did',
+        'when_made': 'made_to_order',
+        'is_supply': False,
+        'type': 'download',
+        'materials': ['digital', 'PDF'],
+        'tags': category['tags'],
+        'should_auto_renew': False,
+        'taxonomy_id': category['taxonomy_id'],
+        'state': 'draft'
+    }
+    
+    response = await etsy.post(f'/shops/{shop_id}/listings', json=data)
+    return response.json()
     
 # @app.get("/get-book-pdf")                                           }
 # def get_book_pdf(book_url='https://www.gutenberg.org/ebooks/1342'): }
@@ -260,57 +310,154 @@ def create_listing(shop_id, title, description):
 #                                                                     }
 
 @app.get("/get-book-pdf")
-def get_book_pdf(book_url="https://www.pdfdrive.com/living-in-the-light-a-guide-to-personal-transformation-e10172273.html"):
+async def get_book_pdf(book_url="https://www.pdfdrive.com/living-in-the-light-a-guide-to-personal-transformation-e10172273.html",
+                       job_id: str = None):
+    async def work():
+        # Fetch the book page once, then follow it to the PDF
+        progress_tracker.stage(job_id, "scrape_page", "started")
+        page = await scrape_book_page(book_url)
+        progress_tracker.stage(job_id, "scrape_page", "done")
+
+        progress_tracker.stage(job_id, "download_pdf", "started")
+        pdf = await download_pdf_from_page(page, progress_tracker.reporter(job_id, "download_pdf"))
+        progress_tracker.stage(job_id, "download_pdf", "done")
+
+        # What the PDF says about itself (info dict / XMP / first pages) is more reliable than the page title
+        metadata = await asyncio.to_thread(extract_pdf_metadata, pdf) if pdf else None
+        return {"title": page["title"], "pdf": pdf, "metadata": metadata}
+
     try:
-        # Download PDF
-        pdf = download_pdf(book_url)
-        title = extract_title(book_url)
-        
-        return {"title": title, "pdf": pdf}
-        
+        # With a job_id, GET /progress/{job_id} follows the download and POST /progress/{job_id}/cancel stops it
+        return await run_tracked(job_id, work)
+
+    except JobCancelled as e:
+        await asyncio.to_thread(pdf_store.discard_partial, book_url)
+        return {"error": str(e), "cancelled": True}
+
     except Exception as e:
         return {"error": str(e)}
     
 @app.get("/search-book")
-def search_book(title):
+async def search_book(title=None, isbn: str = None, file_name: str = None):
     try:
-        # Search for book
-        book = search_book_by_title_openlibrary(title)
+        # Search for book: exact ISBN first, then the downloaded PDF's own metadata, then the title
+        if isbn:
+            book = await search_book_by_isbn_openlibrary(isbn)
+        elif file_name:
+            book = await search_book_for_pdf(file_name, fallback_title=title)
+        elif title:
+            book = await search_book_by_title_openlibrary(title)
+        else:
+            return {"error": "One of title, isbn or file_name is required"}
+        if book["status"] != "success":
+            return {"error": book["message"]}
         return book["data"]
     
     except Exception as e:
         return {"error": str(e)}
+
+async def _pipeline_book(title, file_name: str = None):
+    """search_book for the pipeline: a book Open Library doesn't know is listed under its scraped title"""
+    book = await search_book(title, file_name=file_name)
+    if book.get("error") == "No book found":
+        logger.info("No Open Library match for %r, listing it under the scraped title", title)
+        return {"title": title}
+    return book
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of latencies, bytes, retries, caches and in-flight work"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/search-book/cache-stats")
+async def search_book_cache_stats():
+    return await asyncio.to_thread(metadata_cache.summary)
+
+
+@app.get("/search-book/dump-index")
+async def search_book_dump_index():
+    """Lookup mode and the state of the local Open Library dump index"""
+    return await asyncio.to_thread(dump_index.summary)
+
+
+class SearchBooksRequest(BaseModel):
+    titles: List[str]
+
+
+@app.post("/search-books")
+async def search_books(request: SearchBooksRequest):
+    """
+    Resolve many titles concurrently against Open Library.
+
+    Titles that normalize to the same key are looked up once; results are
+    streamed back as NDJSON, one line per unique title, as each one completes.
+    """
+    unique = {}
+    for title in request.titles:
+        unique.setdefault(normalize_title(title), []).append(title)
+
+    async def resolve(client, normalized, titles):
+        book = await search_book_by_title_openlibrary(titles[0], client)
+        return {"normalized": normalized, "titles": titles, **book}
+
+    async def generate():
+        client = openlibrary_client()
+        tasks = [asyncio.create_task(resolve(client, normalized, titles)) for normalized, titles in unique.items()]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task) + "\n"
+        finally:
+            # Stop outstanding lookups if the client went away
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
     
 @app.get("/generate-description")
-def generate_description(
+async def generate_description(
     title: str = Query(None),
     authors: List[str] = Query(None),
     publish_year: str = Query(None),
     publishers: List[str] = Query(None),
-    subjects: List[str] = Query(None)
+    subjects: List[str] = Query(None),
+    languages: List[str] = Query(None),
+    category: str = Query(None),
+    language: str = Query(None),
+    version: str = Query(None)
 ):
 
     try:
-        # Generate description
-        description_parts = [
-            f"Introducing {title}" if title else "",
-            f", a captivating and transformative work by {authors}." if authors else "",
-            f" Published in {publish_year}" if publish_year != ['N/A'] else "",
-            f" by {publishers}" if publishers != ['N/A'] else "",
-            ", this book invites readers to embark on a journey of discovery and inspiration. With its engaging narrative and insightful perspectives,",
-            f" {title} explores themes of {subjects} and offers practical wisdom to enhance your everyday life." if subjects else f" {title} offers practical wisdom to enhance your everyday life."
-        ]
-
-        # Join the non-empty parts into a single string
-        description = ''.join(part for part in description_parts if part)
-
-        descriptions = (
-            f"Title: {title}\n"
-            f"Author: {authors}\n\n"
-            f"{description}\n\n"
-        )
+        # Generate description from the precompiled template for this book
+        book = {
+            "title": title,
+            "authors": authors,
+            "publish_year": publish_year,
+            "publishers": publishers,
+            "subjects": subjects,
+            "language": languages,
+        }
+        return {"description": description_engine.render(book, category, language, version)}
         
-        return {"description": descriptions}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+class DescriptionsRequest(BaseModel):
+    books: List[dict]
+    category: str = None
+    language: str = None
+    version: str = None
+
+
+@app.post("/generate-descriptions")
+async def generate_descriptions(request: DescriptionsRequest):
+    """Render descriptions for many books (search-book shaped records) in one call"""
+    try:
+        # A large batch is real CPU work; render it off the event loop
+        descriptions = await asyncio.to_thread(
+            description_engine.render_many, request.books, request.category, request.language, request.version
+        )
+        return {"descriptions": descriptions, "version": request.version or description_engine.version}
         
     except Exception as e:
         return {"error": str(e)}
@@ -318,86 +465,72 @@ def generate_description(
 @app.get("/upload-listing-image")
 async def upload_listing_image(shop_id=57595253, listing_id=1873746497, image_url='https://covers.openlibrary.org/b/id/1932116-L.jpg'):
     try:
-        # Load access token from .env file
-        with open('.env', 'r') as file:
-            lines = file.readlines()
-
-        access_token = next(line for line in lines if line.startswith('ETSY_ACCESS_TOKEN=')).split('=')[1].strip()
-
-        # Get image data directly from URL
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            response = await client.get(image_url)
-            response.raise_for_status()
-
-        image_upload_url = f'https://openapi.etsy.com/v3/application/shops/{shop_id}/listings/{listing_id}/images'
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'x-api-key': CLIENT_ID,
-        }
+        # Download, resize and recompress the cover (cached by cover id and size)
+        image_data = await cover_pipeline.prepare(image_url)
 
         # Create files parameter for multipart form data
         files = {
-            'image': ('image.jpg', response.content, 'image/jpeg')
+            'image': ('image.jpg', image_data, 'image/jpeg')
         }
 
-        # Use requests to upload the image
-        response = requests.post(image_upload_url, headers=headers, files=files)
-        response.raise_for_status()
+        response = await etsy.post(f'/shops/{shop_id}/listings/{listing_id}/images', files=files)
 
         image = response.json()
         return {"image_id": image['listing_image_id']}
     
-    except (requests.exceptions.RequestException, httpx.HTTPError) as e:
+    except (httpx.HTTPError, TokenError, OSError) as e:
         return {"error": str(e), "details": e.response.text if hasattr(e, 'response') else None}
     
 @app.get("/upload-listing-file")
-async def upload_listing_file(shop_id, listing_id, file_name):
+async def upload_listing_file(shop_id, listing_id, file_name, job_id: str = None):
     try:
-        # Load access token from .env file
-        with open('.env', 'r') as file:
-            lines = file.readlines()
-
-        access_token = next(line for line in lines if line.startswith('ETSY_ACCESS_TOKEN=')).split('=')[1].strip()
-
-        # Get file data
-        with open(file_name, 'rb') as file:
-            file_data = file.read()
-
-        print('I reached here')
+        return await run_tracked(
+            job_id, lambda: _upload_listing_file(shop_id, listing_id, file_name,
+                                                 progress_tracker.reporter(job_id, "upload_file"))
+        )
 
-        file_upload_url = f'https://openapi.etsy.com/v3/application/shops/{shop_id}/listings/{listing_id}/files'
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'x-api-key': CLIENT_ID,
-        }
-        
-        # Remove file extension and underscores from file name take only what is before :
-        name = file_name.split(':')[0].replace('_', ' ')
+    except JobCancelled as e:
+        return {"error": str(e), "cancelled": True}
 
-        # Create files parameter for multipart form data
-        files = {
-            'file': ('file.pdf', file_data, 'application/pdf'),
-        }
-        
-        # Add name as form data
-        data = {
-            'name': name
-        }
 
-        # Use requests to upload the file with both files and form data
-        response = requests.post(file_upload_url, headers=headers, files=files, data=data)
-        response.raise_for_status()
+async def _upload_listing_file(shop_id, listing_id, file_name, progress=None):
+    try:
+        # Name the file after the book title the store recorded; for files outside the
+        # store, remove underscores from the file name and take only what is before :
+        title = await asyncio.to_thread(pdf_store.title, file_name)
+        name = (title or file_name).split(':')[0].replace('_', ' ').strip()
 
-        file = response.json()
+        # Stream the file from disk as multipart form data (name field + file part)
+        file = await upload_pdf_file_to_etsy(etsy, shop_id, listing_id, name, file_name, progress)
         return {"file_id": file['listing_file_id'], "name": name}
     
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, TokenError, OSError) as e:
         return {"error": str(e), "details": e.response.text if hasattr(e, 'response') else None}
     
+async def upload_listing_file_stream(shop_id, listing_id, source, progress=None):
+    """Upload the PDF described by `resolve_download` without saving it locally"""
+    try:
+        # Take only what is before : for the file name
+        name = source["title"].split(':')[0].strip()
+
+        file = await stream_pdf_to_etsy(etsy, shop_id, listing_id, name, source, progress=progress)
+        return {"file_id": file['listing_file_id'], "name": name}
+
+    except TransferError as e:
+        # Source failures carry their own status and body snippet; the source response was never read
+        return {"error": str(e), "status_code": e.status_code, "details": e.details}
+
+    except (httpx.HTTPError, TokenError) as e:
+        return {"error": str(e), "details": e.response.text if hasattr(e, 'response') else None}
+
 @app.get("/delete-pdf")
-def delete_pdf(file_name):
+async def delete_pdf(file_name):
     try:
-        os.remove(file_name)
+        # Stored PDFs are reference counted and evicted under the disk quota
+        if await asyncio.to_thread(pdf_store.release, file_name):
+            return {"message": "PDF released successfully!"}
+
+        await asyncio.to_thread(os.remove, file_name)
         return {"message": "PDF deleted successfully!"}
     
     except Exception as e:
@@ -405,59 +538,542 @@ def delete_pdf(file_name):
 
 
 @app.get("/get-listings")
-def get_listings(shop_id=57595253):
+async def get_listings(shop_id=57595253):
     try:
-        # Load access token from .env file
-        with open('.env', 'r') as file:
-            lines = file.readlines()
-        
-        access_token = next(line for line in lines if line.startswith('ETSY_ACCESS_TOKEN=')).split('=')[1].strip()
-        
         # Get listings
-        listings_url = f'https://openapi.etsy.com/v3/application/shops/{shop_id}/listings'
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'x-api-key': CLIENT_ID
-        }
-
         data = {
             'state': 'draft'
         }
         
-        response = requests.get(listings_url, headers=headers, params=data)
-        response.raise_for_status()
-        
+        response = await etsy.get(f'/shops/{shop_id}/listings', params=data)
         listings = response.json()
         
         return listings
         
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, TokenError) as e:
         return {"error": str(e), "details": e.response.text if hasattr(e, 'response') else None}
 
 @app.get("/delete-listing")
-def delete_listing():
+async def delete_listing(listing_id: int = 1873814919):
     try:
-        # Load access token from .env file
-        with open('.env', 'r') as file:
-            lines = file.readlines()
-        
-        access_token = next(line for line in lines if line.startswith('ETSY_ACCESS_TOKEN=')).split('=')[1].strip()
-
-        delete_url = f'https://openapi.etsy.com/v3/application/listings/1873814919'
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'x-api-key': CLIENT_ID
-        }
-        
-        response = requests.delete(delete_url, headers=headers)
-        response.raise_for_status()
+        await etsy.delete(f'/listings/{listing_id}')
+        await asyncio.to_thread(listing_index.forget, listing_id)
+        await asyncio.to_thread(shop_mirror.remove, [listing_id])
         
         return {"message": "Listing deleted successfully!"}
         
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, TokenError) as e:
         return {"error": str(e), "details": e.response.text if hasattr(e, 'response') else None}
 
 
+@app.post("/mirror/sync")
+async def sync_mirror(shop_id=57595253, full: bool = False):
+    """Refresh the local shop mirror (full pull the first time, incremental afterwards)"""
+    try:
+        result = await shop_mirror.sync(etsy, shop_id, full=full)
+
+        # Listings deleted on Etsy must not be matched by the dedup index anymore
+        for listing_id in result["removed"]:
+            await asyncio.to_thread(listing_index.forget, listing_id)
+
+        return result
+
+    except (httpx.HTTPError, TokenError) as e:
+        return {"error": str(e), "details": e.response.text if hasattr(e, 'response') else None}
+
+@app.get("/mirror/listings")
+async def mirror_listings(
+    shop_id=57595253,
+    state: str = None,
+    q: str = None,
+    tag: str = None,
+    taxonomy_id: int = None,
+    min_price: float = None,
+    max_price: float = None,
+    sort: str = "updated",
+    limit: int = Query(100, le=1000),
+    offset: int = 0,
+):
+    """Filter and search listings from the local mirror, without calling Etsy"""
+    return await asyncio.to_thread(
+        shop_mirror.query, shop_id, state, q, tag, taxonomy_id, min_price, max_price, sort, limit, offset
+    )
+
+@app.get("/mirror/counts")
+async def mirror_counts(shop_id=57595253):
+    return await asyncio.to_thread(shop_mirror.counts, shop_id)
+
+
+class BulkFilter(BaseModel):
+    state: Optional[str] = None
+    q: Optional[str] = None
+    tag: Optional[str] = None
+    taxonomy_id: Optional[int] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+
+
+class BulkChanges(BaseModel):
+    price: Optional[float] = None
+    quantity: Optional[int] = None
+    tags: Optional[List[str]] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    materials: Optional[List[str]] = None
+    taxonomy_id: Optional[int] = None
+    should_auto_renew: Optional[bool] = None
+
+
+class BulkRequest(BaseModel):
+    shop_id: int = 57595253
+    operation: str
+    listing_ids: Optional[List[int]] = None
+    filter: Optional[BulkFilter] = None
+    changes: Optional[BulkChanges] = None
+    concurrency: Optional[int] = None
+    dry_run: bool = False
+
+
+@app.post("/listings/bulk")
+async def bulk_listings(request: BulkRequest):
+    """
+    Activate, deactivate, update or delete many listings at once. Listings are
+    given as ids or as a filter over the local shop mirror (sync it first).
+    """
+    if request.operation not in BULK_OPERATIONS:
+        return {"error": f"Unknown operation {request.operation}", "details": {"operations": BULK_OPERATIONS}}
+
+    filters = request.filter.model_dump(exclude_none=True) if request.filter else None
+    listing_ids = await resolve_listing_ids(request.shop_id, request.listing_ids, filters)
+    if not listing_ids:
+        return {"error": "No listings matched", "details": {"listing_ids": request.listing_ids, "filter": filters}}
+    if len(listing_ids) > BULK_MAX_LISTINGS:
+        return {"error": f"More than {BULK_MAX_LISTINGS} listings matched, narrow the filter"}
+    if request.dry_run:
+        return {"operation": request.operation, "total": len(listing_ids), "listing_ids": listing_ids}
+
+    changes = request.changes.model_dump(exclude_none=True) if request.changes else None
+    try:
+        kwargs = {"concurrency": request.concurrency} if request.concurrency else {}
+        return await run_bulk(etsy, request.shop_id, request.operation, listing_ids, changes, **kwargs)
+
+    except ValueError as e:
+        return {"error": str(e)}
+
+
+class PipelineError(Exception):
+    """Raised when a stage of the listing pipeline fails"""
+
+    def __init__(self, stage, message, details=None):
+        super().__init__(message)
+        self.stage = stage
+        self.details = details
+
+
+class PipelineRequest(BaseModel):
+    book_url: str
+    job_id: Optional[str] = None
+
+
+def _check_stage(stage, result):
+    # The endpoint helpers report failures as {"error": ...} instead of raising
+    if result is None:
+        raise PipelineError(stage, f"{stage} returned no result")
+    if isinstance(result, dict) and result.get("error"):
+        raise PipelineError(stage, result["error"], result.get("details"))
+    return result
+
+
+_pipeline_locks = {}
+
+
+async def run_listing_pipeline(book_url, on_stage=None, on_progress=None):
+    """
+    Run the whole listing flow for one book page on the server.
+
+    Independent stages overlap: the shop lookup runs alongside the scrape and
+    download, and the cover and PDF uploads run in parallel once the listing
+    exists. Book details come from the ISBN embedded in the downloaded PDF when
+    there is one, falling back to the scraped title.
+
+    With PDF_TRANSFER_MODE=stream the PDF link is only resolved up front and the
+    file is piped from pdfdrive into the Etsy upload without touching disk; the
+    title search then runs while the link is resolved.
+
+    `on_stage(name, status)` hears about stage transitions and
+    `on_progress(name)` may return a `progress(done, total)` callback for the
+    download and upload stages.
+    """
+    timings = {}
+
+    def notify(name, status):
+        if on_stage:
+            on_stage(name, status)
+
+    def reporter(name):
+        return on_progress(name) if on_progress else None
+
+    async def stage(name, func, *args, **kwargs):
+        notify(name, "started")
+        start = time.perf_counter()
+        outcome = "failed"
+        try:
+            with PIPELINE_STAGES_IN_FLIGHT.track(stage=name):
+                if asyncio.iscoroutinefunction(func):
+                    result = await func(*args, **kwargs)
+                else:
+                    result = await asyncio.to_thread(func, *args, **kwargs)
+            _check_stage(name, result)
+            outcome = "done"
+        except PipelineError as e:
+            notify(name, "failed")
+            logger.warning("Stage %s failed for %s: %s", name, book_url, e)
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            notify(name, "failed")
+            logger.warning("Stage %s failed for %s: %s", name, book_url, e)
+            raise PipelineError(name, str(e)) from e
+        finally:
+            PIPELINE_STAGES.observe(time.perf_counter() - start, stage=name, outcome=outcome)
+        timings[name] = round(time.perf_counter() - start, 3)
+        logger.info("Stage %s done in %.3fs", name, timings[name])
+        notify(name, "done")
+        return result
+
+    def resume(name, step):
+        logger.info("Stage %s skipped, step %s was checkpointed", name, step)
+        notify(name, "resumed")
+
+    async def checkpoint(step, output):
+        await asyncio.to_thread(pipeline_checkpoints.save_step, run["run_id"], step, output)
+        done[step] = output
+
+    async def upload(step, name, func, *args):
+        if step in done:
+            resume(name, step)
+            return done[step]
+        result = await stage(name, func, *args)
+        await checkpoint(step, result)
+        return result
+
+    started = time.perf_counter()
+
+    streaming = PDF_TRANSFER_MODE == "stream"
+    mode = "stream" if streaming else "file"
+
+    # One run per book URL at a time; a retry joins the checkpointed run instead of starting over
+    async with _keyed_lock(_pipeline_locks, book_url):
+        run = await asyncio.to_thread(pipeline_checkpoints.open_run, book_url)
+        done = run["steps"]
+        resumed_steps = [step for step in CHECKPOINT_STEPS if step in done]
+
+        user_task = None
+        pdf_task = None
+        upload_tasks = []
+        pdf = None
+        try:
+            # Step 1: Look up the shop (unless the listing exists already) while the book is scraped and downloaded
+            if "listed" not in done:
+                user_task = asyncio.create_task(stage("get_user", get_user))
+
+            downloaded = done.get("downloaded")
+            if downloaded and downloaded["mode"] != mode:
+                downloaded = None
+            if downloaded and not streaming and "file_uploaded" not in done:
+                # The checkpoint names the stored file; take a fresh reference, or download again if it was evicted
+                pdf = await asyncio.to_thread(pdf_store.acquire, url=book_url)
+                if not pdf:
+                    downloaded = None
+
+            if downloaded:
+                resume("scrape_page", "downloaded")
+                title = downloaded["title"]
+                page = downloaded.get("page")
+            else:
+                page = await stage("scrape_page", scrape_book_page, book_url)
+                title = page["title"]
+                if not title:
+                    raise PipelineError("scrape_page", "No title found on the book page")
+                if not streaming:
+                    pdf_task = asyncio.create_task(
+                        stage("download_pdf", download_pdf_from_page, page, reporter("download_pdf"))
+                    )
+
+            # In stream mode the download link is (re-)resolved right before the upload needs it
+            if streaming and "file_uploaded" not in done:
+                pdf_task = asyncio.create_task(stage("resolve_pdf", resolve_download, page))
+
+            if not downloaded:
+                if not streaming:
+                    pdf = await pdf_task
+                await checkpoint("downloaded", {"mode": mode, "title": title, "page": page if streaming else None,
+                                                "pdf": pdf})
+
+            # Step 2: Search book details. In file mode the PDF is read first, so the lookup is an
+            # exact (cached) ISBN query instead of a fuzzy title search
+            if "resolved" in done:
+                resume("search_book", "resolved")
+                book = done["resolved"]
+            else:
+                if streaming:
+                    book = await stage("search_book", _pipeline_book, title)
+                else:
+                    book = await stage("search_book", _pipeline_book, title, file_name=pdf)
+                await checkpoint("resolved", book)
+
+            # Step 3: Generate description
+            if "described" in done:
+                resume("generate_description", "described")
+                description = done["described"]
+            else:
+                description = await stage(
+                    "generate_description",
+                    generate_description,
+                    title=book.get("title", title),
+                    authors=book.get("authors"),
+                    publish_year=book.get("publish_year"),
+                    publishers=book.get("publishers"),
+                    subjects=book.get("subjects"),
+                    languages=book.get("language"),
+                    category=None,
+                    language=None,
+                    version=None,
+                )
+                await checkpoint("described", description)
+
+            # Step 4: Create the listing once the PDF is available, so a failed download leaves no draft behind
+            if streaming and pdf_task:
+                pdf = await pdf_task
+            if "listed" in done:
+                resume("create_listing", "listed")
+                listing = done["listed"]
+            else:
+                user = await user_task
+                listing = await stage(
+                    "create_listing",
+                    create_listing,
+                    user["shop_id"],
+                    title,
+                    description["description"],
+                    source_url=book_url,
+                    isbn=book.get("isbn_13") or book.get("isbn_10"),
+                    subjects=book.get("subjects"),
+                )
+                listing = {**listing, "shop_id": user["shop_id"]}
+                await checkpoint("listed", listing)
+            shop_id = listing["shop_id"]
+
+            if listing.get("existing"):
+                # An earlier run listed this book already; whatever it uploaded isn't uploaded again
+                uploaded = await asyncio.to_thread(pipeline_checkpoints.uploads, listing["listing_id"])
+                for step, output in uploaded.items():
+                    if step not in done:
+                        await checkpoint(step, output)
+
+            # Step 5: Upload the cover image and the PDF file in parallel, checkpointing each on success
+            upload_file = upload_listing_file_stream if streaming else _upload_listing_file
+            upload_tasks.append(asyncio.create_task(
+                upload("file_uploaded", "upload_file", upload_file, shop_id, listing["listing_id"], pdf,
+                       reporter("upload_file"))
+            ))
+            if book.get("cover_image"):
+                upload_tasks.append(asyncio.create_task(
+                    upload("image_uploaded", "upload_image", upload_listing_image, shop_id, listing["listing_id"],
+                           book["cover_image"])
+                ))
+            # Let both uploads finish so whichever succeeded is checkpointed, then report the failure
+            results = await asyncio.gather(*upload_tasks, return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            if not book.get("cover_image"):
+                await checkpoint("image_uploaded", {"image_id": None})
+
+            # Step 6: Clean up the downloaded PDF
+            if not streaming and pdf:
+                await delete_pdf(pdf)
+                pdf = None
+            await checkpoint("cleaned", {})
+            await asyncio.to_thread(pipeline_checkpoints.finish, run["run_id"])
+
+        except PipelineError as e:
+            if e.stage == "resolve_pdf" and downloaded:
+                # The checkpointed pdfdrive session went stale; scrape the page again next time
+                await asyncio.to_thread(pipeline_checkpoints.forget_step, run["run_id"], "downloaded")
+            await asyncio.to_thread(pipeline_checkpoints.fail, run["run_id"], e.stage, str(e))
+            raise
+
+        except asyncio.CancelledError:
+            if progress_tracker.cancel_requested():
+                # Cancelled on request, not by a shutdown: don't resume it at startup, and drop the partial download
+                await asyncio.to_thread(pipeline_checkpoints.fail, run["run_id"], "cancelled", "Cancelled on request")
+                await asyncio.to_thread(pdf_store.discard_partial, book_url)
+            raise
+
+        finally:
+            pending = [task for task in (pdf_task, user_task, *upload_tasks) if task]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            # Drop our reference to the PDF when a later stage failed; a retry takes a new one from the store
+            if pdf and not streaming:
+                await delete_pdf(pdf)
+
+    timings["total"] = round(time.perf_counter() - started, 3)
+    return {
+        "run_id": run["run_id"],
+        "resumed_steps": resumed_steps,
+        "listing_id": listing["listing_id"],
+        "existing_listing": listing.get("existing", False),
+        "shop_id": shop_id,
+        "title": title,
+        "book": book,
+        "file": results[0],
+        "image": results[1] if len(results) > 1 else None,
+        "timings": timings,
+    }
+
+
+@app.post("/listings/pipeline")
+async def listing_pipeline(request: PipelineRequest):
+    job_id = request.job_id
+    try:
+        return await run_tracked(job_id, lambda: run_listing_pipeline(
+            request.book_url,
+            on_stage=lambda name, status: progress_tracker.stage(job_id, name, status),
+            on_progress=lambda name: progress_tracker.reporter(job_id, name),
+        ))
+
+    except PipelineError as e:
+        return {"error": str(e), "stage": e.stage, "details": e.details}
+
+    except JobCancelled as e:
+        return {"error": str(e), "cancelled": True}
+
+
+job_queue = JobQueue(run_listing_pipeline)
+
+
+class BatchRequest(BaseModel):
+    book_urls: List[str]
+
+
+@app.post("/jobs/batch")
+async def create_batch_job(request: BatchRequest):
+    if not request.book_urls:
+        return {"error": "No book URLs given"}
+
+    job = job_queue.submit(request.book_urls)
+    return {"job_id": job["id"], "total": len(job["items"])}
+
+
+crawler = Crawler(job_queue.submit)
+
+
+class CrawlRequest(BaseModel):
+    queries: List[str] = []
+    urls: List[str] = []
+    max_pages: int = CRAWL_MAX_PAGES
+
+
+@app.post("/crawl")
+async def start_crawl(request: CrawlRequest):
+    """
+    Crawl pdfdrive search results for `queries` and the given search/category
+    `urls`; every book found is queued for batch ingestion (see /jobs).
+    """
+    seeds = [search_url(query) for query in request.queries] + request.urls
+    if not seeds:
+        return {"error": "No queries or URLs given"}
+    try:
+        return await crawler.start(seeds, request.max_pages)
+    except RuntimeError as e:
+        return {"error": str(e), "details": crawler.status()}
+
+
+@app.get("/crawl")
+async def crawl_status():
+    return await asyncio.to_thread(crawler.status)
+
+
+@app.post("/crawl/stop")
+async def stop_crawl():
+    await crawler.stop(finished=True)
+    return await asyncio.to_thread(crawler.status)
+
+
+@app.get("/jobs")
+async def list_jobs():
+    return {"jobs": job_queue.summaries()}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if not job:
+        return {"error": f"Job {job_id} not found"}
+    return job
+
+
+@app.get("/progress/{job_id}")
+async def stream_progress(job_id: str, request: Request):
+    """
+    Server-sent events for a job: "stage" transitions, byte-level "progress",
+    per-item results for batch jobs and a final "end". Reconnecting clients
+    send Last-Event-ID and only get what they missed.
+    """
+    after = int(request.headers.get("last-event-id") or 0)
+
+    async def events():
+        async for message in progress_tracker.subscribe(job_id, after):
+            if message is None:
+                # Comment line: keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                continue
+            yield f"id: {message['id']}\nevent: {message['event']}\ndata: {json.dumps(message)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/progress/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Abort a job's in-flight downloads and uploads; batch jobs also skip their queued items"""
+    if not progress_tracker.cancel(job_id):
+        return {"error": f"Job {job_id} is not running"}
+    return {"job_id": job_id, "cancelled": True}
+
+
+@app.get("/pipelines")
+async def list_pipeline_runs(status: str = None, limit: int = Query(100, le=1000)):
+    """Checkpointed listing runs, most recently updated first"""
+    return {"runs": await asyncio.to_thread(pipeline_checkpoints.runs, status, limit)}
+
+
+@app.get("/pipelines/{run_id}")
+async def get_pipeline_run(run_id: str):
+    run = await asyncio.to_thread(pipeline_checkpoints.get, run_id)
+    if not run:
+        return {"error": f"Run {run_id} not found"}
+    return run
+
+
+@app.post("/pipelines/{run_id}/resume")
+async def resume_pipeline_run(run_id: str):
+    """Continue a failed run from its last completed step"""
+    run = await asyncio.to_thread(pipeline_checkpoints.get, run_id)
+    if not run:
+        return {"error": f"Run {run_id} not found"}
+    if run["status"] == "done":
+        return {"error": f"Run {run_id} already finished"}
+    try:
+        return await run_listing_pipeline(run["book_url"])
+
+    except PipelineError as e:
+        return {"error": str(e), "stage": e.stage, "details": e.details}
 
 
 if __name__ == "__main__":
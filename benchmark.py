@@ -0,0 +1,228 @@
+"""
+Offline benchmark: runs the app against local fakes of Etsy, Open Library and
+pdfdrive and measures throughput, latency percentiles and peak RSS at
+increasing concurrency.
+
+    python benchmark.py --scenario pipeline --concurrency 1,4,16 --requests 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from fake_services import FakeServices, FakeSettings
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """Current resident set size of `pid` (Linux /proc only)"""
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class AppProcess:
+    """The real app under uvicorn in a subprocess, with its state kept in a temp dir"""
+
+    def __init__(self, env: Dict[str, str], workdir: str):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.workdir = workdir
+        self.env = {
+            **os.environ,
+            **env,
+            "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])),
+            "ETSY_CLIENT_ID": "benchmark",
+            "LOG_LEVEL": "WARNING",
+            "OPENLIBRARY_CACHE_PATH": os.path.join(workdir, "openlibrary_cache.db"),
+            "LISTING_INDEX_PATH": os.path.join(workdir, "listing_index.db"),
+            "SHOP_MIRROR_PATH": os.path.join(workdir, "shop_mirror.db"),
+            "PDF_STORE_DIR": os.path.join(workdir, "pdf_store"),
+            "COVER_CACHE_DIR": os.path.join(workdir, "cover_cache"),
+        }
+        self.process: Optional[subprocess.Popen] = None
+
+    def start(self, timeout: float = 30.0) -> "AppProcess":
+        # A valid, far-from-expiry token so no OAuth round trip is needed
+        with open(os.path.join(self.workdir, ".env"), "w") as file:
+            file.write(f"ETSY_ACCESS_TOKEN=benchmark\nETSY_TOKEN_EXPIRES_AT={int(time.time()) + 86400}\n")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--log-level", "warning", "--no-access-log"],
+            cwd=self.workdir, env=self.env,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"App exited with code {self.process.returncode}")
+            try:
+                httpx.get(f"{self.url}/search-book/cache-stats", timeout=1.0)
+                return self
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        raise RuntimeError("App did not start in time")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def scenario_request(scenario: str, services: FakeServices, index: int) -> Dict[str, Any]:
+    """Method, path and body for request `index`; book ids are unique so caches don't hide the work"""
+    book_id = 100000 + index
+    if scenario == "pipeline":
+        return {"method": "POST", "url": "/listings/pipeline", "json": {"book_url": services.book_url(book_id)}}
+    if scenario == "search-book":
+        return {"method": "GET", "url": "/search-book", "params": {"title": f"Benchmark Book {book_id}"}}
+    if scenario == "get-book-pdf":
+        return {"method": "GET", "url": "/get-book-pdf", "params": {"book_url": services.book_url(book_id)}}
+    if scenario == "get-user":
+        return {"method": "GET", "url": "/get-user"}
+    if scenario == "generate-description":
+        return {"method": "GET", "url": "/generate-description",
+                "params": {"title": f"Benchmark Book {book_id}", "authors": "Fake Author", "subjects": "Fiction"}}
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+SCENARIOS = ("pipeline", "search-book", "get-book-pdf", "get-user", "generate-description")
+
+
+async def run_level(app: AppProcess, services: FakeServices, scenario: str, concurrency: int, total: int,
+                    offset: int) -> Dict[str, Any]:
+    """Closed loop: `concurrency` workers send `total` requests between them"""
+    latencies: List[float] = []
+    errors = 0
+    peak_rss = rss_bytes(app.process.pid) or 0
+    next_index = iter(range(offset, offset + total))
+    done = asyncio.Event()
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while not done.is_set():
+            peak_rss = max(peak_rss, rss_bytes(app.process.pid) or 0)
+            await asyncio.sleep(0.05)
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for index in next_index:
+            request = scenario_request(scenario, services, index)
+            start = time.perf_counter()
+            try:
+                response = await client.request(**request)
+                # Handlers report failures in the body rather than the status code
+                if response.status_code >= 400 or (response.headers.get("content-type", "").startswith(
+                        "application/json") and isinstance(response.json(), dict) and "error" in response.json()):
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=app.url, timeout=300.0, limits=limits) as client:
+        sampler = asyncio.create_task(sample_rss())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await sampler
+
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 1) if peak_rss else None,
+    }
+
+
+def print_table(results: List[Dict[str, Any]]):
+    columns = ("scenario", "concurrency", "requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms",
+               "peak_rss_mb")
+    widths = {column: max(len(column), *(len(str(row[column])) for row in results)) for column in columns}
+    print("  ".join(column.rjust(widths[column]) for column in columns))
+    for row in results:
+        print("  ".join(str(row[column]).rjust(widths[column]) for column in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="Endpoint to drive (repeatable, default: pipeline)")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--latency", type=float, default=0.05, help="Added latency per fake response (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- random latency per fake response (s)")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Etsy fake requests/second before 429s")
+    parser.add_argument("--fail-every", type=int, default=0, help="Make every Nth Etsy call a 503")
+    parser.add_argument("--pdf-size", type=int, default=2 * 1024 * 1024, help="PDF size in bytes")
+    parser.add_argument("--cover-size", type=int, default=800, help="Cover width in pixels")
+    parser.add_argument("--page-size", type=int, default=60 * 1024, help="Padding of fake HTML pages in bytes")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    settings = FakeSettings(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                            fail_every=args.fail_every, pdf_size=args.pdf_size, cover_size=args.cover_size,
+                            page_padding=args.page_size)
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    results = []
+
+    with FakeServices(settings) as services, tempfile.TemporaryDirectory(prefix="booking-bench-") as workdir:
+        app = AppProcess(services.env(), workdir).start()
+        try:
+            offset = 0
+            for scenario in args.scenario or ["pipeline"]:
+                for concurrency in levels:
+                    results.append(asyncio.run(
+                        run_level(app, services, scenario, concurrency, args.requests, offset)
+                    ))
+                    offset += args.requests
+        finally:
+            app.stop()
+
+    print_table(results)
+    print(f"\nfake calls: etsy={services.etsy.calls} (429s: {services.etsy.rate_limited}) "
+          f"openlibrary={services.openlibrary.calls} pdfdrive={services.pdfdrive.calls}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"settings": vars(args), "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
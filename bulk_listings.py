@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from listing_index import listing_index
+from shop_mirror import shop_mirror
+from tokens import TokenError
+
+# Listings worked on at once; every call still waits on the Etsy client's token bucket
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", 8))
+BULK_MAX_LISTINGS = int(os.getenv("BULK_MAX_LISTINGS", 1000))
+
+logger = logging.getLogger("booking")
+
+OPERATIONS = ("activate", "deactivate", "update", "delete")
+
+# Fields `update` may change with updateListing; price and quantity live in the listing's inventory
+LISTING_FIELDS = ("title", "description", "tags", "materials", "taxonomy_id", "should_auto_renew")
+
+
+def _price_value(price: Any) -> Any:
+    if isinstance(price, dict) and price.get("divisor"):
+        return price["amount"] / price["divisor"]
+    return price
+
+
+def _inventory_payload(inventory: Dict[str, Any], price: Optional[float], quantity: Optional[int]) -> Dict[str, Any]:
+    """Turn a getListingInventory response into an updateListingInventory body with the new price/quantity"""
+    products = []
+    for product in inventory.get("products", []):
+        offerings = []
+        for offering in product.get("offerings", []):
+            if offering.get("is_deleted"):
+                continue
+            offerings.append({
+                "price": price if price is not None else _price_value(offering.get("price")),
+                "quantity": quantity if quantity is not None else offering.get("quantity"),
+                "is_enabled": offering.get("is_enabled", True),
+            })
+        products.append({
+            "sku": product.get("sku") or "",
+            "property_values": [
+                {key: value for key, value in prop.items() if key in (
+                    "property_id", "value_ids", "scale_id", "property_name", "values")}
+                for prop in product.get("property_values", [])
+            ],
+            "offerings": offerings,
+        })
+    return {
+        "products": products,
+        "price_on_property": inventory.get("price_on_property", []),
+        "quantity_on_property": inventory.get("quantity_on_property", []),
+        "sku_on_property": inventory.get("sku_on_property", []),
+    }
+
+
+async def resolve_listing_ids(shop_id, listing_ids: Optional[List[int]] = None,
+                              filters: Optional[Dict[str, Any]] = None) -> List[int]:
+    """Explicit ids as given, or every mirrored listing matching `filters` (see `ShopMirror.query`)"""
+    if listing_ids:
+        return list(dict.fromkeys(int(listing_id) for listing_id in listing_ids))
+    if not filters:
+        return []
+    result = await asyncio.to_thread(
+        shop_mirror.query, shop_id, filters.get("state"), filters.get("q"), filters.get("tag"),
+        filters.get("taxonomy_id"), filters.get("min_price"), filters.get("max_price"), "updated",
+        BULK_MAX_LISTINGS + 1, 0,
+    )
+    return [listing["listing_id"] for listing in result["results"]]
+
+
+async def _apply(etsy, shop_id, operation: str, listing_id: int, changes: Dict[str, Any]) -> Dict[str, Any]:
+    if operation == "delete":
+        await etsy.delete(f'/listings/{listing_id}')
+        await asyncio.to_thread(listing_index.forget, listing_id)
+        await asyncio.to_thread(shop_mirror.remove, [listing_id])
+        return {}
+
+    data = {field: changes[field] for field in LISTING_FIELDS if changes.get(field) is not None}
+    if operation == "activate":
+        data["state"] = "active"
+    elif operation == "deactivate":
+        data["state"] = "inactive"
+
+    listing = None
+    if data:
+        response = await etsy.patch(f'/shops/{shop_id}/listings/{listing_id}', json=data)
+        listing = response.json()
+
+    if operation == "update" and (changes.get("price") is not None or changes.get("quantity") is not None):
+        response = await etsy.get(f'/listings/{listing_id}/inventory')
+        payload = _inventory_payload(response.json(), changes.get("price"), changes.get("quantity"))
+        await etsy.put(f'/listings/{listing_id}/inventory', json=payload)
+        listing = (await etsy.get(f'/listings/{listing_id}')).json()
+
+    if listing:
+        # Keep the local mirror in step so filters see the change without a sync
+        await asyncio.to_thread(shop_mirror.upsert, shop_id, [listing], time.time())
+    return {"state": listing.get("state")} if listing else {}
+
+
+async def run_bulk(etsy, shop_id, operation: str, listing_ids: List[int], changes: Optional[Dict[str, Any]] = None,
+                   concurrency: int = BULK_CONCURRENCY) -> Dict[str, Any]:
+    """
+    Apply one operation to many listings with at most `concurrency` in flight.
+
+    A failed listing doesn't stop the rest; every listing gets its own result.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown operation {operation}, expected one of {', '.join(OPERATIONS)}")
+    changes = changes or {}
+    if operation == "update" and not any(changes.get(field) is not None
+                                         for field in (*LISTING_FIELDS, "price", "quantity")):
+        raise ValueError("Nothing to update")
+
+    started = time.time()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(listing_id):
+        async with semaphore:
+            try:
+                result = await _apply(etsy, shop_id, operation, listing_id, changes)
+                return {"listing_id": listing_id, "status": "ok", **result}
+            except (httpx.HTTPError, TokenError) as e:
+                return {"listing_id": listing_id, "status": "failed", "error": str(e),
+                        "details": e.response.text if hasattr(e, 'response') else None}
+            except Exception as e:
+                # Anything else (a bad payload, an unexpected response) fails this listing, not the batch
+                logger.exception("Bulk %s of listing %s failed", operation, listing_id)
+                return {"listing_id": listing_id, "status": "failed", "error": f"{type(e).__name__}: {e}",
+                        "details": None}
+
+    results = await asyncio.gather(*(one(listing_id) for listing_id in listing_ids))
+    succeeded = sum(1 for result in results if result["status"] == "ok")
+    return {
+        "operation": operation,
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "duration": round(time.time() - started, 3),
+        "results": results,
+    }
@@ -0,0 +1,146 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+PIPELINE_CHECKPOINT_PATH = os.getenv("PIPELINE_CHECKPOINT_PATH", "pipeline_checkpoints.db")
+
+# The listing pipeline's state machine, in order. A run's state is the last step it completed.
+STEPS = ("downloaded", "resolved", "described", "listed", "image_uploaded", "file_uploaded", "cleaned")
+
+
+class PipelineCheckpoints:
+    """
+    SQLite record of listing pipeline runs and the output of every completed step.
+
+    A run stays open until its last step ("cleaned") is checkpointed. Starting
+    the pipeline again for the same book URL picks the open run back up, so
+    steps that already finished (download, Open Library lookup, listing
+    creation, uploads) are not repeated. Runs left "running" by a server stop
+    are reported by `interrupted` so they can be resumed at startup.
+    """
+
+    def __init__(self, path: str = PIPELINE_CHECKPOINT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "run_id TEXT PRIMARY KEY, book_url TEXT NOT NULL, state TEXT NOT NULL, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL, error_stage TEXT, error TEXT, created_at REAL NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS runs_book_url ON runs (book_url, status)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS steps ("
+                "run_id TEXT NOT NULL, step TEXT NOT NULL, output TEXT NOT NULL, completed_at REAL NOT NULL, "
+                "PRIMARY KEY (run_id, step))"
+            )
+        return self._db
+
+    def _run(self, row: sqlite3.Row) -> Dict[str, Any]:
+        steps = self.db.execute(
+            "SELECT step, output FROM steps WHERE run_id = ?", (row["run_id"],)
+        ).fetchall()
+        return {**dict(row), "steps": {step["step"]: json.loads(step["output"]) for step in steps}}
+
+    def open_run(self, book_url: str) -> Dict[str, Any]:
+        """Resume the open run for `book_url`, or start a new one"""
+        now = time.time()
+        with self._lock:
+            row = self.db.execute(
+                "SELECT * FROM runs WHERE book_url = ? AND status != 'done' ORDER BY created_at DESC LIMIT 1",
+                (book_url,),
+            ).fetchone()
+            if row:
+                self.db.execute(
+                    "UPDATE runs SET status = 'running', attempts = attempts + 1, error_stage = NULL, error = NULL, "
+                    "updated_at = ? WHERE run_id = ?",
+                    (now, row["run_id"]),
+                )
+                run_id = row["run_id"]
+            else:
+                run_id = uuid.uuid4().hex
+                self.db.execute(
+                    "INSERT INTO runs (run_id, book_url, state, status, attempts, created_at, updated_at) "
+                    "VALUES (?, ?, 'pending', 'running', 1, ?, ?)",
+                    (run_id, book_url, now, now),
+                )
+            return self._run(self.db.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone())
+
+    def save_step(self, run_id: str, step: str, output: Dict[str, Any]):
+        if step not in STEPS:
+            raise ValueError(f"Unknown pipeline step {step}")
+        now = time.time()
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO steps (run_id, step, output, completed_at) VALUES (?, ?, ?, ?)",
+                (run_id, step, json.dumps(output), now),
+            )
+            completed = {row[0] for row in self.db.execute("SELECT step FROM steps WHERE run_id = ?", (run_id,))}
+            # Uploads finish in either order; the state is the furthest step reached
+            state = next(step for step in reversed(STEPS) if step in completed)
+            self.db.execute("UPDATE runs SET state = ?, updated_at = ? WHERE run_id = ?", (state, now, run_id))
+
+    def forget_step(self, run_id: str, step: str):
+        """Drop a checkpoint whose output turned out to be unusable, so the step runs again"""
+        with self._lock:
+            self.db.execute("DELETE FROM steps WHERE run_id = ? AND step = ?", (run_id, step))
+
+    def fail(self, run_id: str, stage: str, error: str):
+        with self._lock:
+            self.db.execute(
+                "UPDATE runs SET status = 'failed', error_stage = ?, error = ?, updated_at = ? WHERE run_id = ?",
+                (stage, error, time.time(), run_id),
+            )
+
+    def finish(self, run_id: str):
+        with self._lock:
+            self.db.execute(
+                "UPDATE runs SET status = 'done', updated_at = ? WHERE run_id = ?", (time.time(), run_id)
+            )
+
+    def uploads(self, listing_id: int) -> Dict[str, Any]:
+        """Upload steps any run already completed for `listing_id`, with their output"""
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT uploads.step, uploads.output FROM steps AS listed "
+                "JOIN steps AS uploads ON uploads.run_id = listed.run_id "
+                "WHERE listed.step = 'listed' AND json_extract(listed.output, '$.listing_id') = ? "
+                "AND uploads.step IN ('image_uploaded', 'file_uploaded') ORDER BY uploads.completed_at",
+                (listing_id,),
+            ).fetchall()
+        return {row["step"]: json.loads(row["output"]) for row in rows}
+
+    def get(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.db.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            return self._run(row) if row else None
+
+    def runs(self, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        query = "SELECT * FROM runs"
+        params: List[Any] = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY updated_at DESC LIMIT ?"
+        params.append(int(limit))
+        with self._lock:
+            return [dict(row) for row in self.db.execute(query, params)]
+
+    def interrupted(self) -> List[Dict[str, Any]]:
+        """Runs that were still going when the process stopped"""
+        return self.runs(status="running", limit=-1)
+
+
+pipeline_checkpoints = PipelineCheckpoints()
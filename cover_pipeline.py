@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import io
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import httpx
+
+from metrics import outbound, register_cache
+
+# Pillow does the decode / resize / re-encode; without it covers are uploaded as downloaded
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+COVER_CACHE_DIR = os.getenv("COVER_CACHE_DIR", "cover_cache")
+
+# Etsy recommends listing images around 2000px; covers are scaled so their longest side matches
+COVER_SIZE = int(os.getenv("COVER_SIZE", 2000))
+COVER_QUALITY = int(os.getenv("COVER_QUALITY", 85))
+COVER_WORKERS = int(os.getenv("COVER_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+
+OPENLIBRARY_COVER = re.compile(r"/b/(id|isbn|olid)/([^/-]+)-([SML])\.jpg")
+
+
+def process_cover(data: bytes, size: int = COVER_SIZE, quality: int = COVER_QUALITY) -> bytes:
+    """
+    Decode, resize (longest side to `size`) and recompress a cover as a
+    progressive JPEG. Runs in a worker process, so it must stay importable
+    and picklable at module level.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        scale = size / max(image.size)
+        if scale != 1:
+            image = image.resize(
+                (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                Image.LANCZOS,
+            )
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, optimize=True, progressive=True)
+        return output.getvalue()
+
+
+class CoverPipeline:
+    """
+    Download, resize and cache listing covers.
+
+    The CPU-heavy image work runs in a `ProcessPoolExecutor` so it never blocks
+    the event loop. Processed covers are cached on disk keyed by cover id and
+    target size, so a repeated cover skips both the download and the re-encode.
+    """
+
+    def __init__(self, cache_dir: str = COVER_CACHE_DIR, size: int = COVER_SIZE, quality: int = COVER_QUALITY,
+                 workers: int = COVER_WORKERS):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.quality = quality
+        self.workers = workers
+        self.stats = {"hits": 0, "misses": 0, "processed": 0}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(follow_redirects=True, timeout=30.0)
+        return self._client
+
+    def cache_key(self, image_url: str) -> str:
+        match = OPENLIBRARY_COVER.search(image_url)
+        source = f"{match.group(1)}-{match.group(2)}-{match.group(3)}" if match else \
+            hashlib.sha256(image_url.encode()).hexdigest()[:32]
+        return f"{source}-{self.size}-q{self.quality}" if Image else f"{source}-original"
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.jpg")
+
+    def _read_cache(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._cache_path(key), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_cache(self, key: str, data: bytes):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=self.cache_dir)
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, self._cache_path(key))
+
+    async def _build(self, image_url: str, key: str) -> bytes:
+        # Get image data directly from URL
+        with outbound("covers", "download") as call:
+            response = await self.client.get(image_url)
+            call["status"] = response.status_code
+            call["bytes_received"] = len(response.content)
+        response.raise_for_status()
+        data = response.content
+
+        if Image is not None:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self.executor, process_cover, data, self.size, self.quality)
+            self.stats["processed"] += 1
+
+        await asyncio.to_thread(self._write_cache, key, data)
+        return data
+
+    async def prepare(self, image_url: str) -> bytes:
+        """Return upload-ready JPEG bytes for `image_url`, from the cache when possible"""
+        key = self.cache_key(image_url)
+        cached = await asyncio.to_thread(self._read_cache, key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return cached
+
+        # Concurrent requests for the same cover share one download and encode
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        self.stats["misses"] += 1
+        future = asyncio.ensure_future(self._build(image_url, key))
+        self._inflight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                self._inflight.pop(key, None)
+            else:
+                future.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+cover_pipeline = CoverPipeline()
+register_cache("covers", lambda: (cover_pipeline.stats["hits"], cover_pipeline.stats["misses"]))
@@ -0,0 +1,409 @@
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urldefrag, urlencode, urljoin, urlsplit
+from urllib.robotparser import RobotFileParser
+
+import httpx
+from bs4 import BeautifulSoup, SoupStrainer
+
+from metrics import outbound
+from scraper import HTML_PARSER, PDFDRIVE_BASE, USER_AGENT, _client, _headers, fetch_parsed
+
+CRAWL_STATE_PATH = os.getenv("CRAWL_STATE_PATH", "crawler.db")
+
+# Politeness: listing pages fetched at once per host, and the pause between two requests to one host
+CRAWL_HOST_CONCURRENCY = int(os.getenv("CRAWL_HOST_CONCURRENCY", 2))
+CRAWL_DELAY = float(os.getenv("CRAWL_DELAY", 1.0))
+CRAWL_WORKERS = int(os.getenv("CRAWL_WORKERS", 4))
+
+# Listing pages fetched per crawl, and book URLs handed to batch ingestion per job
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", 500))
+CRAWL_BATCH_SIZE = int(os.getenv("CRAWL_BATCH_SIZE", 25))
+
+# Sizing of the seen-URL Bloom filter (about 1.8 MB at the defaults)
+CRAWL_BLOOM_CAPACITY = int(os.getenv("CRAWL_BLOOM_CAPACITY", 1_000_000))
+CRAWL_BLOOM_ERROR = float(os.getenv("CRAWL_BLOOM_ERROR", 0.001))
+
+# How often (in listing pages) the Bloom filter is written back to the state file
+CHECKPOINT_EVERY = 20
+
+# Attempts per listing page when the host answers 429/503
+PAGE_ATTEMPTS = 3
+
+# pdfdrive book pages end in "-e<id>.html"; search and category pages list them
+BOOK_PATH = re.compile(r"/[^/]+-e\d+\.html$")
+LISTING_PATH = re.compile(r"^/(search|category/\d+)")
+
+LINK_STRAINER = SoupStrainer('a')
+
+logger = logging.getLogger("booking")
+
+
+class BloomFilter:
+    """
+    Fixed-size set of seen URLs: no false negatives, `error` false positives at
+    `capacity` entries, a couple of bytes per URL instead of the URL itself.
+    """
+
+    def __init__(self, capacity: int = CRAWL_BLOOM_CAPACITY, error: float = CRAWL_BLOOM_ERROR,
+                 data: Optional[bytes] = None):
+        self.size = max(8, int(-capacity * math.log(error) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(data) if data and len(data) == (self.size + 7) // 8 else bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str) -> Iterable[int]:
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def add(self, value: str) -> bool:
+        """Add `value`; returns False when it was (probably) there already"""
+        added = False
+        for position in self._positions(value):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        return added
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.bits)
+
+
+def canonical_url(url: str) -> str:
+    """Drop the fragment and a trailing slash so the same page is only queued once"""
+    url = urldefrag(url)[0]
+    return url[:-1] if url.endswith("/") and urlsplit(url).path != "/" else url
+
+
+def search_url(query: str) -> str:
+    return f"{PDFDRIVE_BASE}/search?{urlencode({'q': query})}"
+
+
+def parse_listing_page(html: str, base_url: str) -> Dict[str, List[str]]:
+    """Book links and further listing pages (pagination, categories) on a search or category page"""
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=LINK_STRAINER)
+    host = urlsplit(base_url).netloc
+    books, pages = [], []
+    for link in soup.find_all('a', href=True):
+        url = canonical_url(urljoin(base_url, link['href']))
+        parts = urlsplit(url)
+        if parts.netloc != host or parts.scheme not in ("http", "https"):
+            continue
+        if BOOK_PATH.search(parts.path):
+            books.append(url)
+        elif LISTING_PATH.match(parts.path):
+            pages.append(url)
+    return {"books": list(dict.fromkeys(books)), "pages": list(dict.fromkeys(pages))}
+
+
+class CrawlState:
+    """
+    SQLite copy of the crawl: the frontier of listing pages still to fetch,
+    book URLs found but not yet handed to ingestion, and the Bloom filters of
+    pages seen by this crawl and of books seen by any crawl. Fetched pages
+    leave the frontier, so the file stays small.
+    """
+
+    def __init__(self, path: str = CRAWL_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS frontier ("
+                "url TEXT PRIMARY KEY, kind TEXT NOT NULL, added_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB)")
+        return self._db
+
+    def add(self, kind: str, urls: List[str]):
+        now = time.time()
+        with self._lock:
+            self.db.executemany("INSERT OR IGNORE INTO frontier VALUES (?, ?, ?)", [(url, kind, now) for url in urls])
+
+    def remove(self, urls: List[str]):
+        with self._lock:
+            self.db.executemany("DELETE FROM frontier WHERE url = ?", [(url,) for url in urls])
+
+    def pending(self, kind: str) -> List[str]:
+        with self._lock:
+            rows = self.db.execute("SELECT url FROM frontier WHERE kind = ? ORDER BY added_at", (kind,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set(self, **values: Any):
+        with self._lock:
+            self.db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", list(values.items()))
+
+    def reset(self):
+        """Forget the crawl, but not which books were already found: a new crawl only submits new ones"""
+        with self._lock:
+            self.db.execute("DELETE FROM frontier")
+            self.db.execute("DELETE FROM meta WHERE key != 'books_seen'")
+
+
+class HostLimiter:
+    """At most `concurrency` requests per host, started at least `delay` seconds apart"""
+
+    def __init__(self, concurrency: int = CRAWL_HOST_CONCURRENCY, delay: float = CRAWL_DELAY):
+        self.concurrency = max(1, concurrency)
+        self.delay = delay
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._next: Dict[str, float] = {}
+
+    def backoff(self, host: str, seconds: float):
+        """Push the host's next request out, e.g. after a 429/503 with Retry-After"""
+        self._next[host] = max(self._next.get(host, 0), time.monotonic() + seconds)
+
+    async def acquire(self, host: str):
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.concurrency))
+        await semaphore.acquire()
+        try:
+            async with self._locks.setdefault(host, asyncio.Lock()):
+                wait = self._next.get(host, 0) - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._next[host] = time.monotonic() + self.delay
+        except BaseException:
+            semaphore.release()
+            raise
+
+    def release(self, host: str):
+        self._semaphores[host].release()
+
+
+class Crawler:
+    """
+    Walks pdfdrive search and category pages and feeds every new book URL to
+    `submit` (batch ingestion) in groups of `batch_size`.
+
+    Listing pages are fetched by `workers` tasks through the scraper's page
+    fetch (conditional GETs, outbound metrics), within the per-host limits and
+    robots.txt. The frontier, unsubmitted book URLs and seen-URL filters are kept
+    in `CrawlState`, so a crawl cut short by a restart carries on with `resume`.
+    Listing pages are seen once per crawl; books once across all crawls.
+    """
+
+    def __init__(self, submit: Callable[[List[str]], Dict[str, Any]], state: Optional[CrawlState] = None,
+                 workers: int = CRAWL_WORKERS, batch_size: int = CRAWL_BATCH_SIZE,
+                 limiter: Optional[HostLimiter] = None):
+        self.submit = submit
+        self.state = state or CrawlState()
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.limiter = limiter or HostLimiter()
+        self.seen = BloomFilter()
+        self.books_seen = BloomFilter()
+        self.stats: Dict[str, Any] = {}
+        self.jobs: List[str] = []
+        self.max_pages = CRAWL_MAX_PAGES
+        self._books: List[str] = []
+        self._robots: Dict[str, Optional[RobotFileParser]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "max_pages": self.max_pages,
+            "frontier": len(self.state.pending("page")),
+            "unsubmitted_books": len(self._books),
+            "jobs": self.jobs,
+            **self.stats,
+        }
+
+    async def start(self, seeds: List[str], max_pages: int = CRAWL_MAX_PAGES) -> Dict[str, Any]:
+        """Start a new crawl from `seeds` (search or category page URLs), forgetting the previous one"""
+        if self.running:
+            raise RuntimeError("A crawl is already running")
+        # Books the previous crawl found but never submitted are already in the book filter; keep them queued
+        unsubmitted = await asyncio.to_thread(self.state.pending, "book")
+        await asyncio.to_thread(self.state.reset)
+        await asyncio.to_thread(self.state.add, "book", unsubmitted)
+        self.seen = BloomFilter()
+        self.books_seen = BloomFilter(data=await asyncio.to_thread(self.state.get, "books_seen"))
+        self._books = unsubmitted
+        self.jobs = []
+        self.max_pages = max_pages
+        self.stats = {"pages": 0, "failed_pages": 0, "books_found": 0, "books_submitted": 0,
+                      "duplicates": 0, "disallowed": 0, "started_at": time.time(), "finished_at": None}
+        seeds = [canonical_url(url) for url in seeds]
+        for url in seeds:
+            self.seen.add(url)
+        await asyncio.to_thread(self.state.add, "page", seeds)
+        await asyncio.to_thread(self.state.set, status="running", max_pages=max_pages)
+        self._task = asyncio.create_task(self._run())
+        return self.status()
+
+    async def resume(self) -> bool:
+        """Pick up a crawl the last shutdown interrupted; returns False when there is none"""
+        if self.running or await asyncio.to_thread(self.state.get, "status") != "running":
+            return False
+        self.seen = BloomFilter(data=await asyncio.to_thread(self.state.get, "seen"))
+        self.books_seen = BloomFilter(data=await asyncio.to_thread(self.state.get, "books_seen"))
+        self.max_pages = int(await asyncio.to_thread(self.state.get, "max_pages", CRAWL_MAX_PAGES))
+        self.stats = {"pages": int(await asyncio.to_thread(self.state.get, "pages", 0)), "failed_pages": 0,
+                      "books_found": 0, "books_submitted": 0, "duplicates": 0, "disallowed": 0,
+                      "started_at": time.time(), "finished_at": None}
+        # Book URLs found before the stop but never submitted go out first
+        self._books = await asyncio.to_thread(self.state.pending, "book")
+        for url in self._books:
+            self.books_seen.add(url)
+        self._task = asyncio.create_task(self._run())
+        return True
+
+    async def stop(self, finished: bool = False):
+        """Stop crawling. The state is kept (and resumed on the next start) unless `finished`"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if finished:
+            await asyncio.to_thread(self.state.set, status="stopped")
+
+    async def _allowed(self, client: httpx.AsyncClient, url: str) -> bool:
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        if origin not in self._robots:
+            robots = None
+            try:
+                with outbound("pdfdrive", "robots") as call:
+                    response = await client.get(f"{origin}/robots.txt", headers={'User-Agent': USER_AGENT})
+                    call["status"] = response.status_code
+                if response.status_code == 200:
+                    robots = RobotFileParser()
+                    robots.parse(response.text.splitlines())
+                    delay = robots.crawl_delay(USER_AGENT)
+                    if delay:
+                        self.limiter.delay = max(self.limiter.delay, float(delay))
+            except httpx.HTTPError:
+                pass
+            # No (readable) robots.txt means nothing is disallowed
+            self._robots[origin] = robots
+        robots = self._robots[origin]
+        return robots is None or robots.can_fetch(USER_AGENT, url)
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str) -> Optional[Dict[str, List[str]]]:
+        """The parsed page, or None when it failed; a throttled host is waited out and asked again"""
+        host = urlsplit(url).netloc
+        for attempt in range(PAGE_ATTEMPTS):
+            await self.limiter.acquire(host)
+            try:
+                return await fetch_parsed(client, url, _headers(PDFDRIVE_BASE),
+                                          lambda html: parse_listing_page(html, url), raise_for_status=True)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in (429, 503) or attempt == PAGE_ATTEMPTS - 1:
+                    logger.warning("Crawl of %s failed: %s", url, e)
+                    return None
+                retry_after = e.response.headers.get("Retry-After", "")
+                self.limiter.backoff(host, float(retry_after) if retry_after.isdigit() else 30.0 * (attempt + 1))
+            except httpx.HTTPError as e:
+                logger.warning("Crawl of %s failed: %s", url, e)
+                return None
+            finally:
+                self.limiter.release(host)
+        return None
+
+    async def _flush_books(self, force: bool = False):
+        while self._books and (force or len(self._books) >= self.batch_size):
+            batch, self._books = self._books[:self.batch_size], self._books[self.batch_size:]
+            job = self.submit(batch)
+            self.jobs.append(job["id"])
+            self.stats["books_submitted"] += len(batch)
+            await asyncio.to_thread(self.state.remove, batch)
+
+    async def _checkpoint(self):
+        await asyncio.to_thread(self.state.set, seen=self.seen.to_bytes(), books_seen=self.books_seen.to_bytes(),
+                                pages=self.stats["pages"])
+
+    async def _run(self):
+        queue: asyncio.Queue = asyncio.Queue()
+        for url in await asyncio.to_thread(self.state.pending, "page"):
+            queue.put_nowait(url)
+        await self._flush_books()
+
+        async def worker(client):
+            while True:
+                url = await queue.get()
+                try:
+                    await crawl(client, url)
+                except Exception:
+                    # A page that breaks the parser or the state file is one failed page, not a dead worker
+                    logger.exception("Crawl of %s failed", url)
+                    self.stats["failed_pages"] += 1
+                finally:
+                    queue.task_done()
+
+        async def crawl(client, url):
+            if self.stats["pages"] >= self.max_pages:
+                return
+            if not await self._allowed(client, url):
+                self.stats["disallowed"] += 1
+                await asyncio.to_thread(self.state.remove, [url])
+                return
+
+            # Step 1: Fetch and parse the listing page
+            found = await self._fetch(client, url)
+            self.stats["pages"] += 1
+            if found is None:
+                self.stats["failed_pages"] += 1
+                await asyncio.to_thread(self.state.remove, [url])
+                return
+
+            # Step 2: Keep what hasn't been seen; books and new pages are persisted before this page is dropped
+            books = [book for book in found["books"] if self.books_seen.add(book)]
+            pages = [page for page in found["pages"] if self.seen.add(page)]
+            self.stats["duplicates"] += len(found["books"]) + len(found["pages"]) - len(books) - len(pages)
+            self.stats["books_found"] += len(books)
+            await asyncio.to_thread(self.state.add, "book", books)
+            await asyncio.to_thread(self.state.add, "page", pages)
+            await asyncio.to_thread(self.state.remove, [url])
+            for page in pages:
+                queue.put_nowait(page)
+
+            # Step 3: Hand full batches to ingestion
+            self._books.extend(books)
+            await self._flush_books()
+            if self.stats["pages"] % CHECKPOINT_EVERY == 0:
+                await self._checkpoint()
+
+        async with _client() as client:
+            tasks = [asyncio.create_task(worker(client)) for _ in range(self.workers)]
+            try:
+                await queue.join()
+                await self._flush_books(force=True)
+                self.stats["finished_at"] = time.time()
+                await asyncio.to_thread(self.state.reset)
+                await asyncio.to_thread(self.state.set, status="done", books_seen=self.books_seen.to_bytes())
+                logger.info("Crawl finished: %d pages, %d books", self.stats["pages"], self.stats["books_found"])
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                if self.stats["finished_at"] is None:
+                    await self._checkpoint()
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from jinja2 import Environment, StrictUndefined
+
+from metrics import register_cache
+
+DESCRIPTION_TEMPLATE_VERSION = os.getenv("DESCRIPTION_TEMPLATE_VERSION", "v1")
+DESCRIPTION_CACHE_SIZE = int(os.getenv("DESCRIPTION_CACHE_SIZE", 10000))
+
+MISSING = ("", "N/A", "Unknown", None)
+
+# Templates keyed by (version, category, language). Bump the version when the
+# wording changes so memoized output from the old wording is never reused.
+TEMPLATES = {
+    ("v1", "default", "en"): (
+        "Title: {{ title }}\n"
+        "{% if authors %}Author: {{ authors }}\n{% endif %}\n"
+        "Introducing {{ title }}"
+        "{% if authors %}, a captivating and transformative work by {{ authors }}.{% endif %}"
+        "{% if publish_year %} Published in {{ publish_year }}{% endif %}"
+        "{% if publishers %} by {{ publishers }}{% endif %}"
+        ", this book invites readers to embark on a journey of discovery and inspiration. "
+        "With its engaging narrative and insightful perspectives,"
+        "{% if subjects %} {{ title }} explores themes of {{ subjects }} and offers practical wisdom to enhance your everyday life."
+        "{% else %} {{ title }} offers practical wisdom to enhance your everyday life.{% endif %}\n\n"
+    ),
+    ("v1", "fiction", "en"): (
+        "Title: {{ title }}\n"
+        "{% if authors %}Author: {{ authors }}\n{% endif %}\n"
+        "Step into {{ title }}"
+        "{% if authors %}, a captivating story by {{ authors }}.{% else %}.{% endif %}"
+        "{% if publish_year %} First published in {{ publish_year }}"
+        "{% if publishers %} by {{ publishers }}{% endif %}, this{% else %} This{% endif %}"
+        " book draws readers into a world of vivid characters and unforgettable moments."
+        "{% if subjects %} Touching on {{ subjects }}, it{% else %} It{% endif %}"
+        " is a read you won't want to put down.\n\n"
+    ),
+    ("v1", "default", "fr"): (
+        "Titre : {{ title }}\n"
+        "{% if authors %}Auteur : {{ authors }}\n{% endif %}\n"
+        "Découvrez {{ title }}"
+        "{% if authors %}, une œuvre captivante de {{ authors }}.{% else %}.{% endif %}"
+        "{% if publish_year %} Publié en {{ publish_year }}"
+        "{% if publishers %} par {{ publishers }}{% endif %}, ce{% else %} Ce{% endif %}"
+        " livre invite le lecteur à un voyage de découverte et d'inspiration."
+        "{% if subjects %} Il aborde {{ subjects }}.{% endif %}\n\n"
+    ),
+}
+
+LANGUAGE_CODES = {"eng": "en", "fre": "fr", "fra": "fr"}
+
+
+def _join(value: Any, limit: int) -> str:
+    """Render a list as 'a, b and c' instead of its Python repr"""
+    if value is None:
+        return ""
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    items = [str(item).strip() for item in value if item not in MISSING and str(item).strip()]
+    items = list(dict.fromkeys(items))[:limit]
+    if len(items) <= 1:
+        return "".join(items)
+    return f"{', '.join(items[:-1])} and {items[-1]}"
+
+
+def detect_category(subjects: Optional[Iterable[str]]) -> str:
+    lowered = [str(subject).lower() for subject in subjects or []]
+    if any("fiction" in subject and "nonfiction" not in subject and "non-fiction" not in subject for subject in lowered):
+        return "fiction"
+    return "default"
+
+
+def detect_language(languages: Any) -> str:
+    if isinstance(languages, str):
+        languages = [languages]
+    for language in languages or []:
+        if language in LANGUAGE_CODES:
+            return LANGUAGE_CODES[language]
+    return "en"
+
+
+class DescriptionEngine:
+    """
+    Renders listing descriptions from precompiled, versioned Jinja2 templates.
+
+    Output is memoized by a hash of the normalized book metadata plus the
+    template key, so re-rendering the same book costs a dictionary lookup.
+    """
+
+    def __init__(self, templates: Dict[tuple, str] = TEMPLATES, version: str = DESCRIPTION_TEMPLATE_VERSION,
+                 cache_size: int = DESCRIPTION_CACHE_SIZE):
+        self.version = version
+        self.cache_size = cache_size
+        self.stats = {"hits": 0, "misses": 0}
+        environment = Environment(autoescape=False, undefined=StrictUndefined, keep_trailing_newline=True)
+        # Compile every template once up front
+        self.templates = {key: environment.from_string(source) for key, source in templates.items()}
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _template_key(self, version: str, category: str, language: str) -> tuple:
+        for key in ((version, category, language), (version, "default", language), (version, category, "en"),
+                    (version, "default", "en")):
+            if key in self.templates:
+                return key
+        raise KeyError(f"No description template for version {version}")
+
+    @staticmethod
+    def context(book: Dict[str, Any]) -> Dict[str, str]:
+        publish_year = book.get("publish_year")
+        if isinstance(publish_year, (list, tuple)):
+            publish_year = publish_year[0] if publish_year else None
+        return {
+            "title": str(book.get("title") or "").strip(),
+            "authors": _join(book.get("authors"), 3),
+            "publish_year": "" if publish_year in MISSING else str(publish_year),
+            "publishers": _join(book.get("publishers"), 2),
+            "subjects": _join(book.get("subjects"), 5),
+        }
+
+    def render(self, book: Dict[str, Any], category: Optional[str] = None, language: Optional[str] = None,
+               version: Optional[str] = None) -> str:
+        context = self.context(book)
+        key = self._template_key(
+            version or self.version,
+            category or detect_category(book.get("subjects")),
+            language or detect_language(book.get("language")),
+        )
+        digest = hashlib.sha256(json.dumps([key, context], sort_keys=True).encode()).hexdigest()
+
+        with self._lock:
+            cached = self._cache.get(digest)
+            if cached is not None:
+                self._cache.move_to_end(digest)
+                self.stats["hits"] += 1
+                return cached
+
+        description = self.templates[key].render(**context)
+
+        with self._lock:
+            self.stats["misses"] += 1
+            self._cache[digest] = description
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return description
+
+    def render_many(self, books: List[Dict[str, Any]], category: Optional[str] = None,
+                    language: Optional[str] = None, version: Optional[str] = None) -> List[str]:
+        return [self.render(book, category, language, version) for book in books]
+
+
+description_engine = DescriptionEngine()
+register_cache("descriptions", lambda: (description_engine.stats["hits"], description_engine.stats["misses"]))
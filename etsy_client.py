@@ -0,0 +1,219 @@
+import asyncio
+import inspect
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, Union
+
+import httpx
+
+from metrics import OUTBOUND_RETRIES, RATE_LIMIT_WAIT, RATE_LIMITED, outbound, request_id
+
+logger = logging.getLogger(__name__)
+
+ETSY_API_BASE = os.getenv("ETSY_API_BASE", "https://openapi.etsy.com/v3/application")
+
+# Etsy's default app limits are 10 requests per second and 10,000 per day;
+# the real values are read back from the response headers.
+ETSY_RATE_LIMIT = float(os.getenv("ETSY_RATE_LIMIT", 10))
+ETSY_MAX_CONNECTIONS = int(os.getenv("ETSY_MAX_CONNECTIONS", 20))
+ETSY_MAX_RETRIES = int(os.getenv("ETSY_MAX_RETRIES", 5))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Token-bucket limiter that refills at `rate` tokens per second.
+
+    The bucket is corrected from Etsy's `x-limit-per-second` and
+    `x-remaining-this-second` headers so we never run ahead of what the
+    server thinks we have left.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def update_from_headers(self, headers: httpx.Headers):
+        limit = headers.get("x-limit-per-second")
+        remaining = headers.get("x-remaining-this-second")
+        remaining_today = headers.get("x-remaining-today")
+        try:
+            if limit:
+                self.rate = self.capacity = max(float(limit), 1.0)
+            if remaining is not None:
+                self._refill()
+                self.tokens = min(self.tokens, float(remaining))
+            if remaining_today is not None and int(remaining_today) <= 0:
+                # Daily quota exhausted: hold every caller until the server lets us back in
+                self.block(float(headers.get("retry-after") or 60))
+        except ValueError:
+            pass
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class EtsyClient:
+    """
+    Long-lived async client for the Etsy v3 API.
+
+    One pooled `httpx.AsyncClient` is kept open so calls reuse keep-alive
+    connections, every request waits on the shared token bucket, and 429/5xx
+    responses are retried with jittered exponential backoff. A 401 triggers one
+    token refresh through `refresh_token(stale_token)` before giving up.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        access_token: Optional[Callable[[], Union[str, Awaitable[str]]]] = None,
+        refresh_token: Optional[Callable[[str], Awaitable[Any]]] = None,
+        base_url: str = ETSY_API_BASE,
+        rate: float = ETSY_RATE_LIMIT,
+        max_connections: int = ETSY_MAX_CONNECTIONS,
+        max_retries: int = ETSY_MAX_RETRIES,
+    ):
+        self.api_key = api_key
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.limiter = TokenBucket(rate)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(30.0, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=60.0,
+                ),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _headers(self, auth: bool):
+        headers = {"x-api-key": self.api_key or "", "X-Request-ID": request_id.get()}
+        if auth and self.access_token:
+            token = self.access_token()
+            if inspect.isawaitable(token):
+                token = await token
+            headers["Authorization"] = f"Bearer {token}"
+        return headers
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return float(retry_after) + random.uniform(0, 0.25)
+                except ValueError:
+                    pass
+        # Full jitter keeps concurrent callers from retrying in lockstep
+        return random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+
+    async def request(self, method: str, path: str, auth: bool = True, retry: bool = True,
+                      **kwargs: Any) -> httpx.Response:
+        """
+        Send a request, retrying rate-limited and 5xx responses; raises `httpx.HTTPStatusError` on failure.
+
+        Pass `retry=False` for bodies that can't be replayed (streamed uploads),
+        or pass `content` as a callable returning a fresh body for every attempt.
+        """
+        max_retries = self.max_retries if retry else 0
+        content = kwargs.pop("content", None)
+        extra_headers = kwargs.pop("headers", {})
+        headers = {**await self._headers(auth), **extra_headers}
+        refreshed = False
+        attempt = 0
+        # Paths carry ids; the first segment is enough to tell the calls apart
+        operation = f"{method} /{path.strip('/').split('/')[0]}"
+        while True:
+            waited = time.perf_counter()
+            await self.limiter.acquire()
+            RATE_LIMIT_WAIT.inc(time.perf_counter() - waited, service="etsy")
+            try:
+                with outbound("etsy", operation) as call:
+                    body = content() if callable(content) else content
+                    response = await self.client.request(method, path, headers=headers, content=body, **kwargs)
+                    call["status"] = response.status_code
+                    call["bytes_sent"] = int(response.request.headers.get("content-length") or 0)
+                    call["bytes_received"] = len(response.content)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                if attempt >= max_retries:
+                    raise
+                OUTBOUND_RETRIES.inc(service="etsy", reason="connection")
+                logger.warning("Etsy %s %s failed (%s), retrying", method, path, type(e).__name__)
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            self.limiter.update_from_headers(response.headers)
+            if response.status_code == 401 and auth and self.refresh_token and not refreshed and retry:
+                OUTBOUND_RETRIES.inc(service="etsy", reason="401")
+                stale_token = headers.get("Authorization", "").removeprefix("Bearer ")
+                await self.refresh_token(stale_token)
+                headers = {**await self._headers(auth), **extra_headers}
+                refreshed = True
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt >= max_retries:
+                response.raise_for_status()
+                return response
+
+            delay = self._backoff(attempt, response)
+            OUTBOUND_RETRIES.inc(service="etsy", reason=str(response.status_code))
+            logger.warning("Etsy %s %s returned %s, retrying in %.2fs", method, path, response.status_code, delay)
+            if response.status_code == 429:
+                RATE_LIMITED.inc(service="etsy")
+                self.limiter.block(delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get(self, path: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("PUT", path, **kwargs)
+
+    async def patch(self, path: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("PATCH", path, **kwargs)
+
+    async def delete(self, path: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("DELETE", path, **kwargs)
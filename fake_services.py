@@ -0,0 +1,469 @@
+import asyncio
+import io
+import random
+import re
+import socket
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+
+# Pillow is only needed to serve covers the app can actually decode and resize
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class FakeSettings:
+    """
+    Knobs shared by the fake services.
+
+    `latency` (+/- `jitter`) seconds is added to every response. `rate_limit`
+    caps the Etsy fake at that many requests per second (answering 429 with
+    Retry-After beyond it), and `fail_every` turns every Nth Etsy call into a
+    503. Payload sizes control the PDF, cover and page bodies, and
+    `upload_bandwidth` (bytes/second) slows down how fast Etsy reads uploads.
+    PDF downloads honour Range requests unless `ranges` is off, are served at
+    `download_bandwidth` bytes/second when set, and `drop_after` cuts every PDF
+    response off after that many bytes. Search and category pages list
+    `books_per_page` books over `catalog_pages` pages. Open Library has no
+    match for the book ids in `unknown_books`, and the PDF downloads of the
+    book ids in `broken_pdfs` answer 503.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, rate_limit: Optional[float] = None,
+                 fail_every: int = 0, pdf_size: int = 2 * 1024 * 1024, cover_size: int = 800,
+                 page_padding: int = 60 * 1024, chunk_size: int = 64 * 1024,
+                 upload_bandwidth: Optional[float] = None, ranges: bool = True,
+                 drop_after: Optional[int] = None, download_bandwidth: Optional[float] = None,
+                 catalog_pages: int = 5, books_per_page: int = 20, unknown_books: Iterable[int] = (),
+                 broken_pdfs: Iterable[int] = ()):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.fail_every = fail_every
+        self.pdf_size = pdf_size
+        self.cover_size = cover_size
+        self.page_padding = page_padding
+        self.chunk_size = chunk_size
+        self.upload_bandwidth = upload_bandwidth
+        self.ranges = ranges
+        self.drop_after = drop_after
+        self.download_bandwidth = download_bandwidth
+        self.catalog_pages = catalog_pages
+        self.books_per_page = books_per_page
+        self.unknown_books = set(unknown_books)
+        self.broken_pdfs = set(broken_pdfs)
+
+    async def consume(self, request: Request) -> int:
+        """Read an upload body, at no more than `upload_bandwidth` bytes/second when set"""
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if self.upload_bandwidth:
+                await asyncio.sleep(len(chunk) / self.upload_bandwidth)
+        return size
+
+    async def delay(self):
+        latency = self.latency + random.uniform(-self.jitter, self.jitter)
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+
+def _book_id(value: str) -> int:
+    digits = "".join(c for c in str(value) if c.isdigit())
+    return int(digits[-9:]) if digits else 1
+
+
+def _isbn13(book_id: int) -> str:
+    stem = f"978{book_id % 10 ** 9:09d}"
+    check = (10 - sum(int(c) * (1 if i % 2 == 0 else 3) for i, c in enumerate(stem)) % 10) % 10
+    return f"{stem}{check}"
+
+
+def _money(value: float) -> Dict[str, Any]:
+    return {"amount": round(float(value) * 100), "divisor": 100, "currency_code": "USD"}
+
+
+def fake_pdf(book_id: int, size: int) -> bytes:
+    """A minimal PDF carrying title, author and ISBN in its info dict, padded to `size` bytes"""
+    head = (
+        f"%PDF-1.4\n1 0 obj<</Title (Benchmark Book {book_id})/Author (Fake Author)"
+        f"/Subject (ISBN {_isbn13(book_id)})>>endobj\n"
+    ).encode()
+    tail = b"trailer<</Info 1 0 R>>\n%%EOF\n"
+    padding = max(0, size - len(head) - len(tail))
+    return head + b"%" + b"0" * max(0, padding - 2) + b"\n" + tail
+
+
+def fake_cover(size: int) -> bytes:
+    if Image is None:
+        return b"\xff\xd8\xff\xe0" + b"\0" * 1024
+    image = Image.new("RGB", (size, int(size * 1.5)), (120, 60, 30))
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=90)
+    return output.getvalue()
+
+
+def _taxonomy_node(node_id: int, name: str, parent_id: Optional[int], path: List[int],
+                   children: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    children = children or []
+    return {"id": node_id, "level": len(path), "name": name, "parent_id": parent_id,
+            "child_ids": [child["id"] for child in children], "full_path_taxonomy_ids": path + [node_id],
+            "children": children}
+
+
+# A slice of the seller taxonomy: "Books, Movies & Music > Books" with a few genres below it
+TAXONOMY = [
+    _taxonomy_node(1, "Accessories", None, [], [_taxonomy_node(2, "Hats & Caps", 1, [1])]),
+    _taxonomy_node(323, "Books, Movies & Music", None, [], [
+        _taxonomy_node(324, "Books", 323, [323], [
+            _taxonomy_node(325, "Art & Photography Books", 324, [323, 324]),
+            _taxonomy_node(326, "Children's Books", 324, [323, 324]),
+            _taxonomy_node(327, "Cookbooks", 324, [323, 324]),
+            _taxonomy_node(328, "Fiction & Nonfiction", 324, [323, 324], [
+                _taxonomy_node(329, "Fiction", 328, [323, 324, 328]),
+                _taxonomy_node(330, "Nonfiction", 328, [323, 324, 328]),
+            ]),
+            _taxonomy_node(331, "Religion & Spirituality Books", 324, [323, 324]),
+            _taxonomy_node(332, "Computers & Technology Books", 324, [323, 324]),
+        ]),
+        _taxonomy_node(340, "Music", 323, [323]),
+    ]),
+]
+
+
+class FakeEtsy:
+    """Etsy v3 stand-in: users, listings, inventory, images, files and the OAuth token endpoint"""
+
+    def __init__(self, settings: FakeSettings):
+        self.settings = settings
+        self.calls = 0
+        self.rate_limited = 0
+        self.uploads = {"images": 0, "files": 0}
+        self.listings: Dict[int, Dict[str, Any]] = {}
+        self._next_id = 1_000_000
+        self._window = (0, 0)
+        self.app = self._build()
+
+    def _throttle(self) -> Optional[Response]:
+        self.calls += 1
+        headers = {}
+        if self.settings.rate_limit:
+            second = int(time.monotonic())
+            start, count = self._window
+            count = count + 1 if start == second else 1
+            self._window = (second, count)
+            remaining = max(0, int(self.settings.rate_limit) - count)
+            headers = {"x-limit-per-second": str(int(self.settings.rate_limit)),
+                       "x-remaining-this-second": str(remaining)}
+            if count > self.settings.rate_limit:
+                self.rate_limited += 1
+                return JSONResponse({"error": "Rate limit exceeded"}, status_code=429,
+                                    headers={**headers, "retry-after": "1"})
+        if self.settings.fail_every and self.calls % self.settings.fail_every == 0:
+            return JSONResponse({"error": "Service unavailable"}, status_code=503)
+        return None
+
+    def _build(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.middleware("http")
+        async def etsy_behaviour(request: Request, call_next):
+            await self.settings.delay()
+            limited = self._throttle()
+            if limited is not None:
+                return limited
+            return await call_next(request)
+
+        @app.post("/oauth/token")
+        async def token():
+            return {"access_token": "fake-access", "refresh_token": "fake-refresh", "expires_in": 3600}
+
+        @app.get("/v3/application/seller-taxonomy/nodes")
+        async def seller_taxonomy():
+            return {"count": len(TAXONOMY), "results": TAXONOMY}
+
+        @app.get("/v3/application/users/me")
+        async def me():
+            return {"user_id": 1, "shop_id": 1}
+
+        @app.post("/v3/application/shops/{shop_id}/listings")
+        async def create_listing(shop_id: int, request: Request):
+            data = await request.json()
+            self._next_id += 1
+            listing = {"listing_id": self._next_id, "shop_id": shop_id, "state": "draft",
+                       "updated_timestamp": int(time.time()), "created_timestamp": int(time.time()), **data,
+                       "price": _money(data.get("price", 0))}
+            self.listings[self._next_id] = listing
+            return listing
+
+        @app.get("/v3/application/shops/{shop_id}/listings")
+        async def list_listings(shop_id: int, state: str = "active", limit: int = 25, offset: int = 0):
+            listings = [listing for listing in self.listings.values() if listing["state"] == state]
+            return {"count": len(listings), "results": listings[offset:offset + limit]}
+
+        @app.get("/v3/application/listings/{listing_id}")
+        async def get_listing(listing_id: int):
+            if listing_id not in self.listings:
+                return JSONResponse({"error": "Listing not found"}, status_code=404)
+            return self.listings[listing_id]
+
+        @app.patch("/v3/application/shops/{shop_id}/listings/{listing_id}")
+        async def update_listing(shop_id: int, listing_id: int, request: Request):
+            if listing_id not in self.listings:
+                return JSONResponse({"error": "Listing not found"}, status_code=404)
+            listing = self.listings[listing_id]
+            listing.update(await request.json())
+            listing["updated_timestamp"] = int(time.time())
+            return listing
+
+        @app.get("/v3/application/listings/{listing_id}/inventory")
+        async def get_inventory(listing_id: int):
+            if listing_id not in self.listings:
+                return JSONResponse({"error": "Listing not found"}, status_code=404)
+            listing = self.listings[listing_id]
+            return {"products": [{
+                "product_id": listing_id, "sku": "", "is_deleted": False, "property_values": [],
+                "offerings": [{"offering_id": listing_id, "quantity": listing.get("quantity", 1), "is_enabled": True,
+                               "is_deleted": False,
+                               "price": listing["price"]}],
+            }], "price_on_property": [], "quantity_on_property": [], "sku_on_property": []}
+
+        @app.put("/v3/application/listings/{listing_id}/inventory")
+        async def update_inventory(listing_id: int, request: Request):
+            if listing_id not in self.listings:
+                return JSONResponse({"error": "Listing not found"}, status_code=404)
+            inventory = await request.json()
+            offering = inventory["products"][0]["offerings"][0]
+            self.listings[listing_id].update(price=_money(offering["price"]), quantity=offering["quantity"],
+                                             updated_timestamp=int(time.time()))
+            return inventory
+
+        @app.delete("/v3/application/listings/{listing_id}")
+        async def delete_listing(listing_id: int):
+            self.listings.pop(listing_id, None)
+            return Response(status_code=204)
+
+        @app.post("/v3/application/shops/{shop_id}/listings/{listing_id}/images")
+        async def upload_image(shop_id: int, listing_id: int, request: Request):
+            size = await self.settings.consume(request)
+            self.uploads["images"] += 1
+            return {"listing_id": listing_id, "listing_image_id": listing_id * 10, "bytes": size}
+
+        @app.post("/v3/application/shops/{shop_id}/listings/{listing_id}/files")
+        async def upload_file(shop_id: int, listing_id: int, request: Request):
+            size = await self.settings.consume(request)
+            self.uploads["files"] += 1
+            return {"listing_id": listing_id, "listing_file_id": listing_id * 10, "filesize": str(size)}
+
+        return app
+
+
+class FakeOpenLibrary:
+    """`search.json` and the covers host; every title or ISBN resolves to a book unless it is unknown"""
+
+    def __init__(self, settings: FakeSettings):
+        self.settings = settings
+        self.calls = 0
+        self.lookups = {"title": 0, "isbn": 0}
+        self._cover = fake_cover(settings.cover_size)
+        self.app = self._build()
+
+    def _build(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/search.json")
+        async def search(title: str = None, isbn: str = None, limit: int = 1):
+            self.calls += 1
+            self.lookups["isbn" if isbn else "title"] += 1
+            await self.settings.delay()
+            book_id = _book_id(isbn[3:-1] if isbn else title or "")
+            if book_id in self.settings.unknown_books:
+                return {"numFound": 0, "docs": []}
+            return {"numFound": 1, "docs": [{
+                "title": title or f"Benchmark Book {book_id}",
+                "author_name": ["Fake Author"],
+                "first_publish_year": 2001,
+                "publisher": ["Fake Press"],
+                "isbn": [_isbn13(book_id)],
+                "language": ["eng"],
+                "number_of_pages_median": 320,
+                "subject": ["Fiction", "Benchmarks"],
+                "cover_i": book_id,
+            }][:limit]}
+
+        @app.get("/b/id/{cover}")
+        async def cover(cover: str):
+            await self.settings.delay()
+            return Response(self._cover, media_type="image/jpeg")
+
+        return app
+
+
+class FakePdfDrive:
+    """Book page -> "/ebook/broken" -> PDF download, as the scraper walks it"""
+
+    def __init__(self, settings: FakeSettings):
+        self.settings = settings
+        self.calls = 0
+        self.bytes_served = 0
+        self.app = self._build()
+
+    def _build(self) -> FastAPI:
+        app = FastAPI()
+        padding = "<p>" + "lorem ipsum " * (self.settings.page_padding // 12) + "</p>"
+
+        @app.get("/ebook/broken")
+        async def broken(id: str, session: str, r: str = ""):
+            self.calls += 1
+            await self.settings.delay()
+            return HTMLResponse(
+                f"<html><body>{padding}<a class='btn btn-user' href='/download.pdf?id={id}&h={session}'>"
+                f"Download</a></body></html>"
+            )
+
+        @app.get("/download.pdf")
+        async def download(request: Request, id: str, h: str = ""):
+            self.calls += 1
+            await self.settings.delay()
+            if _book_id(id) in self.settings.broken_pdfs:
+                return Response("Fake source failure", status_code=503, media_type="text/plain")
+            body = fake_pdf(_book_id(id), self.settings.pdf_size)
+            chunk_size = self.settings.chunk_size
+            start, end, status = 0, len(body) - 1, 200
+            headers = {"Accept-Ranges": "bytes"} if self.settings.ranges else {}
+
+            match = re.fullmatch(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+            if match and self.settings.ranges:
+                start = int(match.group(1))
+                end = min(int(match.group(2) or end), end)
+                if start >= len(body):
+                    return Response(status_code=416, headers={"Content-Range": f"bytes */{len(body)}"})
+                status = 206
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            headers["Content-Length"] = str(end - start + 1)
+
+            async def chunks():
+                sent = 0
+                for offset in range(start, end + 1, chunk_size):
+                    chunk = body[offset:min(offset + chunk_size, end + 1)]
+                    if self.settings.drop_after is not None and sent + len(chunk) > self.settings.drop_after:
+                        # Send what fits, then break the connection mid-body
+                        self.bytes_served += self.settings.drop_after - sent
+                        yield chunk[:self.settings.drop_after - sent]
+                        raise ConnectionResetError("Fake connection drop")
+                    sent += len(chunk)
+                    self.bytes_served += len(chunk)
+                    if self.settings.download_bandwidth:
+                        await asyncio.sleep(len(chunk) / self.settings.download_bandwidth)
+                    yield chunk
+
+            return StreamingResponse(chunks(), status_code=status, media_type="application/pdf", headers=headers)
+
+        @app.get("/search")
+        async def search(q: str = "", page: int = 1):
+            self.calls += 1
+            await self.settings.delay()
+            return HTMLResponse(self._listing(f"/search?q={q}", sum(map(ord, q)) * 1000, page, padding))
+
+        @app.get("/category/{category_id}")
+        async def category(category_id: int, page: int = 1):
+            self.calls += 1
+            await self.settings.delay()
+            return HTMLResponse(self._listing(f"/category/{category_id}", category_id * 100000, page, padding))
+
+        @app.get("/{slug}.html")
+        async def book_page(slug: str):
+            self.calls += 1
+            await self.settings.delay()
+            book_id = _book_id(slug)
+            return HTMLResponse(
+                f"<html><body><h1>Benchmark Book {book_id}</h1>{padding}"
+                f"<button id='previewButtonMain' data-preview='/ebook/preview?id={book_id}&session=s{book_id}'>"
+                f"Preview</button></body></html>"
+            )
+
+        return app
+
+    def _listing(self, path: str, first_id: int, page: int, padding: str) -> str:
+        """A search/category results page: `books_per_page` book links, pagination and a category link"""
+        separator = "&" if "?" in path else "?"
+        start = first_id + (page - 1) * self.settings.books_per_page
+        links = "".join(
+            f"<a href='/benchmark-book-e{book_id}.html'>Benchmark Book {book_id}</a>"
+            for book_id in range(start, start + self.settings.books_per_page)
+        )
+        if page < self.settings.catalog_pages:
+            links += f"<a href='{path}{separator}page={page + 1}'>Next</a>"
+        links += "<a href='/category/7'>Category</a><a href='https://elsewhere.example/search?q=x'>Ad</a>"
+        return f"<html><body>{padding}{links}</body></html>"
+
+
+class FakeServer:
+    """Runs an ASGI app under uvicorn on a free localhost port in a background thread"""
+
+    def __init__(self, app, host: str = "127.0.0.1"):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, 0))
+        self.url = f"http://{host}:{self.sock.getsockname()[1]}"
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="off"))
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [self.sock]}, daemon=True)
+
+    def start(self) -> "FakeServer":
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+        self.sock.close()
+
+
+class FakeServices:
+    """
+    Etsy, Open Library (+ covers) and pdfdrive fakes on localhost.
+    `env()` returns the variables that point the app at them.
+    """
+
+    def __init__(self, settings: Optional[FakeSettings] = None):
+        self.settings = settings or FakeSettings()
+        self.etsy = FakeEtsy(self.settings)
+        self.openlibrary = FakeOpenLibrary(self.settings)
+        self.pdfdrive = FakePdfDrive(self.settings)
+        self.servers: Dict[str, FakeServer] = {}
+
+    def start(self) -> "FakeServices":
+        for name, service in (("etsy", self.etsy), ("openlibrary", self.openlibrary), ("pdfdrive", self.pdfdrive)):
+            self.servers[name] = FakeServer(service.app).start()
+        return self
+
+    def stop(self):
+        for server in self.servers.values():
+            server.stop()
+        self.servers = {}
+
+    def __enter__(self) -> "FakeServices":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def book_url(self, book_id: int) -> str:
+        return f"{self.servers['pdfdrive'].url}/benchmark-book-e{book_id}.html"
+
+    def env(self) -> Dict[str, str]:
+        return {
+            "ETSY_API_BASE": f"{self.servers['etsy'].url}/v3/application",
+            "ETSY_TOKEN_URL": f"{self.servers['etsy'].url}/oauth/token",
+            "OPENLIBRARY_BASE": self.servers["openlibrary"].url,
+            "OPENLIBRARY_COVERS_BASE": self.servers["openlibrary"].url,
+            "PDFDRIVE_BASE": self.servers["pdfdrive"].url,
+        }
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from metrics import request_id
+from progress import current_job, progress_tracker
+
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", 4))
+
+
+class JobQueue:
+    """
+    Queue of batch ingestion jobs processed by a bounded pool of asyncio workers.
+
+    Each job holds a list of book URLs; every URL is one item that goes through
+    `runner(book_url, on_stage, on_progress)` and reports its current stage,
+    timing and error. Stage changes and byte counts are also published to the
+    progress tracker under the job id, and cancelling the job there stops its
+    running items and skips the queued ones.
+    """
+
+    def __init__(self, runner: Callable[..., Awaitable[Dict[str, Any]]], concurrency: int = JOB_CONCURRENCY):
+        self.runner = runner
+        self.concurrency = max(1, concurrency)
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        # Items queued before start (or left over from a previous loop) are picked up again
+        for job in self.jobs.values():
+            for index, item in enumerate(job["items"]):
+                if item["status"] in ("queued", "running"):
+                    item["status"] = "queued"
+                    self._queue.put_nowait((job["id"], index))
+
+    async def stop(self):
+        self._stopping = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, book_urls: List[str]) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "created_at": time.time(),
+            "finished_at": None,
+            "items": [
+                {
+                    "book_url": url,
+                    "status": "queued",
+                    "stage": None,
+                    "stages": {},
+                    "started_at": None,
+                    "finished_at": None,
+                    "duration": None,
+                    "error": None,
+                    "result": None,
+                }
+                for url in book_urls
+            ],
+        }
+        self.jobs[job_id] = job
+        progress_tracker.open(job_id)
+        if self._queue is not None:
+            for index in range(len(job["items"])):
+                self._queue.put_nowait((job_id, index))
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.jobs.get(job_id)
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        summaries = []
+        for job in self.jobs.values():
+            counts: Dict[str, int] = {}
+            for item in job["items"]:
+                counts[item["status"]] = counts.get(item["status"], 0) + 1
+            summaries.append({
+                "id": job["id"],
+                "status": job["status"],
+                "created_at": job["created_at"],
+                "finished_at": job["finished_at"],
+                "total": len(job["items"]),
+                "counts": counts,
+            })
+        return summaries
+
+    async def _worker(self):
+        while True:
+            job_id, index = await self._queue.get()
+            try:
+                await self._process(self.jobs[job_id], index)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job, index):
+        item = job["items"][index]
+        if progress_tracker.cancel_requested(job["id"]):
+            item["status"] = "cancelled"
+            self._finish(job)
+            return
+
+        # Log lines and outbound calls for this item carry the job id and item index
+        request_id.set(f"{job['id'][:12]}-{index}")
+        current_job.set(job["id"])
+        job["status"] = "running"
+        item["status"] = "running"
+        item["started_at"] = time.time()
+
+        def on_stage(name, status):
+            item["stage"] = name
+            stage = item["stages"].setdefault(name, {"status": status, "started_at": time.time(), "duration": None})
+            stage["status"] = status
+            if status != "started":
+                stage["duration"] = round(time.time() - stage["started_at"], 3)
+            progress_tracker.stage(job["id"], name, status, item=index)
+
+        def on_progress(name):
+            return progress_tracker.reporter(job["id"], name, item=index)
+
+        task = asyncio.create_task(self.runner(item["book_url"], on_stage=on_stage, on_progress=on_progress))
+        progress_tracker.attach(job["id"], task)
+        try:
+            item["result"] = await task
+            item["status"] = "done"
+        except asyncio.CancelledError:
+            if self._stopping or not progress_tracker.cancel_requested(job["id"]):
+                item["status"] = "queued"
+                raise
+            item["status"] = "cancelled"
+        except Exception as e:
+            item["status"] = "failed"
+            item["error"] = {"stage": getattr(e, "stage", item["stage"]), "message": str(e)}
+        finally:
+            item["finished_at"] = time.time()
+            item["duration"] = round(item["finished_at"] - item["started_at"], 3)
+
+        progress_tracker.publish(job["id"], "item", item=index, status=item["status"], error=item["error"])
+        self._finish(job)
+
+    def _finish(self, job):
+        statuses = [i["status"] for i in job["items"]]
+        if all(status in ("done", "failed", "cancelled") for status in statuses):
+            if "cancelled" in statuses:
+                job["status"] = "cancelled"
+            else:
+                job["status"] = "failed" if all(status == "failed" for status in statuses) else "done"
+            job["finished_at"] = time.time()
+            progress_tracker.finish(job["id"], job["status"])
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from metadata_cache import normalize_isbn, normalize_title
+
+LISTING_INDEX_PATH = os.getenv("LISTING_INDEX_PATH", "listing_index.db")
+
+
+class ListingIndex:
+    """
+    Local SQLite index of the listings we created, keyed by idempotency key,
+    source URL, ISBN and normalized title, so a repeated request resolves to
+    the existing listing with one local lookup instead of an Etsy write.
+    """
+
+    def __init__(self, path: str = LISTING_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                "listing_id INTEGER PRIMARY KEY, shop_id INTEGER NOT NULL, title TEXT, "
+                "source_url TEXT, isbn TEXT, idempotency_key TEXT, created_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS listing_keys ("
+                "shop_id INTEGER NOT NULL, key TEXT NOT NULL, listing_id INTEGER NOT NULL, "
+                "PRIMARY KEY (shop_id, key))"
+            )
+        return self._db
+
+    @staticmethod
+    def keys(idempotency_key: Optional[str] = None, source_url: Optional[str] = None,
+             isbn: Optional[str] = None, title: Optional[str] = None):
+        """Lookup keys, most specific first"""
+        keys = []
+        if idempotency_key:
+            keys.append(f"idem:{idempotency_key}")
+        if source_url:
+            keys.append(f"url:{source_url.strip()}")
+        if isbn and normalize_isbn(isbn):
+            keys.append(f"isbn:{normalize_isbn(isbn)}")
+        if title and normalize_title(title):
+            keys.append(f"title:{normalize_title(title)}")
+        return keys
+
+    def find(self, shop_id, idempotency_key: Optional[str] = None, source_url: Optional[str] = None,
+             isbn: Optional[str] = None, title: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        isbn = normalize_isbn(isbn) if isbn else None
+        with self._lock:
+            for key in self.keys(idempotency_key, source_url, isbn, title):
+                row = self.db.execute(
+                    "SELECT l.listing_id, l.isbn FROM listing_keys k JOIN listings l ON l.listing_id = k.listing_id "
+                    "WHERE k.shop_id = ? AND k.key = ?",
+                    (int(shop_id), key),
+                ).fetchone()
+                if not row:
+                    continue
+                # Same title but a different known ISBN is a different book
+                if key.startswith("title:") and isbn and row[1] and row[1] != isbn:
+                    continue
+                return {"listing_id": row[0], "matched_on": key.split(":", 1)[0]}
+        return None
+
+    def record(self, shop_id, listing_id, idempotency_key: Optional[str] = None, source_url: Optional[str] = None,
+               isbn: Optional[str] = None, title: Optional[str] = None):
+        isbn = normalize_isbn(isbn) if isbn else None
+        with self._lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO listings (listing_id, shop_id, title, source_url, isbn, idempotency_key, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (int(listing_id), int(shop_id), title, source_url, isbn, idempotency_key, time.time()),
+                )
+                for key in self.keys(idempotency_key, source_url, isbn, title):
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO listing_keys (shop_id, key, listing_id) VALUES (?, ?, ?)",
+                        (int(shop_id), key, int(listing_id)),
+                    )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def forget(self, listing_id):
+        """Drop a listing (e.g. after it was deleted on Etsy) so it is no longer matched"""
+        with self._lock:
+            self.db.execute("DELETE FROM listing_keys WHERE listing_id = ?", (int(listing_id),))
+            self.db.execute("DELETE FROM listings WHERE listing_id = ?", (int(listing_id),))
+
+
+listing_index = ListingIndex()
@@ -0,0 +1,103 @@
+"""
+Load test: while one large PDF upload is in flight, other requests must keep
+being served promptly instead of queueing behind it.
+
+    python load_test.py --pdf-size 67108864 --upload-bandwidth 16777216
+
+Exits non-zero when a concurrent request waits longer than --max-latency.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmark import AppProcess, percentile
+from fake_services import FakeServices, FakeSettings, fake_pdf
+
+# Etsy-bound endpoints are left out: they wait on the client-side rate limiter by design
+LIGHT_REQUESTS = (
+    ("GET", "/generate-description", {"title": "Load Test Book", "authors": "Fake Author", "subjects": "Fiction"}),
+    ("GET", "/search-book", {"title": "Load Test Book 7"}),
+    ("GET", "/search-book/cache-stats", None),
+)
+
+
+async def run(app: AppProcess, pdf_path: str, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    async with httpx.AsyncClient(base_url=app.url, timeout=600.0) as client:
+        upload_started = time.perf_counter()
+        upload = asyncio.create_task(client.get(
+            "/upload-listing-file", params={"shop_id": 1, "listing_id": 1, "file_name": pdf_path}
+        ))
+        # Give the upload a head start so every probe overlaps with it
+        await asyncio.sleep(0.2)
+
+        async def probe(worker: int):
+            index = worker
+            while not upload.done():
+                method, url, params = LIGHT_REQUESTS[index % len(LIGHT_REQUESTS)]
+                start = time.perf_counter()
+                await client.request(method, url, params=params)
+                latencies.append(time.perf_counter() - start)
+                index += 1
+
+        await asyncio.gather(*(probe(worker) for worker in range(concurrency)))
+        response = await upload
+        upload_duration = time.perf_counter() - upload_started
+
+    return {
+        "upload": response.json(),
+        "upload_s": round(upload_duration, 3),
+        "probes": len(latencies),
+        "probe_p50_ms": round((percentile(latencies, 50) or 0) * 1000, 1),
+        "probe_p95_ms": round((percentile(latencies, 95) or 0) * 1000, 1),
+        "probe_max_ms": round(max(latencies, default=0) * 1000, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pdf-size", type=int, default=64 * 1024 * 1024, help="Size of the uploaded PDF in bytes")
+    parser.add_argument("--upload-bandwidth", type=float, default=16 * 1024 * 1024,
+                        help="Bytes/second the fake Etsy accepts uploads at")
+    parser.add_argument("--latency", type=float, default=0.02, help="Added latency per fake response (s)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent probe workers")
+    parser.add_argument("--max-latency", type=float, default=0.5,
+                        help="Fail when any probe takes longer than this many seconds")
+    args = parser.parse_args(argv)
+
+    settings = FakeSettings(latency=args.latency, upload_bandwidth=args.upload_bandwidth)
+    with FakeServices(settings) as services, tempfile.TemporaryDirectory(prefix="booking-load-") as workdir:
+        pdf_path = os.path.join(workdir, "upload.pdf")
+        with open(pdf_path, "wb") as file:
+            file.write(fake_pdf(7, args.pdf_size))
+
+        app = AppProcess(services.env(), workdir).start()
+        try:
+            result = asyncio.run(run(app, pdf_path, args.concurrency))
+        finally:
+            app.stop()
+
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+    if "error" in result["upload"]:
+        print("FAIL: the upload itself failed")
+        return 1
+    if not result["probes"]:
+        print("FAIL: no request completed while the upload was running")
+        return 1
+    if result["probe_max_ms"] > args.max_latency * 1000:
+        print(f"FAIL: a request waited {result['probe_max_ms']} ms behind the upload (limit {args.max_latency * 1000:.0f} ms)")
+        return 1
+    print(f"OK: {result['probes']} requests served during a {result['upload_s']} s upload")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
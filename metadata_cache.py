@@ -0,0 +1,160 @@
+import copy
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+OPENLIBRARY_CACHE_PATH = os.getenv("OPENLIBRARY_CACHE_PATH", "openlibrary_cache.db")
+OPENLIBRARY_CACHE_SIZE = int(os.getenv("OPENLIBRARY_CACHE_SIZE", 2048))
+OPENLIBRARY_CACHE_TTL = int(os.getenv("OPENLIBRARY_CACHE_TTL", 30 * 24 * 3600))
+OPENLIBRARY_NEGATIVE_TTL = int(os.getenv("OPENLIBRARY_NEGATIVE_TTL", 24 * 3600))
+# How often expired and negative entries are deleted from the SQLite file
+OPENLIBRARY_CACHE_PURGE_INTERVAL = int(os.getenv("OPENLIBRARY_CACHE_PURGE_INTERVAL", 3600))
+
+
+def normalize_title(title: str) -> str:
+    """Lowercase, drop the subtitle and punctuation and collapse whitespace"""
+    title = title.split(':')[0].casefold()
+    title = re.sub(r"[^\w\s]", " ", title)
+    return " ".join(title.split())
+
+
+def normalize_isbn(isbn: str) -> str:
+    return re.sub(r"[^0-9Xx]", "", isbn).upper()
+
+
+def title_key(title: str) -> str:
+    return f"title:{normalize_title(title)}"
+
+
+def isbn_key(isbn: str) -> str:
+    return f"isbn:{normalize_isbn(isbn)}"
+
+
+class MetadataCache:
+    """
+    Two-tier cache for Open Library lookups: an in-process LRU in front of an
+    on-disk SQLite table, so resolved books survive restarts.
+
+    Entries carry their own expiry; negative results ("No book found") are
+    stored with a shorter TTL than real matches.
+
+    The memory tier (`get_memory`, `remember`) never waits on the disk, so async
+    callers can use it inline and send only `get_disk` / `persist` to a thread.
+    """
+
+    def __init__(self, path: str = OPENLIBRARY_CACHE_PATH, max_entries: int = OPENLIBRARY_CACHE_SIZE,
+                 ttl: int = OPENLIBRARY_CACHE_TTL, negative_ttl: int = OPENLIBRARY_NEGATIVE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "negative_hits": 0, "writes": 0}
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        # One lock for the LRU, one for SQLite, so a memory hit never queues behind a disk query
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, negative INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS metadata_expires_at ON metadata (expires_at)")
+        return self._db
+
+    def _remember(self, key: str, value: Dict[str, Any], negative: bool, expires_at: float):
+        self._memory[key] = (value, negative, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        """A copy of the value from the memory tier, or None (the disk may still have it)"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if not entry or entry[2] <= now:
+                self._memory.pop(key, None)
+                return None
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            if entry[1]:
+                self.stats["negative_hits"] += 1
+            return copy.deepcopy(entry[0])
+
+    def get_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        """A copy of the value from SQLite, or None when missing or expired; a hit is kept in memory"""
+        now = time.time()
+        with self._db_lock:
+            row = self.db.execute(
+                "SELECT value, negative, expires_at FROM metadata WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        with self._lock:
+            if not row:
+                self.stats["misses"] += 1
+                return None
+            entry = (json.loads(row[0]), bool(row[1]), row[2])
+            # A write that landed in memory while we read the disk is newer than this row
+            if key not in self._memory:
+                self._remember(key, *entry)
+            self.stats["disk_hits"] += 1
+            if entry[1]:
+                self.stats["negative_hits"] += 1
+        return copy.deepcopy(entry[0])
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached value, or None when missing or expired"""
+        value = self.get_memory(key)
+        return value if value is not None else self.get_disk(key)
+
+    def remember(self, key: str, value: Dict[str, Any], negative: bool = False,
+                 ttl: Optional[int] = None) -> Tuple[str, Dict[str, Any], bool, float]:
+        """Put an entry in the memory tier; returns the row `persist` writes to disk"""
+        if ttl is None:
+            ttl = self.negative_ttl if negative else self.ttl
+        row = (key, copy.deepcopy(value), negative, time.time() + ttl)
+        with self._lock:
+            self._remember(*row)
+        return row
+
+    def persist(self, rows: List[Tuple[str, Dict[str, Any], bool, float]]):
+        """Write rows from `remember` to SQLite in one statement"""
+        values = [(key, json.dumps(value), int(negative), expires_at) for key, value, negative, expires_at in rows]
+        with self._db_lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO metadata (key, value, negative, expires_at) VALUES (?, ?, ?, ?)", values
+            )
+        with self._lock:
+            self.stats["writes"] += len(values)
+
+    def set(self, key: str, value: Dict[str, Any], negative: bool = False, ttl: Optional[int] = None):
+        self.persist([self.remember(key, value, negative, ttl)])
+
+    def purge_expired(self) -> int:
+        """Drop expired entries from memory and disk; returns the number of rows deleted"""
+        now = time.time()
+        with self._lock:
+            for key in [key for key, entry in self._memory.items() if entry[2] <= now]:
+                del self._memory[key]
+        with self._db_lock:
+            return self.db.execute("DELETE FROM metadata WHERE expires_at <= ?", (now,)).rowcount
+
+    def summary(self) -> Dict[str, Any]:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hits": hits,
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            "memory_entries": len(self._memory),
+        }
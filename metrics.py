@@ -0,0 +1,279 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Request ID of the HTTP request (or job item) currently being handled. Context
+# variables follow asyncio tasks and `asyncio.to_thread`, so every log line and
+# outbound call made on its behalf sees the same ID.
+request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+def configure_logging(level: str = LOG_LEVEL):
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Base for labelled metrics; samples are keyed by the tuple of label values"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return [("", _format_labels(self.label_names, key), value) for key, value in self._values.items()]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels: str) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._histograms: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            # Per label set: one count per bucket (+Inf last), then sum and count
+            counts = self._histograms.setdefault(key, [0] * (len(self.buckets) + 3))
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        with self._lock:
+            for key, counts in self._histograms.items():
+                cumulative = 0
+                for bound, count in zip((*self.buckets, float("inf")), counts):
+                    cumulative += count
+                    labels = _format_labels((*self.label_names, "le"), (*key, _format_value(bound)))
+                    samples.append(("_bucket", labels, cumulative))
+                labels = _format_labels(self.label_names, key)
+                samples.append(("_sum", labels, counts[-2]))
+                samples.append(("_count", labels, counts[-1]))
+        return samples
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class CallbackMetric(Metric):
+    """Metric whose samples are read at scrape time from `collect()` -> {label values: value}"""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...],
+                 collect: Callable[[], Dict[Tuple[str, ...], float]], type: str = "gauge"):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+        self.type = type
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [("", _format_labels(self.label_names, key), value) for key, value in self.collect().items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(Histogram(
+    "booking_http_request_duration_seconds", "Latency of requests served by this app.",
+    ("method", "route", "status"),
+))
+HTTP_IN_FLIGHT = registry.register(Gauge(
+    "booking_http_requests_in_flight", "Requests currently being served by this app.",
+))
+
+OUTBOUND_REQUESTS = registry.register(Histogram(
+    "booking_outbound_request_duration_seconds", "Latency of calls to external services, per attempt.",
+    ("service", "operation", "status"),
+))
+OUTBOUND_IN_FLIGHT = registry.register(Gauge(
+    "booking_outbound_requests_in_flight", "Calls to external services currently in flight.", ("service",),
+))
+OUTBOUND_BYTES = registry.register(Counter(
+    "booking_outbound_bytes_total", "Bytes sent to and received from external services.", ("service", "direction"),
+))
+OUTBOUND_RETRIES = registry.register(Counter(
+    "booking_outbound_retries_total", "Retried calls to external services.", ("service", "reason"),
+))
+RATE_LIMITED = registry.register(Counter(
+    "booking_rate_limited_total", "Responses that told us to slow down (HTTP 429).", ("service",),
+))
+RATE_LIMIT_WAIT = registry.register(Counter(
+    "booking_rate_limit_wait_seconds_total", "Time spent waiting on the client-side rate limiter.", ("service",),
+))
+
+PIPELINE_STAGES = registry.register(Histogram(
+    "booking_pipeline_stage_duration_seconds", "Duration of listing pipeline stages.", ("stage", "outcome"),
+))
+PIPELINE_STAGES_IN_FLIGHT = registry.register(Gauge(
+    "booking_pipeline_stages_in_flight", "Listing pipeline stages currently running.", ("stage",),
+))
+
+_cache_sources: Dict[str, Callable[[], Tuple[float, float]]] = {}
+
+
+def register_cache(name: str, hits_and_misses: Callable[[], Tuple[float, float]]):
+    """Expose a cache's (hits, misses) as lookup counters and a hit ratio"""
+    _cache_sources[name] = hits_and_misses
+
+
+def _cache_lookups() -> Dict[Tuple[str, ...], float]:
+    samples = {}
+    for name, source in _cache_sources.items():
+        hits, misses = source()
+        samples[(name, "hit")] = hits
+        samples[(name, "miss")] = misses
+    return samples
+
+
+def _cache_hit_ratios() -> Dict[Tuple[str, ...], float]:
+    samples = {}
+    for name, source in _cache_sources.items():
+        hits, misses = source()
+        if hits + misses:
+            samples[(name,)] = round(hits / (hits + misses), 4)
+    return samples
+
+
+registry.register(CallbackMetric(
+    "booking_cache_lookups_total", "Cache lookups by result.", ("cache", "result"), _cache_lookups, type="counter",
+))
+registry.register(CallbackMetric(
+    "booking_cache_hit_ratio", "Share of cache lookups that were hits.", ("cache",), _cache_hit_ratios,
+))
+
+
+@contextmanager
+def outbound(service: str, operation: str) -> Iterator[Dict[str, Optional[object]]]:
+    """
+    Time one call to an external service. The caller fills in `call["status"]`
+    (and optionally `bytes_sent` / `bytes_received`) on the yielded dict; an
+    exception is recorded as status "error".
+    """
+    call: Dict[str, Optional[object]] = {"status": None, "bytes_sent": 0, "bytes_received": 0}
+    start = time.perf_counter()
+    OUTBOUND_IN_FLIGHT.inc(service=service)
+    try:
+        yield call
+    except BaseException:
+        call["status"] = call["status"] or "error"
+        raise
+    finally:
+        OUTBOUND_IN_FLIGHT.dec(service=service)
+        OUTBOUND_REQUESTS.observe(time.perf_counter() - start, service=service, operation=operation,
+                                  status=str(call["status"] or "ok"))
+        if call["bytes_sent"]:
+            OUTBOUND_BYTES.inc(call["bytes_sent"], service=service, direction="sent")
+        if call["bytes_received"]:
+            OUTBOUND_BYTES.inc(call["bytes_received"], service=service, direction="received")
+
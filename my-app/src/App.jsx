@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 // Add RefreshCw to imports
-import { BookOpen, Upload, ShoppingBag, Loader2, RefreshCw } from 'lucide-react';
+import { BookOpen, Upload, ShoppingBag, Loader2, RefreshCw, XCircle, CheckCircle2, Circle } from 'lucide-react';
 import { api } from './api';
 import toast from 'react-hot-toast';
 
@@ -15,6 +15,11 @@ function App() {
   const [step, setStep] = useState(1);
   const [bookData, setBookData] = useState(null);
 
+  // Job the running pipeline reports to, and its stages as the progress stream describes them
+  const [jobId, setJobId] = useState(null);
+  const [stages, setStages] = useState([]);
+  const [cancelling, setCancelling] = useState(false);
+
   // Add useEffect to check token status on mount
   useEffect(() => {
     checkToken();
@@ -48,67 +53,74 @@ function App() {
     }
   };
 
+  const updateStage = (name, changes) => {
+    setStages((current) => {
+      const index = current.findIndex((stage) => stage.name === name);
+      if (index === -1) return [...current, { name, status: 'started', ...changes }];
+      const next = [...current];
+      next[index] = { ...next[index], ...changes };
+      return next;
+    });
+  };
+
+  // Follow the job's server-sent events; the stream closes itself after "end"
+  const followJob = (id) => {
+    const source = api.followProgress(id);
+    source.addEventListener('stage', (event) => {
+      const { stage, status } = JSON.parse(event.data);
+      updateStage(stage, { status });
+    });
+    source.addEventListener('progress', (event) => {
+      const { stage, done, total } = JSON.parse(event.data);
+      updateStage(stage, { done, total });
+    });
+    source.addEventListener('end', (event) => {
+      // Stages still running when the job failed or was cancelled end with it
+      const { status } = JSON.parse(event.data);
+      if (status !== 'done') {
+        setStages((current) => current.map((stage) => (stage.status === 'started' ? { ...stage, status } : stage)));
+      }
+      source.close();
+    });
+    return source;
+  };
+
+  const handleCancel = async () => {
+    if (!jobId) return;
+    setCancelling(true);
+    try {
+      const response = await api.cancelJob(jobId);
+      if (response.error) throw new Error(response.error);
+    } catch (error) {
+      toast.error(error.message || 'Failed to cancel');
+      setCancelling(false);
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     if (!pdfUrl) return;
 
+    // Subscribe before starting so no stage is missed
+    const id = crypto.randomUUID();
+    setJobId(id);
+    setStages([]);
+    setCancelling(false);
+    const source = followJob(id);
+
     setLoading(true);
     try {
-      // Step 1: Get PDF and extract info
-      console.log('downloadeding pdf...');
-      const pdfResponse = await api.getBookPdf(pdfUrl);
-      if (pdfResponse.error) throw new Error(pdfResponse.error);
-      console.log(pdfResponse);
-
-      // Step 2: Search book details
-      console.log('searching book details...');
-      const bookDetails = await api.searchBook(pdfResponse.title);
-      setBookData(bookDetails);
-      
-      // Step 3: Generate description
-      console.log('generating description...');
-      console.log(bookDetails);
-      const descriptionData = await api.generateDescription(bookDetails);
-      
-      // Step 4: Get user/shop info
-      console.log('getting user info...');
-      const userData = await api.getUser();
-      
-      console.log('creating listing...');
-      // Step 5: Create listing
-      const listingData = await api.createListing(
-        userData.shop_id,
-        pdfResponse.title,
-        descriptionData.description
-      );
-
-      // Step 6: Upload cover image
-      // wait for 1sec to avoid rate limiting before uploading image
-      await new Promise((resolve) => setTimeout(resolve, 1000));
-      
-      console.log('uploading cover image...');
-      if (bookDetails.cover_image) {
-        await api.uploadListingImage(
-          userData.shop_id,
-          listingData.listing_id,
-          bookDetails.cover_image
-        );
+      // The server runs the whole flow (download, search, description,
+      // listing, uploads and cleanup) with independent stages overlapped
+      console.log('running listing pipeline...');
+      const result = await api.runPipeline(pdfUrl, id);
+      if (result.cancelled) {
+        toast('Listing cancelled');
+        return;
       }
-
-      // wait for 1sec to avoid rate limiting before uploading file
-      console.log('uploading pdf file...');
-      console.log(userData.shop_id, listingData, pdfResponse);
-      await new Promise((resolve) => setTimeout(resolve, 1000));
-      // Step 7: Upload PDF file
-      await api.uploadListingFile(
-        userData.shop_id,
-        listingData.listing_id,
-        pdfResponse.pdf
-      );
-
-      // Step 8: Clean up downloaded PDF
-      console.log('deleting pdf...');
-      await api.deletePdf(pdfResponse.pdf);
+      if (result.error) throw new Error(`${result.stage}: ${result.error}`);
+      console.log(result);
+      setBookData(result.book);
 
       toast.success('Listing created successfully!');
       setStep(1);
@@ -117,6 +129,9 @@ function App() {
     } catch (error) {
       toast.error(error.message || 'Something went wrong');
     } finally {
+      source.close();
+      setJobId(null);
+      setCancelling(false);
       setLoading(false);
     }
   };
@@ -220,9 +235,54 @@ function App() {
                       </>
                     )}
                   </button>
+                  {loading && jobId && (
+                    <button
+                      type="button"
+                      onClick={handleCancel}
+                      disabled={cancelling}
+                      className="inline-flex items-center gap-2 px-4 py-2 border border-[#E1E3DF] text-[#222222] rounded-lg hover:bg-[#FAF9F8] focus:outline-none focus:ring-2 focus:ring-[#F1641E] focus:ring-offset-2 disabled:opacity-50 disabled:cursor-not-allowed"
+                    >
+                      <XCircle className="w-5 h-5" />
+                      {cancelling ? 'Cancelling...' : 'Cancel'}
+                    </button>
+                  )}
                 </div>
               </div>
 
+              {stages.length > 0 && (
+                <ul className="space-y-2">
+                  {stages.map((stage) => (
+                    <li key={stage.name} className="text-sm">
+                      <div className="flex items-center gap-2">
+                        {stage.status === 'done' || stage.status === 'resumed' ? (
+                          <CheckCircle2 className="w-4 h-4 text-[#258635]" />
+                        ) : stage.status === 'failed' ? (
+                          <XCircle className="w-4 h-4 text-[#CC0000]" />
+                        ) : stage.status === 'started' ? (
+                          <Loader2 className="w-4 h-4 animate-spin text-[#F1641E]" />
+                        ) : (
+                          <Circle className="w-4 h-4 text-[#595959]" />
+                        )}
+                        <span className="text-[#222222] capitalize">{stage.name.replace(/_/g, ' ')}</span>
+                        {stage.total ? (
+                          <span className="ml-auto text-[#595959]">
+                            {Math.round((stage.done / stage.total) * 100)}%
+                          </span>
+                        ) : null}
+                      </div>
+                      {stage.total ? (
+                        <div className="mt-1 h-1.5 bg-[#E1E3DF] rounded-full overflow-hidden">
+                          <div
+                            className="h-full bg-[#F1641E]"
+                            style={{ width: `${Math.min(100, (stage.done / stage.total) * 100)}%` }}
+                          />
+                        </div>
+                      ) : null}
+                    </li>
+                  ))}
+                </ul>
+              )}
+
               {bookData && (
                 <div className="p-4 bg-[#FDEEE8] rounded-lg">
                   <h3 className="font-medium text-[#222222] mb-2">Book Details</h3>
@@ -3,6 +3,24 @@ import axios from 'axios';
 const BASE_URL = 'http://localhost:8000';
 
 export const api = {
+  async runPipeline(url, jobId) {
+    const response = await axios.post(`${BASE_URL}/listings/pipeline`, {
+      book_url: url,
+      job_id: jobId
+    });
+    return response.data;
+  },
+
+  // Server-sent events for a job: "stage" transitions, byte "progress" and a final "end"
+  followProgress(jobId) {
+    return new EventSource(`${BASE_URL}/progress/${jobId}`);
+  },
+
+  async cancelJob(jobId) {
+    const response = await axios.post(`${BASE_URL}/progress/${jobId}/cancel`);
+    return response.data;
+  },
+
   async getBookPdf(url) {
     const response = await axios.get(`${BASE_URL}/get-book-pdf`, {
       params: { book_url: url }
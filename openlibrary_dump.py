@@ -0,0 +1,399 @@
+"""
+Local Open Library index built from the bulk data dumps
+(https://openlibrary.org/developers/dumps), so title and ISBN lookups can be
+answered from disk instead of the public search API.
+
+    python openlibrary_dump.py --works ol_dump_works_latest.txt.gz \\
+        --editions ol_dump_editions_latest.txt.gz --authors ol_dump_authors_latest.txt.gz
+
+Set OPENLIBRARY_LOOKUP_MODE to "offline" or "offline-then-online" to use it.
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from statistics import median
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metadata_cache import normalize_isbn, normalize_title
+
+OPENLIBRARY_DUMP_INDEX = os.getenv("OPENLIBRARY_DUMP_INDEX", "openlibrary_dump.db")
+
+# "online" only asks the API, "offline" only the local index, "offline-then-online" the index first
+OPENLIBRARY_LOOKUP_MODE = os.getenv("OPENLIBRARY_LOOKUP_MODE", "online")
+LOOKUP_MODES = ("online", "offline", "offline-then-online")
+if OPENLIBRARY_LOOKUP_MODE not in LOOKUP_MODES:
+    # A typo would otherwise quietly mean "online"
+    raise ValueError(f"Unknown OPENLIBRARY_LOOKUP_MODE {OPENLIBRARY_LOOKUP_MODE!r}, "
+                     f"expected one of {', '.join(LOOKUP_MODES)}")
+
+# Editions read per work when assembling a result; enough for publishers, ISBNs and a page count
+EDITIONS_PER_WORK = 200
+
+YEAR = re.compile(r"\b(1[5-9]\d\d|20\d\d)\b")
+
+
+def _key(value: Any) -> Optional[str]:
+    """"/works/OL45883W" -> "OL45883W" (also accepts {"key": ...})"""
+    if isinstance(value, dict):
+        value = value.get("key")
+    return value.rsplit("/", 1)[-1] if isinstance(value, str) and value else None
+
+
+def _year(date: Any) -> Optional[int]:
+    match = YEAR.search(date) if isinstance(date, str) else None
+    return int(match.group(1)) if match else None
+
+
+def _compact(values: Iterable[Any]) -> Optional[str]:
+    values = [value for value in values if value]
+    return json.dumps(values, separators=(",", ":")) if values else None
+
+
+def read_dump(path: str) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    """(type, key, record) for every line of a (gzipped) dump: type, key, revision, last_modified, JSON"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            parts = line.rstrip("\n").split("\t", 4)
+            if len(parts) != 5:
+                continue
+            try:
+                yield parts[0], parts[1], json.loads(parts[4])
+            except ValueError:
+                continue
+
+
+SCHEMA = (
+    "CREATE TABLE authors (author_key TEXT PRIMARY KEY, name TEXT NOT NULL) WITHOUT ROWID",
+    "CREATE TABLE works (id INTEGER PRIMARY KEY, work_key TEXT NOT NULL, title TEXT NOT NULL, "
+    "norm_title TEXT NOT NULL, author_keys TEXT, subjects TEXT, first_publish_year INTEGER, cover_id INTEGER, "
+    "editions_count INTEGER NOT NULL DEFAULT 0)",
+    "CREATE TABLE editions (edition_key TEXT NOT NULL, work_key TEXT NOT NULL, title TEXT, author_keys TEXT, "
+    "publishers TEXT, publish_year INTEGER, isbn_10 TEXT, isbn_13 TEXT, languages TEXT, pages INTEGER, "
+    "cover_id INTEGER)",
+    "CREATE TABLE isbns (isbn TEXT PRIMARY KEY, edition_rowid INTEGER NOT NULL) WITHOUT ROWID",
+    "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)",
+)
+
+# Created once the rows are in: bulk inserts into unindexed tables are much faster
+INDEXES = (
+    "CREATE UNIQUE INDEX works_key ON works (work_key)",
+    "CREATE INDEX works_title ON works (norm_title, editions_count DESC)",
+    "CREATE INDEX editions_work ON editions (work_key)",
+)
+
+
+class DumpImporter:
+    """
+    Streams the authors, works and editions dumps into a compact SQLite index:
+    only the fields `searchbook` reports are kept, works get an exact
+    normalized-title index plus an FTS5 title index, and every ISBN points at
+    its edition. The index is built next to the target and swapped in when
+    complete, so a running app never sees a half-built file.
+    """
+
+    def __init__(self, path: str = OPENLIBRARY_DUMP_INDEX, batch_size: int = 20000):
+        self.path = path
+        self.batch_size = batch_size
+        self.stats = {"authors": 0, "works": 0, "editions": 0, "isbns": 0}
+
+    def _batches(self, rows: Iterable[tuple]) -> Iterator[List[tuple]]:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _insert(self, db: sqlite3.Connection, sql: str, rows: Iterable[tuple], counter: str):
+        for batch in self._batches(rows):
+            db.execute("BEGIN")
+            db.executemany(sql, batch)
+            db.execute("COMMIT")
+            self.stats[counter] += len(batch)
+
+    @staticmethod
+    def _authors(path: str) -> Iterator[tuple]:
+        for kind, key, record in read_dump(path):
+            if kind == "/type/author" and record.get("name"):
+                yield _key(key), record["name"]
+
+    @staticmethod
+    def _works(path: str) -> Iterator[tuple]:
+        for kind, key, record in read_dump(path):
+            title = record.get("title")
+            if kind != "/type/work" or not title or not normalize_title(title):
+                continue
+            authors = [_key(entry.get("author")) for entry in record.get("authors", []) if isinstance(entry, dict)]
+            covers = [cover for cover in record.get("covers", []) if isinstance(cover, int) and cover > 0]
+            yield (_key(key), title, normalize_title(title), _compact(authors), _compact(record.get("subjects", [])),
+                   _year(record.get("first_publish_date")), covers[0] if covers else None)
+
+    @staticmethod
+    def _editions(path: str) -> Iterator[tuple]:
+        for kind, key, record in read_dump(path):
+            if kind != "/type/edition":
+                continue
+            works = record.get("works") or []
+            # An edition without a work stands in for its own work
+            work_key = _key(works[0]) if works else _key(key)
+            covers = [cover for cover in record.get("covers", []) if isinstance(cover, int) and cover > 0]
+            pages = record.get("number_of_pages")
+            yield (
+                _key(key), work_key, record.get("title"),
+                _compact(_key(author) for author in record.get("authors", [])),
+                _compact(record.get("publishers", [])), _year(record.get("publish_date")),
+                _compact(normalize_isbn(isbn) for isbn in record.get("isbn_10", []) if isinstance(isbn, str)),
+                _compact(normalize_isbn(isbn) for isbn in record.get("isbn_13", []) if isinstance(isbn, str)),
+                _compact(_key(language) for language in record.get("languages", [])),
+                pages if isinstance(pages, int) and pages > 0 else None,
+                covers[0] if covers else None,
+            )
+
+    def run(self, works: Optional[str] = None, editions: Optional[str] = None,
+            authors: Optional[str] = None) -> Dict[str, Any]:
+        started = time.time()
+        tmp_path = f"{self.path}.building"
+        for leftover in (tmp_path, f"{tmp_path}-journal"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+        db = sqlite3.connect(tmp_path, isolation_level=None)
+        try:
+            # Nothing to recover if the import dies half way: it is simply run again
+            db.execute("PRAGMA journal_mode=OFF")
+            db.execute("PRAGMA synchronous=OFF")
+            db.execute("PRAGMA cache_size=-262144")
+            for statement in SCHEMA:
+                db.execute(statement)
+
+            # Step 1: Load the rows
+            if authors:
+                self._insert(db, "INSERT OR REPLACE INTO authors VALUES (?, ?)", self._authors(authors), "authors")
+            if works:
+                self._insert(db, "INSERT INTO works (work_key, title, norm_title, author_keys, subjects, "
+                                 "first_publish_year, cover_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             self._works(works), "works")
+            if editions:
+                self._insert(db, "INSERT INTO editions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             self._editions(editions), "editions")
+
+            # Step 2: Index them, then derive what lookups rank and join on
+            db.execute("BEGIN")
+            for statement in INDEXES:
+                db.execute(statement)
+            # Editions whose work isn't in the works dump become works of their own
+            db.execute(
+                "INSERT INTO works (work_key, title, norm_title, author_keys) "
+                "SELECT work_key, title, '', author_keys FROM editions "
+                "WHERE title IS NOT NULL AND work_key NOT IN (SELECT work_key FROM works) GROUP BY work_key"
+            )
+            orphans = db.execute("SELECT id, title FROM works WHERE norm_title = ''").fetchall()
+            db.executemany("UPDATE works SET norm_title = ? WHERE id = ?",
+                           [(normalize_title(title), work_id) for work_id, title in orphans])
+            db.execute(
+                "UPDATE works SET editions_count = (SELECT COUNT(*) FROM editions WHERE editions.work_key = works.work_key)"
+            )
+            db.execute(
+                "INSERT OR IGNORE INTO isbns (isbn, edition_rowid) "
+                "SELECT value, editions.rowid FROM editions, json_each(editions.isbn_13) "
+                "UNION ALL SELECT value, editions.rowid FROM editions, json_each(editions.isbn_10)"
+            )
+            self.stats["isbns"] = db.execute("SELECT COUNT(*) FROM isbns").fetchone()[0]
+            self.stats["works"] = db.execute("SELECT COUNT(*) FROM works").fetchone()[0]
+            db.execute("COMMIT")
+
+            # Step 3: Full-text index over work titles (external content: the titles aren't stored twice)
+            db.execute("CREATE VIRTUAL TABLE works_fts USING fts5(norm_title, content='works', content_rowid='id')")
+            db.execute("INSERT INTO works_fts (works_fts) VALUES ('rebuild')")
+            db.execute("INSERT INTO works_fts (works_fts) VALUES ('optimize')")
+
+            db.execute("BEGIN")
+            db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+                ("built_at", str(time.time())),
+                ("sources", json.dumps({"works": works, "editions": editions, "authors": authors})),
+                ("stats", json.dumps(self.stats)),
+            ])
+            db.execute("COMMIT")
+            db.execute("ANALYZE")
+        finally:
+            db.close()
+
+        os.replace(tmp_path, self.path)
+        return {**self.stats, "path": self.path, "duration": round(time.time() - started, 1)}
+
+
+class DumpIndex:
+    """
+    Read-only lookups against the index built by `DumpImporter`. Results have
+    the shape of an Open Library `search.json` response ({"docs": [...]}), so
+    `searchbook` turns them into `book_details` the same way as API answers.
+    A rebuilt index file is picked up automatically.
+    """
+
+    def __init__(self, path: str = OPENLIBRARY_DUMP_INDEX):
+        self.path = path
+        self.stats = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._mtime: Optional[float] = None
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(self.path)
+
+    @property
+    def db(self) -> Optional[sqlite3.Connection]:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+        if self._db is None or mtime != self._mtime:
+            if self._db is not None:
+                self._db.close()
+            self._db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._mtime = mtime
+        return self._db
+
+    def _doc(self, db: sqlite3.Connection, work: sqlite3.Row, edition_rowid: Optional[int] = None) -> Dict[str, Any]:
+        """A search.json-style doc for `work`; the edition we matched on (if any) leads the ISBN list"""
+        editions = db.execute(
+            "SELECT rowid, * FROM editions WHERE work_key = ? ORDER BY rowid = ? DESC LIMIT ?",
+            (work["work_key"], edition_rowid or -1, EDITIONS_PER_WORK),
+        ).fetchall()
+
+        publishers, isbns, languages, pages, years = [], [], [], [], []
+        for edition in editions:
+            for value in json.loads(edition["publishers"] or "[]"):
+                if value not in publishers:
+                    publishers.append(value)
+            isbns.extend(json.loads(edition["isbn_13"] or "[]") + json.loads(edition["isbn_10"] or "[]"))
+            for value in json.loads(edition["languages"] or "[]"):
+                if value not in languages:
+                    languages.append(value)
+            if edition["pages"]:
+                pages.append(edition["pages"])
+            if edition["publish_year"]:
+                years.append(edition["publish_year"])
+
+        author_keys = json.loads(work["author_keys"] or "[]")
+        if not author_keys and editions:
+            author_keys = json.loads(editions[0]["author_keys"] or "[]")
+        names = {
+            row["author_key"]: row["name"]
+            for row in db.execute(
+                f"SELECT author_key, name FROM authors WHERE author_key IN ({','.join('?' * len(author_keys))})",
+                author_keys,
+            )
+        } if author_keys else {}
+
+        doc: Dict[str, Any] = {"key": f"/works/{work['work_key']}", "title": work["title"]}
+        if names:
+            doc["author_name"] = [names[key] for key in author_keys if key in names]
+        first_year = work["first_publish_year"] or (min(years) if years else None)
+        if first_year:
+            doc["first_publish_year"] = first_year
+        if publishers:
+            doc["publisher"] = publishers
+        if isbns:
+            doc["isbn"] = list(dict.fromkeys(isbns))
+        if languages:
+            doc["language"] = languages
+        if pages:
+            doc["number_of_pages_median"] = int(median(pages))
+        if work["subjects"]:
+            doc["subject"] = json.loads(work["subjects"])
+        cover = work["cover_id"] or next((edition["cover_id"] for edition in editions if edition["cover_id"]), None)
+        if cover:
+            doc["cover_i"] = cover
+        return doc
+
+    def _result(self, db: sqlite3.Connection, work: Optional[sqlite3.Row],
+                edition_rowid: Optional[int] = None) -> Dict[str, Any]:
+        if work is None:
+            self.stats["misses"] += 1
+            return {"numFound": 0, "docs": []}
+        self.stats["hits"] += 1
+        return {"numFound": 1, "docs": [self._doc(db, work, edition_rowid)]}
+
+    def search_title(self, title: str) -> Optional[Dict[str, Any]]:
+        """Exact normalized title first (most editions wins), then a full-text match; None without an index"""
+        normalized = normalize_title(title)
+        with self._lock:
+            db = self.db
+            if db is None:
+                return None
+            work = db.execute(
+                "SELECT * FROM works WHERE norm_title = ? ORDER BY editions_count DESC LIMIT 1", (normalized,)
+            ).fetchone()
+            if work is None and normalized:
+                query = " ".join(f'"{token}"' for token in normalized.split())
+                work = db.execute(
+                    "SELECT works.* FROM works_fts JOIN works ON works.id = works_fts.rowid "
+                    "WHERE works_fts MATCH ? ORDER BY bm25(works_fts), works.editions_count DESC LIMIT 1",
+                    (query,),
+                ).fetchone()
+            return self._result(db, work)
+
+    def search_isbn(self, isbn: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            db = self.db
+            if db is None:
+                return None
+            edition = db.execute(
+                "SELECT editions.rowid, editions.work_key FROM isbns JOIN editions ON editions.rowid = isbns.edition_rowid "
+                "WHERE isbns.isbn = ?",
+                (normalize_isbn(isbn),),
+            ).fetchone()
+            work = db.execute(
+                "SELECT * FROM works WHERE work_key = ?", (edition["work_key"],)
+            ).fetchone() if edition else None
+            return self._result(db, work, edition["rowid"] if edition else None)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            db = self.db
+            if db is None:
+                return {"available": False, "mode": OPENLIBRARY_LOOKUP_MODE}
+            meta = dict(db.execute("SELECT key, value FROM meta").fetchall())
+        return {
+            "available": True,
+            "mode": OPENLIBRARY_LOOKUP_MODE,
+            "path": self.path,
+            "built_at": float(meta["built_at"]) if meta.get("built_at") else None,
+            "counts": json.loads(meta.get("stats") or "{}"),
+            **self.stats,
+        }
+
+
+dump_index = DumpIndex()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the local Open Library index from the data dumps")
+    parser.add_argument("--works", help="ol_dump_works_*.txt.gz")
+    parser.add_argument("--editions", help="ol_dump_editions_*.txt.gz")
+    parser.add_argument("--authors", help="ol_dump_authors_*.txt.gz (for author names)")
+    parser.add_argument("--index", default=OPENLIBRARY_DUMP_INDEX, help="Index file to write")
+    parser.add_argument("--batch-size", type=int, default=20000, help="Rows per insert transaction")
+    args = parser.parse_args(argv)
+    if not (args.works or args.editions):
+        parser.error("at least one of --works or --editions is required")
+
+    result = DumpImporter(args.index, args.batch_size).run(args.works, args.editions, args.authors)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from metrics import OUTBOUND_BYTES, OUTBOUND_RETRIES, outbound
+
+# Files at least this large are fetched as PDF_DOWNLOAD_SEGMENTS parallel Range requests
+PDF_DOWNLOAD_SEGMENTS = int(os.getenv("PDF_DOWNLOAD_SEGMENTS", 4))
+PDF_SEGMENT_MIN_SIZE = int(os.getenv("PDF_SEGMENT_MIN_SIZE", 8 * 1024 * 1024))
+PDF_DOWNLOAD_RETRIES = int(os.getenv("PDF_DOWNLOAD_RETRIES", 3))
+
+# Write sizes adapt between these bounds: fast links get big writes, slow ones keep resume points close together
+PDF_CHUNK_MIN = int(os.getenv("PDF_CHUNK_MIN", 64 * 1024))
+PDF_CHUNK_MAX = int(os.getenv("PDF_CHUNK_MAX", 4 * 1024 * 1024))
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+Progress = Callable[[int, Optional[int]], Any]
+
+
+class DownloadError(Exception):
+    """Raised when a download can't be completed; the `.part` file is kept for the next attempt"""
+
+
+class UnexpectedContentType(DownloadError):
+    """Raised when the server answers with something other than the expected content type"""
+
+
+class AdaptiveChunker:
+    """Buffer network reads into writes sized by how fast the buffer fills up"""
+
+    def __init__(self, minimum: int = PDF_CHUNK_MIN, maximum: int = PDF_CHUNK_MAX):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = minimum
+        self._filled_since = time.perf_counter()
+
+    def adapt(self):
+        elapsed = time.perf_counter() - self._filled_since
+        if elapsed < 0.05:
+            self.size = min(self.maximum, self.size * 2)
+        elif elapsed > 0.5:
+            self.size = max(self.minimum, self.size // 2)
+        self._filled_since = time.perf_counter()
+
+
+def _pwrite(path: str, offset: int, data: bytes):
+    with open(path, "r+b") as file:
+        file.seek(offset)
+        file.write(data)
+
+
+def _append(path: str, data: bytes):
+    with open(path, "ab") as file:
+        file.write(data)
+
+
+def _hash_prefix(path: str, length: int) -> Any:
+    """SHA-256 object fed with the first `length` bytes of `path`"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while length > 0:
+            chunk = file.read(min(length, 1024 * 1024))
+            if not chunk:
+                break
+            digest.update(chunk)
+            length -= len(chunk)
+    return digest
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _allocate(path: str, size: int):
+    with open(path, "ab") as file:
+        file.truncate(size)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+def _remove(*paths: str):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class RangedDownload:
+    """
+    Download one URL into `part_path`, resumably.
+
+    A leftover `.part` file is continued with `Range: bytes=<size>-` when the
+    server answers 206, and restarted from zero when it ignores ranges. Large
+    files on servers that support ranges are split into parallel segments
+    whose progress is kept in a `.segments` sidecar, so a segmented download
+    resumes per segment too. The final size is checked against the length the
+    server announced.
+
+    A file written front to back (one stream, resumed or not) is hashed as the
+    bytes are written, and `sha256` holds its hex digest once `run` returns;
+    segments land out of order, so a segmented download leaves it None.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, url: str, part_path: str, headers: Optional[Dict[str, str]] = None,
+                 content_type: Optional[str] = None, progress: Optional[Progress] = None,
+                 segments: int = PDF_DOWNLOAD_SEGMENTS, segment_min_size: int = PDF_SEGMENT_MIN_SIZE,
+                 retries: int = PDF_DOWNLOAD_RETRIES, service: str = "pdfdrive", key: Optional[str] = None):
+        self.client = client
+        self.url = url
+        # What the `.part` file holds; pdfdrive links carry a per-visit session, so callers pass the book URL
+        self.key = key or url
+        self.part_path = part_path
+        self.sidecar_path = f"{part_path}.segments"
+        self.headers = dict(headers or {})
+        self.content_type = content_type
+        self.progress = progress
+        self.segments = max(1, segments)
+        self.segment_min_size = segment_min_size
+        self.retries = retries
+        self.service = service
+        self.total: Optional[int] = None
+        self.done = 0
+        self.sha256: Optional[str] = None
+        # SHA-256 of the `.part` file's first `_hashed` bytes while it is written in order
+        self._digest: Any = None
+        self._hashed = 0
+
+    def _report(self, received: int):
+        self.done += received
+        OUTBOUND_BYTES.inc(received, service=self.service, direction="received")
+        if self.progress:
+            self.progress(self.done, self.total)
+
+    async def _open(self, start: int = 0, end: Optional[int] = None) -> httpx.Response:
+        # Always ask for a range, even from byte 0: a 206 is how we learn the server supports them
+        headers = {**self.headers, "Range": f"bytes={start}-{'' if end is None else end}"}
+        with outbound(self.service, "pdf") as call:
+            response = await self.client.send(self.client.build_request("GET", self.url, headers=headers), stream=True)
+            call["status"] = response.status_code
+        if response.status_code == 416 and start and end is None:
+            # Nothing left past `start`: the `.part` file is already whole, or belongs to a different file
+            return response
+        if response.status_code not in (200, 206):
+            await response.aclose()
+            raise DownloadError(f"Download failed with HTTP {response.status_code}")
+        media_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        if self.content_type and media_type != self.content_type:
+            await response.aclose()
+            raise UnexpectedContentType(f"Expected {self.content_type}, got {media_type or 'no content type'}")
+        return response
+
+    @staticmethod
+    def _content_range(response: httpx.Response) -> Tuple[Optional[int], Optional[int]]:
+        """(first byte, total size) of a 206 response"""
+        match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+        if not match:
+            return None, None
+        return int(match.group(1)), None if match.group(3) == "*" else int(match.group(3))
+
+    async def _write_stream(self, response: httpx.Response, write: Callable[[bytes], Any],
+                            limit: Optional[int] = None) -> int:
+        """Copy a response body (up to `limit` bytes) through `write` in adaptively sized chunks"""
+        chunker = AdaptiveChunker()
+        buffer = bytearray()
+        written = 0
+
+        async def flush():
+            nonlocal written
+            await write(bytes(buffer))
+            written += len(buffer)
+            self._report(len(buffer))
+            buffer.clear()
+
+        try:
+            async for data in response.aiter_bytes():
+                if limit is not None:
+                    data = data[:limit - written - len(buffer)]
+                buffer += data
+                if len(buffer) >= chunker.size:
+                    await flush()
+                    chunker.adapt()
+                if limit is not None and written + len(buffer) >= limit:
+                    break
+        finally:
+            # Keep whatever arrived before a dropped connection; the next attempt resumes after it
+            if buffer:
+                await flush()
+        return written
+
+    async def _single(self, response: httpx.Response, offset: int):
+        """Continue the `.part` file from `offset` with an already opened response"""
+        if offset == 0:
+            self._digest, self._hashed = hashlib.sha256(), 0
+        elif self._digest is None or self._hashed != offset:
+            # A `.part` left by another process: hash what is already there once, then carry on as it arrives
+            try:
+                self._digest = await asyncio.to_thread(_hash_prefix, self.part_path, offset)
+            except BaseException:
+                await response.aclose()
+                raise
+            self._hashed = offset
+
+        def append(data):
+            _append(self.part_path, data)
+            self._digest.update(data)
+            self._hashed += len(data)
+
+        async def write(data):
+            await asyncio.to_thread(append, data)
+
+        try:
+            await self._write_stream(response, write)
+        finally:
+            await response.aclose()
+
+    async def _segment(self, segment: Dict[str, int], response: Optional[httpx.Response] = None):
+        start = segment["start"] + segment["done"]
+        if start > segment["end"]:
+            return
+        response = response or await self._open(start, segment["end"])
+        if response.status_code != 206:
+            await response.aclose()
+            raise DownloadError("Server stopped honouring Range requests")
+
+        async def write(data):
+            await asyncio.to_thread(_pwrite, self.part_path, segment["start"] + segment["done"], data)
+            segment["done"] += len(data)
+
+        try:
+            await self._write_stream(response, write, limit=segment["end"] - start + 1)
+        finally:
+            await response.aclose()
+
+    async def _segmented(self, plan: Dict[str, Any], first: Optional[httpx.Response] = None):
+        """Fetch the plan's unfinished segments in parallel; `first` is an open response for segment one"""
+        self._digest = None
+        responses = [first] + [None] * (len(plan["segments"]) - 1)
+        try:
+            # Let every segment get as far as it can before reporting a failure
+            results = await asyncio.gather(
+                *(self._segment(segment, response) for segment, response in zip(plan["segments"], responses)),
+                return_exceptions=True,
+            )
+        finally:
+            # Record how far every segment got, even when one of them failed
+            await asyncio.to_thread(_write_json, self.sidecar_path, plan)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def _plan(self, total: int) -> Dict[str, Any]:
+        size = -(-total // self.segments)
+        segments = [
+            {"start": start, "end": min(total, start + size) - 1, "done": 0}
+            for start in range(0, total, size)
+        ]
+        return {"key": self.key, "total": total, "segments": segments}
+
+    async def _attempt(self):
+        plan = await asyncio.to_thread(_read_json, self.sidecar_path)
+        if plan and plan.get("key") == self.key and _size(self.part_path) == plan["total"]:
+            # Resume a segmented download where each segment stopped
+            self.total = plan["total"]
+            self.done = sum(segment["done"] for segment in plan["segments"])
+            await self._segmented(plan)
+            return
+
+        if plan:
+            # Segments of some other file; their bytes can't be trusted
+            await asyncio.to_thread(_remove, self.part_path, self.sidecar_path)
+        offset = await asyncio.to_thread(_size, self.part_path)
+        response = await self._open(offset)
+        if response.status_code == 416:
+            await response.aclose()
+            unsatisfied = re.match(r"bytes \*/(\d+)", response.headers.get("Content-Range", ""))
+            if unsatisfied and int(unsatisfied.group(1)) == offset:
+                # A previous attempt got every byte but stopped before handing the file over
+                self.total = self.done = offset
+                return
+            await asyncio.to_thread(_remove, self.part_path)
+            raise DownloadError("Partial download did not match the remote file, starting over")
+        first, total = self._content_range(response)
+
+        if response.status_code == 206 and first == offset:
+            self.total = total
+            self.done = offset
+            if offset == 0 and total and self.segments > 1 and total >= self.segment_min_size:
+                # Ranges work and the file is big: this response becomes the first of several parallel segments
+                plan = self._plan(total)
+                try:
+                    # The sidecar goes down first: a full-size `.part` without one would look finished
+                    await asyncio.to_thread(_write_json, self.sidecar_path, plan)
+                    await asyncio.to_thread(_allocate, self.part_path, total)
+                except BaseException:
+                    await response.aclose()
+                    raise
+                await self._segmented(plan, response)
+                return
+            await self._single(response, offset)
+            return
+
+        # A plain 200: the server ignored the range, start over from byte 0
+        length = response.headers.get("Content-Length")
+        self.total = int(length) if length and not response.headers.get("Content-Encoding") else None
+        self.done = 0
+        await asyncio.to_thread(_remove, self.part_path)
+        await self._single(response, 0)
+
+    async def run(self) -> str:
+        """Download to `part_path` and return it once complete and verified"""
+        attempt = 0
+        while True:
+            try:
+                await self._attempt()
+                break
+            except UnexpectedContentType:
+                raise
+            except (httpx.TransportError, DownloadError) as e:
+                if attempt >= self.retries:
+                    raise DownloadError(f"Download of {self.url} failed after {attempt + 1} attempts: {e}") from e
+                OUTBOUND_RETRIES.inc(service=self.service, reason="download")
+                await asyncio.sleep(random.uniform(0, min(10.0, 0.5 * 2 ** attempt)))
+                attempt += 1
+
+        size = await asyncio.to_thread(_size, self.part_path)
+        if self.total is not None and size != self.total:
+            raise DownloadError(f"Downloaded {size} bytes, expected {self.total}")
+        await asyncio.to_thread(_remove, self.sidecar_path)
+        if self._digest is not None and self._hashed == size:
+            self.sha256 = self._digest.hexdigest()
+        return self.part_path
@@ -0,0 +1,369 @@
+import mmap
+import os
+import re
+import zlib
+from typing import Any, Dict, List, Optional
+
+# How much of the file is scanned for the first pages' content streams
+PDF_METADATA_SCAN_BYTES = int(os.getenv("PDF_METADATA_SCAN_BYTES", 8 * 1024 * 1024))
+PDF_METADATA_MAX_STREAMS = int(os.getenv("PDF_METADATA_MAX_STREAMS", 40))
+
+INFO_REF = re.compile(rb"/Info\s+(\d+)\s+(\d+)\s+R")
+XMP_PACKET = re.compile(rb"<x:xmpmeta.*?</x:xmpmeta>", re.S)
+# "endstream" ends in "stream" too; only the keyword that opens a stream counts
+STREAM = re.compile(rb"(?<!end)stream\r?\n")
+ISBN = re.compile(
+    r"ISBN(?:-1[03])?\s*(?:\(\w+\))?[:\s]*((?:97[89][\s-]?)?(?:\d[\s-]?){9}[\dXx])"
+    r"|\b(97[89][\s-]?(?:\d[\s-]?){9}\d)\b",
+    re.I,
+)
+TEXT_STRING = re.compile(rb"\((?:\\.|[^\\)])*\)")
+ROOT_REF = re.compile(rb"/Root\s+(\d+)\s+(\d+)\s+R")
+METADATA_REF = re.compile(rb"/Metadata\s+(\d+)\s+(\d+)\s+R")
+STARTXREF = re.compile(rb"startxref\s+(\d+)")
+XREF_SUBSECTION = re.compile(rb"\s*(\d+)\s+(\d+)[ \t]*\r?\n")
+XREF_ENTRY = re.compile(rb"\s*(\d{10})\s+(\d{5})\s+([nf])")
+OBJECT = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj(.*?)endobj", re.S)
+
+# The trailer and xref sit in the last (or, for linearized files, first) few KB,
+# and objects are read from their xref offset a window at a time
+WINDOW = 64 * 1024
+MAX_XREF_SECTIONS = 32
+
+
+def _valid_isbn(isbn: str) -> bool:
+    if len(isbn) == 10:
+        if not isbn[:9].isdigit() or not (isbn[9].isdigit() or isbn[9] == "X"):
+            return False
+        total = sum((10 - i) * (10 if c == "X" else int(c)) for i, c in enumerate(isbn))
+        return total % 11 == 0
+    if len(isbn) == 13 and isbn.isdigit():
+        total = sum(int(c) * (1 if i % 2 == 0 else 3) for i, c in enumerate(isbn))
+        return total % 10 == 0
+    return False
+
+
+def find_isbns(text: str) -> List[str]:
+    """Valid ISBN-10/13s in `text`, in order of appearance"""
+    isbns = []
+    for match in ISBN.finditer(text):
+        isbn = re.sub(r"[\s-]", "", match.group(1) or match.group(2)).upper()
+        if _valid_isbn(isbn) and isbn not in isbns:
+            isbns.append(isbn)
+    return isbns
+
+
+def _decode_literal(raw: bytes) -> str:
+    """Decode a PDF literal string body (without the outer parentheses)"""
+    out = bytearray()
+    i = 0
+    while i < len(raw):
+        c = raw[i]
+        if c == 0x5C and i + 1 < len(raw):  # backslash
+            n = raw[i + 1]
+            escapes = {ord("n"): 10, ord("r"): 13, ord("t"): 9, ord("b"): 8, ord("f"): 12}
+            if n in escapes:
+                out.append(escapes[n])
+                i += 2
+            elif 0x30 <= n <= 0x37:
+                digits = re.match(rb"[0-7]{1,3}", raw[i + 1:i + 4]).group(0)
+                out.append(int(digits, 8) & 0xFF)
+                i += 1 + len(digits)
+            elif n in (0x0A, 0x0D):
+                i += 2
+            else:
+                out.append(n)
+                i += 2
+        else:
+            out.append(c)
+            i += 1
+    return _decode_text(bytes(out))
+
+
+def _decode_text(data: bytes) -> str:
+    if data.startswith(b"\xfe\xff"):
+        return data[2:].decode("utf-16-be", "ignore")
+    if data.startswith(b"\xef\xbb\xbf"):
+        return data[3:].decode("utf-8", "ignore")
+    return data.decode("latin-1")
+
+
+def _info_value(info: bytes, key: bytes) -> Optional[str]:
+    match = re.search(rb"/" + key + rb"\s*(\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>)", info)
+    if not match:
+        return None
+    value = match.group(1)
+    if value.startswith(b"<"):
+        digits = re.sub(rb"\s", b"", value[1:-1]).decode()
+        # An odd number of hex digits means the last one is followed by an implicit 0
+        text = _decode_text(bytes.fromhex(digits + "0" * (len(digits) % 2)))
+    else:
+        text = _decode_literal(value[1:-1])
+    text = text.strip().strip("\x00")
+    return text or None
+
+
+def _int(pattern: bytes, data: bytes, default: int = 0) -> int:
+    match = re.search(rb"/" + pattern + rb"\s+(\d+)", data)
+    return int(match.group(1)) if match else default
+
+
+def _stream_data(obj: bytes) -> Optional[bytes]:
+    """The (Flate-decoded) data of a stream object body, or None"""
+    match = STREAM.search(obj)
+    if not match:
+        return None
+    end = obj.rfind(b"endstream")
+    raw = obj[match.end():end if end > 0 else len(obj)]
+    if b"/FlateDecode" in obj[:match.start()]:
+        try:
+            raw = zlib.decompress(raw)
+        except zlib.error:
+            return None
+        columns = _int(b"Columns", obj[:match.start()], 1)
+        if _int(b"Predictor", obj[:match.start()], 1) >= 10:
+            raw = _png_unpredict(raw, columns)
+    return raw
+
+
+def _png_unpredict(data: bytes, columns: int) -> bytes:
+    """Undo the PNG row predictors xref streams are usually written with"""
+    rows, previous = [], bytearray(columns)
+    for start in range(0, len(data) - columns, columns + 1):
+        kind, row = data[start], bytearray(data[start + 1:start + 1 + columns])
+        for i in range(len(row)):
+            left = row[i - 1] if i else 0
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif kind == 2:
+                row[i] = (row[i] + previous[i]) & 0xFF
+            elif kind == 3:
+                row[i] = (row[i] + (left + previous[i]) // 2) & 0xFF
+            elif kind == 4:
+                up_left = previous[i - 1] if i else 0
+                estimate = left + previous[i] - up_left
+                row[i] = (row[i] + min((left, previous[i], up_left),
+                                       key=lambda value: abs(estimate - value))) & 0xFF
+        rows.append(bytes(row))
+        previous = row
+    return b"".join(rows)
+
+
+class _Objects:
+    """
+    Random access to a PDF's objects through its cross-reference data
+    (classic tables, xref streams and object streams, following /Prev), so
+    only the trailer, the xref sections and the objects asked for are read.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.offsets: Dict[int, tuple] = {}
+        self.trailer = b""
+        tail = data[max(0, self.size - WINDOW):]
+        starts = list(STARTXREF.finditer(tail))
+        offset = int(starts[-1].group(1)) if starts else None
+        for _ in range(MAX_XREF_SECTIONS):
+            if offset is None or offset >= self.size:
+                break
+            section = self._xref_table(offset) if data[offset:offset + 4] == b"xref" else self._xref_stream(offset)
+            if section is None:
+                break
+            # The newest section (read first) has the newest trailer and object versions
+            self.trailer = self.trailer or section
+            prev = re.search(rb"/Prev\s+(\d+)", section)
+            offset = int(prev.group(1)) if prev else None
+
+    def _xref_table(self, offset: int) -> Optional[bytes]:
+        position = offset + 4
+        while True:
+            subsection = XREF_SUBSECTION.match(self.data, position)
+            if not subsection:
+                break
+            first, count = int(subsection.group(1)), int(subsection.group(2))
+            position = subsection.end()
+            for number in range(first, first + count):
+                entry = XREF_ENTRY.match(self.data, position)
+                if not entry:
+                    return None
+                position = entry.end()
+                if entry.group(3) == b"n":
+                    self.offsets.setdefault(number, (1, int(entry.group(1)), int(entry.group(2))))
+        trailer = re.match(rb"\s*trailer(.*?)(?:startxref|$)", self.data[position:position + WINDOW], re.S)
+        return trailer.group(1) if trailer else None
+
+    def _xref_stream(self, offset: int) -> Optional[bytes]:
+        obj = OBJECT.match(self.data[offset:offset + WINDOW * 16])
+        if not obj or b"/XRef" not in obj.group(3):
+            return None
+        body = obj.group(3)
+        stream = _stream_data(body)
+        widths = re.search(rb"/W\s*\[\s*(\d+)\s+(\d+)\s+(\d+)\s*\]", body)
+        if stream is None or not widths:
+            return None
+        widths = [int(width) for width in widths.groups()]
+        index = re.search(rb"/Index\s*\[([\d\s]*)\]", body)
+        ranges = [int(value) for value in index.group(1).split()] if index else [0, _int(b"Size", body)]
+        entry_size, position = sum(widths), 0
+        for first, count in zip(ranges[::2], ranges[1::2]):
+            for number in range(first, first + count):
+                entry = stream[position:position + entry_size]
+                position += entry_size
+                if len(entry) < entry_size:
+                    return body
+                fields, cursor = [], 0
+                for width in widths:
+                    fields.append(int.from_bytes(entry[cursor:cursor + width], "big"))
+                    cursor += width
+                kind = fields[0] if widths[0] else 1
+                if kind in (1, 2):
+                    self.offsets.setdefault(number, (kind, fields[1], fields[2]))
+        return body[:STREAM.search(body).start()] if STREAM.search(body) else body
+
+    def get(self, number: int) -> Optional[bytes]:
+        """The body of object `number` (between "obj" and "endobj"), or None"""
+        entry = self.offsets.get(number)
+        if entry is None:
+            return None
+        kind, first, second = entry
+        if kind == 1:
+            obj = OBJECT.match(self.data[first:first + WINDOW])
+            if obj and int(obj.group(1)) == number:
+                return obj.group(3)
+            # Bigger than the window (a long XMP packet): read up to its endobj
+            end = self.data.find(b"endobj", first, first + WINDOW * 16)
+            obj = OBJECT.match(self.data[first:end + 6]) if end > 0 else None
+            return obj.group(3) if obj and int(obj.group(1)) == number else None
+
+        # Compressed into object stream `first` at index `second`
+        container = self.get(first) if self.offsets.get(first, (0,))[0] == 1 else None
+        content = _stream_data(container) if container else None
+        if content is None:
+            return None
+        header = content[:_int(b"First", container)].split()
+        pairs = list(zip(header[::2], header[1::2]))
+        if second >= len(pairs):
+            return None
+        begin = _int(b"First", container) + int(pairs[second][1])
+        finish = _int(b"First", container) + int(pairs[second + 1][1]) if second + 1 < len(pairs) else len(content)
+        return content[begin:finish]
+
+
+def _windows(data) -> List[bytes]:
+    """The first and last WINDOW bytes, where files without usable xref data keep their trailer"""
+    if len(data) <= 2 * WINDOW:
+        return [data[:]]
+    return [data[:WINDOW], data[len(data) - WINDOW:]]
+
+
+def _fallback_object(data, number: bytes, generation: bytes) -> Optional[bytes]:
+    obj = re.compile(rb"(?<!\d)" + number + rb"\s+" + generation + rb"\s+obj(.*?)endobj", re.S)
+    # Incremental updates append newer versions of the object; the last one wins
+    matches = [match for window in _windows(data) for match in obj.finditer(window)]
+    return matches[-1].group(1) if matches else None
+
+
+def _read_info(data, objects: _Objects) -> Dict[str, Optional[str]]:
+    refs = list(INFO_REF.finditer(objects.trailer))
+    if not refs:
+        refs = [match for window in _windows(data) for match in INFO_REF.finditer(window)]
+    if not refs:
+        return {}
+    number, generation = refs[-1].group(1), refs[-1].group(2)
+    info = objects.get(int(number)) or _fallback_object(data, number, generation)
+    if info is None:
+        return {}
+    return {key.lower(): _info_value(info, key.encode()) for key in ("Title", "Author", "Subject", "Keywords")}
+
+
+def _read_xmp(data, objects: _Objects) -> Dict[str, Any]:
+    # Catalog (/Root) -> /Metadata stream; without xref data only the head and tail are searched
+    packet = None
+    root = ROOT_REF.search(objects.trailer)
+    catalog = objects.get(int(root.group(1))) if root else None
+    metadata = METADATA_REF.search(catalog) if catalog else None
+    stream = objects.get(int(metadata.group(1))) if metadata else None
+    if stream is not None:
+        packet = XMP_PACKET.search(_stream_data(stream) or b"")
+    if packet is None and not objects.offsets:
+        matches = [match for window in _windows(data) for match in XMP_PACKET.finditer(window)]
+        packet = matches[-1] if matches else None
+    if packet is None:
+        return {}
+    xmp = packet.group(0).decode("utf-8", "ignore")
+
+    def items(tag):
+        block = re.search(rf"<{tag}[^>]*>(.*?)</{tag}>", xmp, re.S)
+        if not block:
+            return []
+        values = re.findall(r"<rdf:li[^>]*>(.*?)</rdf:li>", block.group(1), re.S) or [block.group(1)]
+        return [re.sub(r"<[^>]+>", "", value).strip() for value in values if value.strip()]
+
+    titles = items("dc:title")
+    return {
+        "title": titles[0] if titles else None,
+        "authors": items("dc:creator"),
+        "isbns": find_isbns(" ".join(items("dc:identifier") + items("prism:isbn") + [xmp])),
+    }
+
+
+def _first_pages_text(data, scan_bytes: int, max_streams: int) -> str:
+    """Text-show strings from the first content streams, enough to find a copyright-page ISBN"""
+    chunks = []
+    limit = min(len(data), scan_bytes)
+    for count, match in enumerate(STREAM.finditer(data, 0, limit)):
+        if count >= max_streams:
+            break
+        start = match.end()
+        end = data.find(b"endstream", start, min(len(data), start + scan_bytes))
+        if end < 0:
+            continue
+        raw = data[start:end]
+        try:
+            raw = zlib.decompressobj().decompress(raw, 4 * 1024 * 1024)
+        except zlib.error:
+            pass
+        if b"Tj" not in raw and b"TJ" not in raw:
+            continue
+        chunks.append("".join(_decode_literal(s[1:-1]) for s in TEXT_STRING.findall(raw)))
+    return " ".join(chunks)
+
+
+def extract_pdf_metadata(path: str, scan_bytes: int = PDF_METADATA_SCAN_BYTES,
+                         max_streams: int = PDF_METADATA_MAX_STREAMS) -> Dict[str, Any]:
+    """
+    Read title, author and ISBN straight from a PDF without parsing the whole
+    document: the file is memory-mapped and only the trailer and xref data, the
+    document info dict, the XMP metadata stream and the first few content
+    streams are looked at.
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return {"title": None, "authors": [], "isbn": None, "isbns": [], "source": None}
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            objects = _Objects(data)
+            info = _read_info(data, objects)
+            xmp = _read_xmp(data, objects)
+
+            isbns = find_isbns(" ".join(filter(None, [info.get("subject"), info.get("keywords")])))
+            source = "info" if isbns else None
+            for isbn in xmp.get("isbns", []):
+                if isbn not in isbns:
+                    isbns.append(isbn)
+                    source = source or "xmp"
+            if not isbns:
+                isbns = find_isbns(_first_pages_text(data, scan_bytes, max_streams))
+                source = "text" if isbns else None
+
+    author = info.get("author")
+    authors = xmp.get("authors") or ([author] if author else [])
+    # ISBN-13 first: it is what Open Library indexes most consistently
+    isbns.sort(key=len, reverse=True)
+    return {
+        "title": xmp.get("title") or info.get("title"),
+        "authors": authors,
+        "isbn": isbns[0] if isbns else None,
+        "isbns": isbns,
+        "source": source,
+    }
@@ -0,0 +1,200 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from metrics import register_cache
+
+PDF_STORE_DIR = os.getenv("PDF_STORE_DIR", "pdf_store")
+
+# Unreferenced PDFs are evicted least-recently-used first once the store grows past this
+PDF_STORE_QUOTA = int(os.getenv("PDF_STORE_QUOTA", 2 * 1024 * 1024 * 1024))
+
+# Interrupted downloads older than this are given up on
+PDF_PARTIAL_MAX_AGE = float(os.getenv("PDF_PARTIAL_MAX_AGE", 24 * 3600))
+
+
+class PdfStore:
+    """
+    Content-addressed store for downloaded PDFs.
+
+    Files live under `<root>/<sha[:2]>/<sha>.pdf`. The SHA-256 comes from the
+    download, which hashes single-stream files as they are written; segmented
+    downloads are hashed here once complete. A SQLite index maps source URLs
+    and titles to hashes so a source we already hold is never downloaded twice.
+
+    Blobs are reference counted: `acquire` / `put_file` hand out a reference and
+    `release` drops it. Unreferenced blobs stay on disk for reuse until the
+    quota is exceeded, then the least recently used ones are evicted.
+    """
+
+    def __init__(self, root: str = PDF_STORE_DIR, quota: int = PDF_STORE_QUOTA):
+        self.root = root
+        self.quota = quota
+        self.stats = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self.root, "index.db"), check_same_thread=False,
+                                       isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "hash TEXT PRIMARY KEY, size INTEGER NOT NULL, title TEXT, "
+                "refcount INTEGER NOT NULL DEFAULT 0, last_used REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sources (key TEXT PRIMARY KEY, hash TEXT NOT NULL)"
+            )
+            # References belong to in-flight work of a previous process; none survive a restart
+            self._db.execute("UPDATE blobs SET refcount = 0")
+        return self._db
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], f"{sha256}.pdf")
+
+    def hash_for_path(self, path: str) -> Optional[str]:
+        name = os.path.basename(path)
+        if not name.endswith(".pdf") or os.path.dirname(os.path.abspath(path)) != \
+                os.path.abspath(os.path.join(self.root, name[:2])):
+            return None
+        return name[:-4]
+
+    def _touch(self, sha256: str, delta: int):
+        self.db.execute(
+            "UPDATE blobs SET refcount = MAX(refcount + ?, 0), last_used = ? WHERE hash = ?",
+            (delta, time.time(), sha256),
+        )
+
+    def acquire(self, url: Optional[str] = None, title: Optional[str] = None) -> Optional[str]:
+        """Return the stored path for a source URL (or title) and take a reference, or None"""
+        with self._lock:
+            for key in (f"url:{url}" if url else None, f"title:{title}" if title else None):
+                if not key:
+                    continue
+                row = self.db.execute("SELECT hash FROM sources WHERE key = ?", (key,)).fetchone()
+                if row and os.path.exists(self.path_for(row[0])):
+                    self._touch(row[0], 1)
+                    self.stats["hits"] += 1
+                    return self.path_for(row[0])
+            self.stats["misses"] += 1
+        return None
+
+    def partial_path(self, key: str) -> str:
+        """Where an interrupted download of `key` is kept so the next attempt can resume it"""
+        directory = os.path.join(self.root, "partial")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{hashlib.sha256(key.encode()).hexdigest()}.part")
+
+    def discard_partial(self, key: str):
+        """Drop an interrupted download of `key` (and its segment sidecar) that won't be resumed"""
+        path = self.partial_path(key)
+        for leftover in (path, f"{path}.segments", f"{path}.segments.tmp"):
+            self._discard(leftover)
+
+    def prune_partial(self, max_age: float = PDF_PARTIAL_MAX_AGE) -> int:
+        """Delete interrupted downloads nobody has resumed for `max_age` seconds"""
+        directory = os.path.join(self.root, "partial")
+        if not os.path.isdir(directory):
+            return 0
+        removed = 0
+        cutoff = time.time() - max_age
+        for entry in os.scandir(directory):
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        return removed
+
+    def put_file(self, tmp_path: str, url: Optional[str] = None, title: Optional[str] = None,
+                 sha256: Optional[str] = None) -> str:
+        """
+        Move a completely downloaded file into the store; returns the path with a
+        reference taken. Without the `sha256` the download computed, the file is read to hash it.
+        """
+        if sha256 is None:
+            digest = hashlib.sha256()
+            with open(tmp_path, "rb") as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            sha256 = digest.hexdigest()
+        return self._commit(tmp_path, sha256, os.path.getsize(tmp_path), url, title)
+
+    @staticmethod
+    def _discard(tmp_path: str):
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+    def _commit(self, tmp_path: str, sha256: str, size: int, url: Optional[str], title: Optional[str]) -> str:
+        path = self.path_for(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._lock:
+            if os.path.exists(path):
+                # Same bytes already stored under another source
+                os.unlink(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+            self.db.execute(
+                "INSERT INTO blobs (hash, size, title, refcount, last_used) VALUES (?, ?, ?, 1, ?) "
+                "ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1, last_used = excluded.last_used",
+                (sha256, size, title, time.time()),
+            )
+            for key in (f"url:{url}" if url else None, f"title:{title}" if title else None):
+                if key:
+                    self.db.execute("INSERT OR REPLACE INTO sources (key, hash) VALUES (?, ?)", (key, sha256))
+
+        self.evict()
+        return path
+
+    def release(self, path: str) -> bool:
+        """Drop one reference to a stored file; returns False when the path is not in the store"""
+        sha256 = self.hash_for_path(path)
+        if not sha256:
+            return False
+        with self._lock:
+            row = self.db.execute("SELECT 1 FROM blobs WHERE hash = ?", (sha256,)).fetchone()
+            if not row:
+                return False
+            self._touch(sha256, -1)
+        self.evict()
+        return True
+
+    def title(self, path: str) -> Optional[str]:
+        sha256 = self.hash_for_path(path)
+        if not sha256:
+            return None
+        row = self.db.execute("SELECT title FROM blobs WHERE hash = ?", (sha256,)).fetchone()
+        return row[0] if row else None
+
+    def evict(self) -> int:
+        """Delete unreferenced blobs, least recently used first, until the store fits the quota"""
+        evicted = 0
+        with self._lock:
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.quota:
+                return 0
+            candidates = self.db.execute(
+                "SELECT hash, size FROM blobs WHERE refcount = 0 ORDER BY last_used"
+            ).fetchall()
+            for sha256, size in candidates:
+                if total <= self.quota:
+                    break
+                try:
+                    os.remove(self.path_for(sha256))
+                except FileNotFoundError:
+                    pass
+                self.db.execute("DELETE FROM blobs WHERE hash = ?", (sha256,))
+                self.db.execute("DELETE FROM sources WHERE hash = ?", (sha256,))
+                total -= size
+                evicted += 1
+        return evicted
+
+
+pdf_store = PdfStore()
+register_cache("pdf_store", lambda: (pdf_store.stats["hits"], pdf_store.stats["misses"]))
@@ -0,0 +1,208 @@
+import os
+import secrets
+import tempfile
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import anyio
+import httpx
+
+# "file" downloads to the PDF store, then uploads from disk; "stream" pipes the
+# pdfdrive response straight into the Etsy upload. Only "file" goes through the
+# store (dedup, reuse, quota), reads the PDF's own metadata and resumes downloads.
+PDF_TRANSFER_MODE = os.getenv("PDF_TRANSFER_MODE", "file")
+
+# Sources that don't announce their size are spooled (in memory up to this
+# many bytes, then on disk) so the upload can carry a Content-Length
+PDF_SPOOL_MAX_SIZE = int(os.getenv("PDF_SPOOL_MAX_SIZE", 16 * 1024 * 1024))
+
+# Send unknown-length uploads with chunked transfer encoding instead of spooling
+PDF_ALLOW_CHUNKED_UPLOAD = os.getenv("PDF_ALLOW_CHUNKED_UPLOAD", "0") == "1"
+
+CHUNK_SIZE = 64 * 1024
+
+# How much of an error response from the source is kept for the error details
+ERROR_SNIPPET_SIZE = 512
+
+
+class TransferError(Exception):
+    """Raised when the source does not serve a PDF"""
+
+    def __init__(self, message, status_code: Optional[int] = None, details: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+class MultipartBody:
+    """
+    Hand-built multipart/form-data body with a single file part, so the file
+    bytes can come from any async iterator instead of a fully read buffer.
+    """
+
+    def __init__(self, fields: Dict[str, str], file_field: str, filename: str, content_type: str):
+        self.boundary = secrets.token_hex(16)
+        preamble = b""
+        for key, value in fields.items():
+            preamble += (
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{key}"\r\n\r\n'
+                f'{value}\r\n'
+            ).encode()
+        preamble += (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode()
+        self.preamble = preamble
+        self.epilogue = f'\r\n--{self.boundary}--\r\n'.encode()
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def length(self, file_size: int) -> int:
+        return len(self.preamble) + file_size + len(self.epilogue)
+
+    async def stream(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        yield self.preamble
+        async for chunk in chunks:
+            yield chunk
+        yield self.epilogue
+
+
+async def _iter_file(file) -> AsyncIterator[bytes]:
+    """Read a (spooled or on-disk) file from the start in worker threads"""
+    await anyio.to_thread.run_sync(file.seek, 0)
+    while True:
+        chunk = await anyio.to_thread.run_sync(file.read, CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def _reported(chunks: AsyncIterator[bytes], progress: Optional[Callable[[int, Optional[int]], Any]],
+                    total: Optional[int]) -> AsyncIterator[bytes]:
+    """Pass `chunks` through, calling `progress(done, total)` as they go; every retry counts from zero"""
+    done = 0
+    async for chunk in chunks:
+        done += len(chunk)
+        if progress:
+            progress(done, total)
+        yield chunk
+
+
+async def _check_source(pdf_response: httpx.Response):
+    """
+    Raise TransferError unless the streamed response is a PDF. An error status
+    carries the start of its body: the response isn't read, so `.text` isn't there.
+    """
+    if pdf_response.is_error:
+        snippet = b""
+        async for chunk in pdf_response.aiter_bytes():
+            snippet += chunk
+            if len(snippet) >= ERROR_SNIPPET_SIZE:
+                break
+        raise TransferError(f"Source returned {pdf_response.status_code} for {pdf_response.url}",
+                            status_code=pdf_response.status_code,
+                            details=snippet[:ERROR_SNIPPET_SIZE].decode("utf-8", "replace"))
+    if pdf_response.headers.get('Content-Type') != 'application/pdf':
+        raise TransferError(f"Source did not return a PDF ({pdf_response.headers.get('Content-Type')})",
+                            status_code=pdf_response.status_code)
+
+
+async def _download_again(client: httpx.AsyncClient, source: Dict[str, Any],
+                          size: Optional[int]) -> AsyncIterator[bytes]:
+    """The PDF bytes from a fresh GET of `source["pdf_url"]`, for a retried upload"""
+    async with client.stream('GET', source["pdf_url"], headers=source.get("headers")) as pdf_response:
+        await _check_source(pdf_response)
+        # The upload already announced a Content-Length; a different file can't be sent under it
+        length = pdf_response.headers.get('Content-Length')
+        if size is not None and (pdf_response.headers.get('Content-Encoding') or length != str(size)):
+            raise TransferError(f"Source changed size between upload attempts ({length} != {size})")
+        async for chunk in pdf_response.aiter_bytes(CHUNK_SIZE):
+            yield chunk
+
+
+async def stream_pdf_to_etsy(etsy, shop_id, listing_id, name: str, source: Dict[str, Any],
+                             spool_max_size: int = PDF_SPOOL_MAX_SIZE,
+                             allow_chunked: bool = PDF_ALLOW_CHUNKED_UPLOAD,
+                             progress: Optional[Callable[[int, Optional[int]], Any]] = None) -> Dict[str, Any]:
+    """
+    Pipe the PDF at `source["pdf_url"]` (as returned by `scraper.resolve_download`)
+    into `POST /shops/{shop_id}/listings/{listing_id}/files` without writing it to
+    the working directory or holding it in memory. `progress(done, total)` follows
+    the PDF bytes sent to Etsy. A retried upload downloads the PDF again.
+    """
+    path = f'/shops/{shop_id}/listings/{listing_id}/files'
+    body = MultipartBody({'name': name}, 'file', 'file.pdf', 'application/pdf')
+
+    with tempfile.SpooledTemporaryFile(max_size=spool_max_size) as spool:
+        async with httpx.AsyncClient(cookies=source.get("cookies"), follow_redirects=True,
+                                     timeout=httpx.Timeout(60.0, connect=10.0)) as client:
+            async with client.stream('GET', source["pdf_url"], headers=source.get("headers")) as pdf_response:
+                await _check_source(pdf_response)
+
+                content_length: Optional[str] = pdf_response.headers.get('Content-Length')
+                # A compressed body makes Content-Length describe the wire size, not the PDF
+                if pdf_response.headers.get('Content-Encoding'):
+                    content_length = None
+
+                if content_length is not None or allow_chunked:
+                    # Stream straight through. The first attempt reads the response we already have;
+                    # a retried upload downloads the PDF again, so 429s and 5xx back off like any other call
+                    size = int(content_length) if content_length is not None else None
+                    headers = {'Content-Type': body.content_type}
+                    if size is not None:
+                        headers['Content-Length'] = str(body.length(size))
+                    attempts = 0
+
+                    def attempt_body():
+                        nonlocal attempts
+                        attempts += 1
+                        chunks = pdf_response.aiter_bytes(CHUNK_SIZE) if attempts == 1 \
+                            else _download_again(client, source, size)
+                        return body.stream(_reported(chunks, progress, size))
+
+                    response = await etsy.post(path, content=attempt_body, headers=headers)
+                    return response.json()
+
+                # Unknown length: spool to a bounded temp file so the upload can carry a Content-Length
+                size = 0
+                async for chunk in pdf_response.aiter_bytes(CHUNK_SIZE):
+                    await anyio.to_thread.run_sync(spool.write, chunk)
+                    size += len(chunk)
+
+        # The source connection is released before the upload starts; the spool
+        # can be re-read, so this upload is retried like any other call
+        headers = {
+            'Content-Type': body.content_type,
+            'Content-Length': str(body.length(size)),
+        }
+        response = await etsy.post(path, content=lambda: body.stream(_reported(_iter_file(spool), progress, size)),
+                                   headers=headers)
+        return response.json()
+
+
+async def upload_pdf_file_to_etsy(etsy, shop_id, listing_id, name: str, path: str,
+                                  progress: Optional[Callable[[int, Optional[int]], Any]] = None) -> Dict[str, Any]:
+    """
+    Upload a PDF from disk to `POST /shops/{shop_id}/listings/{listing_id}/files`,
+    reading it in chunks off the event loop instead of loading it into memory.
+    """
+    body = MultipartBody({'name': name}, 'file', 'file.pdf', 'application/pdf')
+    file = await anyio.to_thread.run_sync(open, path, 'rb')
+    try:
+        size = (await anyio.to_thread.run_sync(os.fstat, file.fileno())).st_size
+        headers = {
+            'Content-Type': body.content_type,
+            'Content-Length': str(body.length(size)),
+        }
+        # Every attempt re-reads the file from the start, so the upload is retried like any other call
+        response = await etsy.post(
+            f'/shops/{shop_id}/listings/{listing_id}/files',
+            content=lambda: body.stream(_reported(_iter_file(file), progress, size)),
+            headers=headers,
+        )
+        return response.json()
+    finally:
+        await anyio.to_thread.run_sync(file.close)
@@ -0,0 +1,199 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+# How often byte-level progress is published per stage, and how long finished jobs can still be replayed
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 0.25))
+PROGRESS_RETENTION = float(os.getenv("PROGRESS_RETENTION", 600))
+PROGRESS_HEARTBEAT = float(os.getenv("PROGRESS_HEARTBEAT", 15))
+
+# Job the current task works for; set by `run_tracked` and inherited by the tasks it starts
+current_job: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_job", default=None)
+
+
+class JobCancelled(Exception):
+    """Raised by `run_tracked` when the job was cancelled through the tracker"""
+
+
+class Channel:
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.events: List[Dict[str, Any]] = []
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.tasks: Set[asyncio.Task] = set()
+        self.cancelled = False
+        self.finished_at: Optional[float] = None
+        self.created_at = time.time()
+        self._last_progress: Dict[str, float] = {}
+
+
+class ProgressTracker:
+    """
+    In-process progress channels keyed by job id.
+
+    Work publishes stage transitions and byte counts; `subscribe` replays what
+    happened so far and then follows live events until the job ends, which is
+    what the SSE endpoint streams. Tasks attached to a job are cancelled by
+    `cancel`, which closes their connections (and lets callers drop temp files)
+    right away instead of when the transfer would have finished.
+    """
+
+    def __init__(self, interval: float = PROGRESS_INTERVAL, retention: float = PROGRESS_RETENTION):
+        self.interval = interval
+        self.retention = retention
+        self.channels: Dict[str, Channel] = {}
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id, channel in list(self.channels.items()):
+            idle = channel.finished_at or (channel.created_at if not channel.events and not channel.tasks else None)
+            if idle and idle < cutoff and not channel.subscribers:
+                del self.channels[job_id]
+
+    def open(self, job_id: Optional[str] = None) -> str:
+        """Create (or return) the channel for `job_id`; subscribers may open it before the work starts"""
+        self._prune()
+        job_id = job_id or uuid.uuid4().hex
+        if job_id not in self.channels:
+            self.channels[job_id] = Channel(job_id)
+        return job_id
+
+    def publish(self, job_id: Optional[str], event: str, **data: Any):
+        channel = self.channels.get(job_id) if job_id else None
+        if channel is None or channel.finished_at:
+            return
+        message = {"id": len(channel.events) + 1, "event": event, "time": round(time.time(), 3), **data}
+        channel.events.append(message)
+        for queue in channel.subscribers:
+            queue.put_nowait(message)
+
+    def stage(self, job_id: Optional[str], name: str, status: str, **data: Any):
+        self.publish(job_id, "stage", stage=name, status=status, **data)
+
+    def reporter(self, job_id: Optional[str], stage: str, **data: Any) -> Optional[Callable[[int, Optional[int]], None]]:
+        """A `progress(done, total)` callback publishing byte counts for `stage`, at most every `interval` seconds"""
+        if not job_id or job_id not in self.channels:
+            return None
+        channel = self.channels[job_id]
+        key = f"{stage}:{json.dumps(data, sort_keys=True)}"
+
+        def report(done: int, total: Optional[int]):
+            now = time.monotonic()
+            if done != total and now - channel._last_progress.get(key, 0) < self.interval:
+                return
+            channel._last_progress[key] = now
+            self.publish(job_id, "progress", stage=stage, done=done, total=total, **data)
+
+        return report
+
+    def finish(self, job_id: Optional[str], status: str, **data: Any):
+        """Publish the final "end" event; subscribers stop after it"""
+        channel = self.channels.get(job_id) if job_id else None
+        if channel is None or channel.finished_at:
+            return
+        self.publish(job_id, "end", status=status, **data)
+        channel.finished_at = time.time()
+        for queue in channel.subscribers:
+            queue.put_nowait(None)
+
+    def attach(self, job_id: Optional[str], task: asyncio.Task):
+        channel = self.channels.get(job_id) if job_id else None
+        if channel is None:
+            return
+        channel.tasks.add(task)
+        task.add_done_callback(channel.tasks.discard)
+        if channel.cancelled:
+            task.cancel()
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel every task working for the job; returns False for an unknown or finished job"""
+        channel = self.channels.get(job_id)
+        if channel is None or channel.finished_at:
+            return False
+        channel.cancelled = True
+        self.publish(job_id, "cancelling", tasks=len(channel.tasks))
+        for task in list(channel.tasks):
+            task.cancel()
+        return True
+
+    def cancel_requested(self, job_id: Optional[str] = None) -> bool:
+        channel = self.channels.get(job_id or current_job.get() or "")
+        return bool(channel and channel.cancelled)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        channel = self.channels.get(job_id)
+        if channel is None:
+            return None
+        return {
+            "job_id": job_id,
+            "cancelled": channel.cancelled,
+            "finished": channel.finished_at is not None,
+            "running_tasks": len(channel.tasks),
+            "events": len(channel.events),
+        }
+
+    async def subscribe(self, job_id: str, after: int = 0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Events after id `after`, then live ones until the job ends. Yields None
+        when nothing happened for `PROGRESS_HEARTBEAT` seconds.
+        """
+        self.open(job_id)
+        channel = self.channels[job_id]
+        queue: asyncio.Queue = asyncio.Queue()
+        channel.subscribers.add(queue)
+        try:
+            for message in list(channel.events):
+                if message["id"] > after:
+                    yield message
+            if channel.finished_at:
+                return
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), PROGRESS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if message is None:
+                    return
+                if message["id"] > after:
+                    yield message
+        finally:
+            channel.subscribers.discard(queue)
+
+
+progress_tracker = ProgressTracker()
+
+
+async def run_tracked(job_id: Optional[str], work: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Run `work()` as a task attached to `job_id` and publish its end. Raises
+    `JobCancelled` when the job was cancelled through the tracker. Without a
+    job id the work simply runs.
+    """
+    if not job_id:
+        return await work()
+
+    progress_tracker.open(job_id)
+    token = current_job.set(job_id)
+    try:
+        task = asyncio.create_task(work())
+    finally:
+        current_job.reset(token)
+    progress_tracker.attach(job_id, task)
+    try:
+        result = await task
+    except asyncio.CancelledError:
+        if task.cancelled() and progress_tracker.cancel_requested(job_id):
+            progress_tracker.finish(job_id, "cancelled")
+            raise JobCancelled(f"Job {job_id} was cancelled")
+        raise
+    except Exception as e:
+        progress_tracker.finish(job_id, "failed", error=str(e))
+        raise
+    error = result.get("error") if isinstance(result, dict) else None
+    progress_tracker.finish(job_id, "failed" if error else "done", **({"error": error} if error else {}))
+    return result
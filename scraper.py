@@ -1,95 +1,235 @@
-import requests
-from bs4 import BeautifulSoup
-import re
+import asyncio
+import httpx
+from bs4 import BeautifulSoup, SoupStrainer
+from collections import OrderedDict
+import os
+import threading
 import random
+from pdf_download import RangedDownload, UnexpectedContentType
+from pdf_store import pdf_store
+from metrics import outbound, register_cache
 
-def download_pdf(book_url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Referer': book_url
-    }
+# lxml is a much faster C-backed parser; fall back to the pure-Python one when it isn't installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
 
-    with requests.Session() as session:
-        # Fetch the book page
-        response = session.get(book_url, headers=headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
+PDFDRIVE_BASE = os.getenv("PDFDRIVE_BASE", "https://www.pdfdrive.com")
 
-        # Extract title
-        title = soup.find('h1').text.strip()
+# Number of book / "broken" pages kept for conditional GETs
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", 256))
 
-        # Extract ID and Session from the button's data-preview attribute
-        button = soup.find('button', {'id': 'previewButtonMain'})
-        if not button:
-            return None
+PDFDRIVE_TIMEOUT = httpx.Timeout(float(os.getenv("PDFDRIVE_TIMEOUT", 60)), connect=10.0)
 
-        data_preview = button.get('data-preview', '')
-        if not data_preview:
-            return None
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 
-        # Parse ID and Session from the URL in data-preview
-        params = {}
-        parts = data_preview.split('?')[1].split('&')
-        for part in parts:
-            key, value = part.split('=')
-            params[key] = value
+# Only the elements we read are built into the tree
+BOOK_PAGE_STRAINER = SoupStrainer(['h1', 'button'])
+BROKEN_PAGE_STRAINER = SoupStrainer('a')
 
 
-        # Extract the "r" parameter (random token) from JavaScript logic
-        # Example: Look for a script containing "downloadButton"
-        r_value = None
-        # Generate random r value between 100-999
-        r_value = str(random.randint(100, 999))
+class PageCache:
+    """
+    Small LRU of fetched pages keyed by URL. Entries keep the ETag / Last-Modified
+    validators and the parsed result, so a 304 skips both the body and the parse.
+    """
 
-        if not r_value:
-            return None
+    def __init__(self, max_entries=PAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.stats = {"misses": 0, "not_modified": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
 
-        # Step 2: Fetch the intermediate "/ebook/broken" page
-        broken_url = (
-            f"https://www.pdfdrive.com/ebook/broken?"
-            f"id={params['id']}&session={params['session']}&r={r_value}"
-        )
-        broken_response = session.get(broken_url, headers=headers)
-        broken_soup = BeautifulSoup(broken_response.text, 'html.parser')
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry:
+                self._entries.move_to_end(url)
+            return entry
+
+    def put(self, url, etag, last_modified, parsed):
+        if not etag and not last_modified:
+            return
+        with self._lock:
+            self._entries[url] = {"etag": etag, "last_modified": last_modified, "parsed": parsed}
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
 
-        # Step 3: Extract the final PDF URL from the download button
-        download_link = broken_soup.find('a', {'class': 'btn-user'})
-        print("I am here: ", download_link)
-        if not download_link:
-            return None
 
+page_cache = PageCache()
+register_cache("pdfdrive_pages", lambda: (page_cache.stats["not_modified"], page_cache.stats["misses"]))
 
-        pdf_path = download_link.get('href')
-        pdf_url = f"https://www.pdfdrive.com{pdf_path}"
+
+def _headers(referer):
+    return {
+        'User-Agent': USER_AGENT,
+        'Referer': referer
+    }
 
 
-        # Step 4: Download the actual PDF
-        pdf_response = session.get(
-            pdf_url,
-            headers=headers,
-            stream=True
+async def fetch_parsed(client, url, headers, parse, raise_for_status=False):
+    """
+    GET `url` and return `parse(html)`, revalidating a cached copy with
+    If-None-Match / If-Modified-Since so unchanged pages are not re-parsed.
+    Parsing runs in a worker thread so it never holds up the event loop.
+    With `raise_for_status`, error responses raise instead of being parsed.
+    """
+    request_headers = dict(headers)
+    cached = page_cache.get(url)
+    if cached:
+        if cached["etag"]:
+            request_headers['If-None-Match'] = cached["etag"]
+        if cached["last_modified"]:
+            request_headers['If-Modified-Since'] = cached["last_modified"]
+
+    with outbound("pdfdrive", "page") as call:
+        response = await client.get(url, headers=request_headers)
+        call["status"] = response.status_code
+        call["bytes_received"] = len(response.content)
+    if response.status_code == 304 and cached:
+        page_cache.stats["not_modified"] += 1
+        return cached["parsed"]
+    if raise_for_status:
+        response.raise_for_status()
+
+    page_cache.stats["misses"] += 1
+    parsed = await asyncio.to_thread(parse, response.text)
+    page_cache.put(url, response.headers.get('ETag'), response.headers.get('Last-Modified'), parsed)
+    return parsed
+
+
+def _client(cookies=None):
+    """One client per book flow: pdfdrive ties the download to the cookies of the page visit"""
+    return httpx.AsyncClient(cookies=cookies, follow_redirects=True, timeout=PDFDRIVE_TIMEOUT)
+
+
+def _cookies(client):
+    return {cookie.name: cookie.value for cookie in client.cookies.jar}
+
+
+def parse_book_page(html):
+    """Single parse of a pdfdrive book page: title plus the preview id and session"""
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=BOOK_PAGE_STRAINER)
+
+    # Extract title
+    h1 = soup.find('h1')
+    page = {"title": h1.text.strip() if h1 else None, "preview_id": None, "session": None}
+
+    # Extract ID and Session from the button's data-preview attribute
+    button = soup.find('button', id='previewButtonMain')
+    data_preview = button.get('data-preview', '') if button else ''
+    if '?' in data_preview:
+        # Parse ID and Session from the URL in data-preview
+        params = dict(part.split('=', 1) for part in data_preview.split('?', 1)[1].split('&') if '=' in part)
+        page["preview_id"] = params.get('id')
+        page["session"] = params.get('session')
+
+    return page
+
+
+def parse_broken_page(html):
+    """Extract the final PDF path from the download button of the "/ebook/broken" page"""
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=BROKEN_PAGE_STRAINER)
+    download_link = soup.find('a', class_='btn-user')
+    return download_link.get('href') if download_link else None
+
+
+async def scrape_book_page(book_url, client=None):
+    """
+    Fetch and parse a book page once. Returns the title, preview id/session and
+    the cookies the follow-up "/ebook/broken" request has to send.
+    """
+    headers = _headers(book_url)
+    own_client = client is None
+    client = client or _client()
+    try:
+        page = dict(await fetch_parsed(client, book_url, headers, parse_book_page))
+        page["book_url"] = book_url
+        page["headers"] = headers
+        page["cookies"] = _cookies(client)
+        return page
+    finally:
+        if own_client:
+            await client.aclose()
+
+
+async def resolve_download(page, client=None):
+    """
+    Follow a scraped book page to the final PDF URL. Returns the structured
+    source (title, preview id/session, download link, headers, cookies) or None.
+    """
+    if not page.get("preview_id") or not page.get("session"):
+        return None
+
+    # Generate random r value between 100-999, like the page's JavaScript does
+    r_value = str(random.randint(100, 999))
+
+    own_client = client is None
+    client = client or _client(page.get("cookies"))
+    try:
+        # Fetch the intermediate "/ebook/broken" page
+        broken_url = (
+            f"{PDFDRIVE_BASE}/ebook/broken?"
+            f"id={page['preview_id']}&session={page['session']}&r={r_value}"
         )
+        with outbound("pdfdrive", "broken_page") as call:
+            response = await client.get(broken_url, headers=page["headers"])
+            call["status"] = response.status_code
+            call["bytes_received"] = len(response.content)
+        pdf_path = await asyncio.to_thread(parse_broken_page, response.text)
+        if not pdf_path:
+            return None
 
-        if pdf_response.headers.get('Content-Type') == 'application/pdf':
-            filename = f"{title.replace(' ', '_')}.pdf"
-            with open(filename, 'wb') as f:
-                for chunk in pdf_response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            return filename
-        else:
+        return {
+            **page,
+            "download_link": pdf_path,
+            "pdf_url": f"{PDFDRIVE_BASE}{pdf_path}",
+            "cookies": _cookies(client),
+        }
+    finally:
+        if own_client:
+            await client.aclose()
+
+
+async def download_pdf_from_source(source, progress=None):
+    """
+    Download the PDF described by `resolve_download` into the content-addressed
+    PDF store and return its path (with a store reference taken).
+
+    The bytes go to a `.part` file keyed by the book URL first, using Range
+    requests so a dropped connection (or a later call) resumes where it stopped
+    and large files are fetched in parallel segments. `progress(done, total)`
+    is called as bytes arrive.
+    """
+    cached = await asyncio.to_thread(pdf_store.acquire, url=source.get("book_url"))
+    if cached:
+        return cached
+
+    key = source.get("book_url") or source["pdf_url"]
+    part_path = await asyncio.to_thread(pdf_store.partial_path, key)
+    async with _client(source["cookies"]) as client:
+        try:
+            download = RangedDownload(client, source["pdf_url"], part_path, headers=source["headers"],
+                                      content_type="application/pdf", progress=progress, key=key)
+            await download.run()
+        except UnexpectedContentType:
             return None
 
-def extract_title(book_url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Referer': book_url
-    }
-    
-    with requests.Session() as session:
-        # Fetch the book page
-        response = session.get(book_url, headers=headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Extract title
-        title = soup.find('h1').text.strip()
-        return title
-    
\ No newline at end of file
+    # Hashed as it was written (or, for segmented downloads, by the store); identical files are stored once
+    return await asyncio.to_thread(pdf_store.put_file, part_path, url=source.get("book_url"),
+                                   title=source.get("title"), sha256=download.sha256)
+
+
+async def download_pdf_from_page(page, progress=None):
+    # A book we already hold skips the "/ebook/broken" hop and the download
+    cached = await asyncio.to_thread(pdf_store.acquire, url=page.get("book_url"))
+    if cached:
+        return cached
+
+    source = await resolve_download(page)
+    if not source:
+        return None
+    return await download_pdf_from_source(source, progress)
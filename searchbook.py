@@ -1,51 +1,155 @@
-import requests
-from typing import Dict, Any, Optional
+import asyncio
+import os
+import httpx
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from metadata_cache import MetadataCache, title_key, isbn_key, normalize_isbn
+from pdf_metadata import extract_pdf_metadata
+from metrics import outbound, register_cache
+from openlibrary_dump import OPENLIBRARY_LOOKUP_MODE, dump_index
 
-def search_book_by_title_openlibrary(book_title: str) -> Dict[str, Any]:
+OPENLIBRARY_BASE = os.getenv("OPENLIBRARY_BASE", "https://openlibrary.org").rstrip("/")
+OPENLIBRARY_COVERS_BASE = os.getenv("OPENLIBRARY_COVERS_BASE", "https://covers.openlibrary.org").rstrip("/")
+
+BASE_URL = f"{OPENLIBRARY_BASE}/search.json"
+
+# Trust the title/author embedded in the PDF and skip Open Library when no ISBN is found
+PDF_METADATA_SKIP_LOOKUP = os.getenv("PDF_METADATA_SKIP_LOOKUP", "0") == "1"
+
+# Maximum number of concurrent requests per host
+OPENLIBRARY_CONCURRENCY = int(os.getenv("OPENLIBRARY_CONCURRENCY", 8))
+
+# Shared Open Library cache (in-process LRU + SQLite on disk)
+metadata_cache = MetadataCache()
+register_cache("openlibrary", lambda: (
+    metadata_cache.stats["memory_hits"] + metadata_cache.stats["disk_hits"], metadata_cache.stats["misses"]
+))
+
+register_cache("openlibrary_dump", lambda: (dump_index.stats["hits"], dump_index.stats["misses"]))
+
+_host_limits: Dict[str, asyncio.Semaphore] = {}
+_client: Optional[httpx.AsyncClient] = None
+
+
+def host_limit(url: str) -> asyncio.Semaphore:
+    """Semaphore capping the number of in-flight requests to the host of `url`"""
+    host = urlsplit(url).netloc
+    if host not in _host_limits:
+        _host_limits[host] = asyncio.Semaphore(OPENLIBRARY_CONCURRENCY)
+    return _host_limits[host]
+
+
+def _build_book_details(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if not data.get('docs'):
+        return None
+
+    book = data['docs'][0]
+
+    # Build book details
+    book_details = {
+        'status': 'success',
+        'data': {
+            'title': book.get('title', 'N/A'),
+            'authors': book.get('author_name', ['Unknown']),
+            'publish_year': book.get('first_publish_year', 'N/A'),
+            'publishers': book.get('publisher', ['N/A']),
+            'isbn_10': None,
+            'isbn_13': None,
+            'language': book.get('language', ['N/A']),
+            'number_of_pages': book.get('number_of_pages_median', 'N/A'),
+            'subjects': book.get('subject', []),
+        }
+    }
+
+    # Extract ISBNs if available
+    if 'isbn' in book:
+        book_details['data']['isbn_10'] = next((isbn for isbn in book['isbn'] if len(isbn) == 10), None)
+        book_details['data']['isbn_13'] = next((isbn for isbn in book['isbn'] if len(isbn) == 13), None)
+
+    # Get cover image if available
+    if 'cover_i' in book:
+        book_details['data']['cover_image'] = f"{OPENLIBRARY_COVERS_BASE}/b/id/{book['cover_i']}-L.jpg"
+
+    return book_details
+
+
+def _store_result(key: str, data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[tuple]]:
+    """The result for an API answer, already in the memory cache, and the rows still to write to disk"""
+    book_details = _build_book_details(data)
+    if book_details is None:
+        not_found = {"status": "error", "message": "No book found"}
+        return not_found, [metadata_cache.remember(key, not_found, negative=True)]
+
+    # Cache under the title and every ISBN we resolved
+    rows = [metadata_cache.remember(key, book_details)]
+    for isbn in (book_details['data']['isbn_10'], book_details['data']['isbn_13']):
+        if isbn:
+            rows.append(metadata_cache.remember(isbn_key(isbn), book_details))
+
+    return book_details, rows
+
+
+def openlibrary_client() -> httpx.AsyncClient:
+    """Shared, pooled client for Open Library lookups"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0), follow_redirects=True)
+    return _client
+
+
+async def aclose_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _search_offline(lookup: Callable[[str], Optional[Dict[str, Any]]], value: str) -> Optional[Dict[str, Any]]:
     """
-    Fetch book metadata from Open Library API with improved error handling
+    Answer from the local Open Library dump index. Returns None when the API
+    should be asked instead (no index, or no match in "offline-then-online").
+    Local answers aren't cached: the index is as fast as the cache.
     """
-    BASE_URL = "https://openlibrary.org/search.json"
-    
+    data = await asyncio.to_thread(lookup, value)
+    if data is None:
+        if OPENLIBRARY_LOOKUP_MODE == "offline":
+            return {"status": "error", "message": "Open Library dump index not found"}
+        return None
+
+    book_details = _build_book_details(data)
+    if book_details is None:
+        return {"status": "error", "message": "No book found"} if OPENLIBRARY_LOOKUP_MODE == "offline" else None
+    return {**book_details, "source": "openlibrary_dump"}
+
+
+async def _search(key: str, params: Dict[str, Any], operation: str,
+                  client: Optional[httpx.AsyncClient],
+                  offline: Optional[Callable[[], Awaitable[Optional[Dict[str, Any]]]]] = None) -> Dict[str, Any]:
     try:
-        title = book_title.split(':')[0].strip()  # Take only the part before ':' and remove whitespace
-        response = requests.get(BASE_URL, params={'title': title, 'limit': 1})
+        # Memory hits are answered inline; only the SQLite tier goes to a worker thread
+        cached = metadata_cache.get_memory(key)
+        if cached is None:
+            cached = await asyncio.to_thread(metadata_cache.get_disk, key)
+        if cached is not None:
+            return cached
+
+        if offline is not None and OPENLIBRARY_LOOKUP_MODE != "online":
+            book = await offline()
+            if book is not None:
+                return book
+
+        async with host_limit(BASE_URL):
+            with outbound("openlibrary", operation) as call:
+                response = await (client or openlibrary_client()).get(BASE_URL, params=params)
+                call["status"] = response.status_code
+                call["bytes_received"] = len(response.content)
         response.raise_for_status()
-        
-        data = response.json()
-        if not data.get('docs'):
-            return {"status": "error", "message": "No book found"}
-            
-        book = data['docs'][0]
-        
-        # Build book details
-        book_details = {
-            'status': 'success',
-            'data': {
-                'title': book.get('title', 'N/A'),
-                'authors': book.get('author_name', ['Unknown']),
-                'publish_year': book.get('first_publish_year', 'N/A'),
-                'publishers': book.get('publisher', ['N/A']),
-                'isbn_10': None,
-                'isbn_13': None,
-                'language': book.get('language', ['N/A']),
-                'number_of_pages': book.get('number_of_pages_median', 'N/A'),
-                'subjects': book.get('subject', []),
-            }
-        }
-        
-        # Extract ISBNs if available
-        if 'isbn' in book:
-            book_details['data']['isbn_10'] = next((isbn for isbn in book['isbn'] if len(isbn) == 10), None)
-            book_details['data']['isbn_13'] = next((isbn for isbn in book['isbn'] if len(isbn) == 13), None)
-        
-        # Get cover image if available
-        if 'cover_i' in book:
-            book_details['data']['cover_image'] = f"https://covers.openlibrary.org/b/id/{book['cover_i']}-L.jpg"
-        
-        return book_details
-        
-    except requests.exceptions.RequestException as e:
+
+        result, rows = _store_result(key, response.json())
+        await asyncio.to_thread(metadata_cache.persist, rows)
+        return result
+
+    except httpx.HTTPError as e:
         return {
             "status": "error",
             "message": f"API request failed: {str(e)}"
@@ -54,4 +158,78 @@ def search_book_by_title_openlibrary(book_title: str) -> Dict[str, Any]:
         return {
             "status": "error",
             "message": f"Data parsing error: {str(e)}"
-        }
\ No newline at end of file
+        }
+
+
+async def search_book_by_title_openlibrary(book_title: str,
+                                           client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+    """
+    Fetch book metadata from Open Library API with improved error handling.
+    Results (including "No book found") are served from the metadata cache when present,
+    and at most OPENLIBRARY_CONCURRENCY requests are in flight at once. Depending on
+    OPENLIBRARY_LOOKUP_MODE the local dump index is asked first, or instead.
+    """
+    title = book_title.split(':')[0].strip()  # Take only the part before ':' and remove whitespace
+    return await _search(title_key(title), {'title': title, 'limit': 1}, "search_title", client,
+                         lambda: _search_offline(dump_index.search_title, title))
+
+
+async def search_book_by_isbn_openlibrary(isbn: str, client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+    """
+    Exact ISBN lookup on Open Library. Returns the same shape as
+    `search_book_by_title_openlibrary` and shares its cache.
+    """
+    isbn = normalize_isbn(isbn)
+    return await _search(isbn_key(isbn), {'isbn': isbn, 'limit': 1}, "search_isbn", client,
+                         lambda: _search_offline(dump_index.search_isbn, isbn))
+
+
+def _details_from_embedded(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    isbn = metadata.get("isbn")
+    return {
+        'status': 'success',
+        'data': {
+            'title': metadata['title'],
+            'authors': metadata.get('authors') or ['Unknown'],
+            'publish_year': 'N/A',
+            'publishers': ['N/A'],
+            'isbn_10': isbn if isbn and len(isbn) == 10 else None,
+            'isbn_13': isbn if isbn and len(isbn) == 13 else None,
+            'language': ['N/A'],
+            'number_of_pages': 'N/A',
+            'subjects': [],
+        },
+        'source': 'pdf',
+    }
+
+
+async def search_book_for_pdf(pdf_path: str, fallback_title: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Resolve a downloaded PDF's metadata, reading the PDF itself first.
+
+    An ISBN found in the info dict, XMP or first pages is looked up exactly on
+    Open Library (cheap and cached); otherwise the embedded title is used, or
+    trusted as-is with PDF_METADATA_SKIP_LOOKUP=1. `fallback_title` (e.g. the
+    scraped page title) is searched when the PDF carries nothing useful.
+    """
+    try:
+        metadata = await asyncio.to_thread(extract_pdf_metadata, pdf_path)
+    except (OSError, ValueError):
+        metadata = {}
+
+    if metadata.get("isbn"):
+        book = await search_book_by_isbn_openlibrary(metadata["isbn"])
+        if book["status"] == "success":
+            return book
+
+    if metadata.get("title") and metadata.get("authors") and PDF_METADATA_SKIP_LOOKUP:
+        return _details_from_embedded(metadata)
+
+    title = fallback_title or metadata.get("title")
+    if not title:
+        return {"status": "error", "message": "No book found"}
+    book = await search_book_by_title_openlibrary(title)
+    if book["status"] != "success" and metadata.get("title") and metadata.get("authors"):
+        # Open Library didn't help; the embedded metadata is still better than nothing
+        return _details_from_embedded(metadata)
+    return book
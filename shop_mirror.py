@@ -0,0 +1,251 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+SHOP_MIRROR_PATH = os.getenv("SHOP_MIRROR_PATH", "shop_mirror.db")
+
+# Concurrent page fetches during a full sync (the Etsy client still rate limits them)
+SHOP_MIRROR_CONCURRENCY = int(os.getenv("SHOP_MIRROR_CONCURRENCY", 4))
+
+LISTING_STATES = ("active", "inactive", "draft", "expired", "sold_out")
+PAGE_SIZE = 100
+
+
+def _price(listing: Dict[str, Any]) -> Optional[float]:
+    price = listing.get("price")
+    if isinstance(price, dict) and price.get("divisor"):
+        return price["amount"] / price["divisor"]
+    return None
+
+
+class ShopMirror:
+    """
+    Local SQLite copy of every listing in a shop, in every state.
+
+    `sync` does a full, concurrently paginated pull the first time (or when
+    asked) and afterwards only fetches listings whose `updated_timestamp` is
+    newer than the last sync. Queries never touch Etsy.
+    """
+
+    def __init__(self, path: str = SHOP_MIRROR_PATH, concurrency: int = SHOP_MIRROR_CONCURRENCY):
+        self.path = path
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._sync_locks: Dict[int, asyncio.Lock] = {}
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                "listing_id INTEGER PRIMARY KEY, shop_id INTEGER NOT NULL, state TEXT, title TEXT, "
+                "price REAL, currency TEXT, quantity INTEGER, tags TEXT, taxonomy_id INTEGER, "
+                "url TEXT, created_timestamp INTEGER, updated_timestamp INTEGER, "
+                "synced_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS listings_shop_state ON listings (shop_id, state)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS listings_updated ON listings (shop_id, updated_timestamp)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                "shop_id INTEGER PRIMARY KEY, last_full_sync REAL, last_sync REAL, watermark INTEGER)"
+            )
+        return self._db
+
+    # ---- writes ----------------------------------------------------------
+
+    def upsert(self, shop_id, listings: List[Dict[str, Any]], synced_at: float):
+        rows = [
+            (
+                listing["listing_id"], int(shop_id), listing.get("state"), listing.get("title"),
+                _price(listing), (listing.get("price") or {}).get("currency_code"), listing.get("quantity"),
+                json.dumps(listing.get("tags") or []), listing.get("taxonomy_id"), listing.get("url"),
+                listing.get("created_timestamp"), listing.get("updated_timestamp"), synced_at, json.dumps(listing),
+            )
+            for listing in listings
+        ]
+        with self._lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO listings (listing_id, shop_id, state, title, price, currency, quantity, "
+                "tags, taxonomy_id, url, created_timestamp, updated_timestamp, synced_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def remove(self, listing_ids):
+        with self._lock:
+            self.db.executemany("DELETE FROM listings WHERE listing_id = ?", [(int(i),) for i in listing_ids])
+
+    def _remove_stale(self, shop_id, started: float) -> List[int]:
+        with self._lock:
+            removed = [row[0] for row in self.db.execute(
+                "SELECT listing_id FROM listings WHERE shop_id = ? AND synced_at < ?", (int(shop_id), started)
+            )]
+        self.remove(removed)
+        return removed
+
+    def _sync_state(self, shop_id) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self.db.execute("SELECT * FROM sync_state WHERE shop_id = ?", (int(shop_id),)).fetchone()
+
+    def _save_sync_state(self, shop_id, full: bool, started: float):
+        with self._lock:
+            watermark = self.db.execute(
+                "SELECT MAX(updated_timestamp) FROM listings WHERE shop_id = ?", (int(shop_id),)
+            ).fetchone()[0]
+            previous = self.db.execute(
+                "SELECT last_full_sync FROM sync_state WHERE shop_id = ?", (int(shop_id),)
+            ).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO sync_state (shop_id, last_full_sync, last_sync, watermark) VALUES (?, ?, ?, ?)",
+                (int(shop_id), started if full else (previous[0] if previous else None), started, watermark),
+            )
+
+    # ---- sync ------------------------------------------------------------
+
+    async def _fetch_page(self, etsy, shop_id, state, offset, sort_on="updated"):
+        response = await etsy.get(
+            f'/shops/{shop_id}/listings',
+            params={'state': state, 'limit': PAGE_SIZE, 'offset': offset, 'sort_on': sort_on, 'sort_order': 'desc'},
+        )
+        return response.json()
+
+    async def _full_state(self, etsy, shop_id, state, semaphore) -> List[Dict[str, Any]]:
+        first = await self._fetch_page(etsy, shop_id, state, 0, sort_on="created")
+        results = list(first.get("results", []))
+        count = first.get("count", len(results))
+
+        async def page(offset):
+            async with semaphore:
+                return (await self._fetch_page(etsy, shop_id, state, offset, sort_on="created")).get("results", [])
+
+        # The first page tells us the count; the rest are fetched concurrently
+        pages = await asyncio.gather(*(page(offset) for offset in range(PAGE_SIZE, count, PAGE_SIZE)))
+        for results_page in pages:
+            results.extend(results_page)
+        return results
+
+    async def _incremental_state(self, etsy, shop_id, state, watermark) -> List[Dict[str, Any]]:
+        # Newest first: stop at the first page that reaches what we already have
+        results = []
+        offset = 0
+        while True:
+            page = await self._fetch_page(etsy, shop_id, state, offset)
+            listings = page.get("results", [])
+            results.extend(listing for listing in listings if (listing.get("updated_timestamp") or 0) >= watermark)
+            if not listings or len(listings) < PAGE_SIZE or \
+                    min(listing.get("updated_timestamp") or 0 for listing in listings) < watermark:
+                return results
+            offset += PAGE_SIZE
+
+    async def sync(self, etsy, shop_id, full: bool = False) -> Dict[str, Any]:
+        """
+        Bring the mirror up to date. Returns counts plus `removed`, the ids that
+        disappeared from the shop (only detectable on a full sync).
+        """
+        lock = self._sync_locks.setdefault(int(shop_id), asyncio.Lock())
+        async with lock:
+            started = time.time()
+            state = await asyncio.to_thread(self._sync_state, shop_id)
+            full = full or state is None or state["watermark"] is None
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            if full:
+                per_state = await asyncio.gather(
+                    *(self._full_state(etsy, shop_id, listing_state, semaphore) for listing_state in LISTING_STATES)
+                )
+            else:
+                per_state = await asyncio.gather(
+                    *(self._incremental_state(etsy, shop_id, listing_state, state["watermark"])
+                      for listing_state in LISTING_STATES)
+                )
+
+            listings = [listing for results in per_state for listing in results]
+            await asyncio.to_thread(self.upsert, shop_id, listings, started)
+
+            removed = []
+            if full:
+                # Anything we didn't see in a full pull no longer exists on Etsy
+                removed = await asyncio.to_thread(self._remove_stale, shop_id, started)
+
+            await asyncio.to_thread(self._save_sync_state, shop_id, full, started)
+            return {
+                "shop_id": int(shop_id),
+                "full": full,
+                "fetched": len(listings),
+                "removed": removed,
+                "duration": round(time.time() - started, 3),
+            }
+
+    # ---- queries ---------------------------------------------------------
+
+    def query(self, shop_id, state: Optional[str] = None, q: Optional[str] = None, tag: Optional[str] = None,
+              taxonomy_id: Optional[int] = None, min_price: Optional[float] = None, max_price: Optional[float] = None,
+              sort: str = "updated", limit: int = 100, offset: int = 0) -> Dict[str, Any]:
+        where = ["shop_id = ?"]
+        params: List[Any] = [int(shop_id)]
+        if state:
+            where.append("state = ?")
+            params.append(state)
+        if q:
+            where.append("title LIKE ?")
+            params.append(f"%{q}%")
+        if tag:
+            where.append("EXISTS (SELECT 1 FROM json_each(listings.tags) WHERE json_each.value = ?)")
+            params.append(tag)
+        if taxonomy_id is not None:
+            where.append("taxonomy_id = ?")
+            params.append(taxonomy_id)
+        if min_price is not None:
+            where.append("price >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            where.append("price <= ?")
+            params.append(max_price)
+
+        order = {
+            "updated": "updated_timestamp DESC",
+            "created": "created_timestamp DESC",
+            "price": "price ASC",
+            "title": "title COLLATE NOCASE ASC",
+        }.get(sort, "updated_timestamp DESC")
+        clause = " AND ".join(where)
+
+        with self._lock:
+            total = self.db.execute(f"SELECT COUNT(*) FROM listings WHERE {clause}", params).fetchone()[0]
+            rows = self.db.execute(
+                f"SELECT listing_id, state, title, price, currency, quantity, tags, taxonomy_id, url, "
+                f"created_timestamp, updated_timestamp FROM listings WHERE {clause} ORDER BY {order} LIMIT ? OFFSET ?",
+                [*params, int(limit), int(offset)],
+            ).fetchall()
+
+        listings = []
+        for row in rows:
+            listing = dict(row)
+            listing["tags"] = json.loads(listing["tags"])
+            listings.append(listing)
+        return {"count": total, "results": listings}
+
+    def counts(self, shop_id) -> Dict[str, Any]:
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT state, COUNT(*) FROM listings WHERE shop_id = ? GROUP BY state", (int(shop_id),)
+            ).fetchall()
+        state = self._sync_state(shop_id)
+        by_state = {row[0]: row[1] for row in rows}
+        return {
+            "total": sum(by_state.values()),
+            "by_state": by_state,
+            "last_sync": state["last_sync"] if state else None,
+            "last_full_sync": state["last_full_sync"] if state else None,
+        }
+
+
+shop_mirror = ShopMirror()
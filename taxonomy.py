@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+from tokens import TokenError
+
+ETSY_TAXONOMY_PATH = os.getenv("ETSY_TAXONOMY_PATH", "etsy_taxonomy.json")
+ETSY_TAXONOMY_REFRESH = float(os.getenv("ETSY_TAXONOMY_REFRESH", 7 * 24 * 3600))
+
+# Category every book listing falls back to; subjects only pick nodes below it when it exists in the tree
+ETSY_TAXONOMY_ROOT = int(os.getenv("ETSY_TAXONOMY_ROOT", 324))
+
+DEFAULT_TAGS = ['digital', 'ebook', 'PDF', 'instant download']
+
+# Etsy accepts up to 13 tags of at most 20 characters (letters, digits, spaces, - ' ™ © ®)
+MAX_TAGS = 13
+MAX_TAG_LENGTH = 20
+TAG_INVALID = re.compile(r"[^\w\s\-'™©®]|_")
+
+# A node name word counts this much for the node itself, an ancestor's name word 1
+NAME_WEIGHT = 3
+
+STOPWORDS = {"and", "the", "of", "in", "for", "a", "an", "to", "on", "with", "other", "general", "book", "books"}
+
+# Open Library subject vocabulary -> the (keyword-normalized) words Etsy uses for the same thing
+SUBJECT_ALIASES = {
+    "juvenile": "children",
+    "cookery": "cooking",
+    "cookbook": "cooking",
+    "recipe": "cooking",
+    "novel": "fiction",
+    "bible": "religion",
+    "christian": "religion",
+    "poem": "poetry",
+    "graphic": "comic",
+    "programming": "computer",
+}
+
+# How long to wait before asking Etsy again after a failed fetch
+RETRY_AFTER_FAILURE = 600
+
+logger = logging.getLogger("booking")
+
+
+def keywords(text: str) -> List[str]:
+    """Lowercase words without stopwords, crudely singularized, with Open Library aliases applied"""
+    words = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        if len(word) < 2 or word in STOPWORDS:
+            continue
+        words.extend(SUBJECT_ALIASES.get(word, word).split())
+    return words
+
+
+def clean_tag(value: str) -> Optional[str]:
+    tag = " ".join(TAG_INVALID.sub(" ", value).split())
+    return tag if tag and len(tag) <= MAX_TAG_LENGTH else None
+
+
+class TaxonomyIndex:
+    """
+    In-memory view of the Etsy seller taxonomy: nodes by id plus a keyword
+    lookup (word -> {node id: weight}) built once from the node names, so
+    matching a book's subjects is a handful of dict lookups.
+    """
+
+    def __init__(self, tree: List[Dict[str, Any]], root_id: int = ETSY_TAXONOMY_ROOT):
+        self.nodes: Dict[int, Dict[str, Any]] = {}
+        self._flatten(tree, [])
+        # Only nodes under the books root are candidates, when the tree has it
+        self.root_id = root_id if root_id in self.nodes else None
+        self.lookup: Dict[str, Dict[int, int]] = {}
+        for node_id, node in self.nodes.items():
+            if self.root_id is not None and self.root_id not in node["path_ids"]:
+                continue
+            below_root = node["path_ids"][node["path_ids"].index(self.root_id) + 1:] if self.root_id else node["path_ids"]
+            for ancestor_id in below_root:
+                weight = NAME_WEIGHT if ancestor_id == node_id else 1
+                for word in set(keywords(self.nodes[ancestor_id]["name"])):
+                    entry = self.lookup.setdefault(word, {})
+                    entry[node_id] = max(entry.get(node_id, 0), weight)
+
+    def _flatten(self, children: List[Dict[str, Any]], path_ids: List[int]):
+        for child in children:
+            ids = path_ids + [child["id"]]
+            self.nodes[child["id"]] = {"id": child["id"], "name": child["name"], "level": len(path_ids),
+                                       "parent_id": child.get("parent_id"), "path_ids": ids}
+            self._flatten(child.get("children") or [], ids)
+
+    def path(self, node_id: int) -> List[str]:
+        return [self.nodes[ancestor_id]["name"] for ancestor_id in self.nodes[node_id]["path_ids"]]
+
+    def match(self, subjects: Optional[Iterable[str]]) -> Optional[Dict[str, Any]]:
+        """The node whose name best covers the subjects (deeper wins ties), or None without a name match"""
+        scores: Dict[int, int] = {}
+        matched: Dict[int, set] = {}
+        for subject in subjects or []:
+            if not isinstance(subject, str):
+                continue
+            for word in set(keywords(subject)):
+                for node_id, weight in self.lookup.get(word, {}).items():
+                    scores[node_id] = scores.get(node_id, 0) + weight
+                    matched.setdefault(node_id, set()).add(word)
+
+        best = max(
+            (node_id for node_id, score in scores.items() if score >= NAME_WEIGHT),
+            key=lambda node_id: (scores[node_id], self.nodes[node_id]["level"], -node_id),
+            default=None,
+        )
+        if best is None:
+            return None
+        return {"taxonomy_id": best, "path": self.path(best), "score": scores[best], "matched": sorted(matched[best])}
+
+    def classify(self, subjects: Optional[Iterable[str]]) -> Dict[str, Any]:
+        """taxonomy_id and tags for a listing: the matched node (or the root) and tags from subjects"""
+        subjects = [subject for subject in subjects or [] if isinstance(subject, str)]
+        node = self.match(subjects)
+        taxonomy_id = node["taxonomy_id"] if node else (self.root_id or ETSY_TAXONOMY_ROOT)
+
+        tags, seen = [], set()
+        candidates = DEFAULT_TAGS + ([self.nodes[taxonomy_id]["name"]] if taxonomy_id in self.nodes else []) + subjects
+        for candidate in candidates:
+            tag = clean_tag(candidate)
+            if tag and tag.casefold() not in seen:
+                seen.add(tag.casefold())
+                tags.append(tag)
+            if len(tags) == MAX_TAGS:
+                break
+        return {"taxonomy_id": taxonomy_id, "tags": tags, "node": node}
+
+
+class EtsyTaxonomy:
+    """
+    The seller taxonomy (`GET /seller-taxonomy/nodes`) fetched once, kept in
+    `path` and refetched after `refresh` seconds. When Etsy can't be reached a
+    stale copy is still used, and with no copy at all listings fall back to
+    the root category and the default tags.
+    """
+
+    def __init__(self, path: str = ETSY_TAXONOMY_PATH, refresh: float = ETSY_TAXONOMY_REFRESH):
+        self.path = path
+        self.refresh = refresh
+        self.index: Optional[TaxonomyIndex] = None
+        self.tree: Optional[List[Dict[str, Any]]] = None
+        self.fetched_at: Optional[float] = None
+        self._retry_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, cached: Dict[str, Any]):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(cached, file)
+        os.replace(tmp_path, self.path)
+
+    def _load(self, cached: Dict[str, Any]):
+        self.index = TaxonomyIndex(cached["nodes"])
+        self.tree = cached["nodes"]
+        self.fetched_at = cached["fetched_at"]
+
+    def _fresh(self) -> bool:
+        # While Etsy is unreachable, whatever we have counts as fresh until the retry time
+        return (self.fetched_at is not None and time.time() - self.fetched_at < self.refresh) \
+            or time.time() < self._retry_at
+
+    async def ensure(self, etsy, force: bool = False) -> Optional[TaxonomyIndex]:
+        """The loaded index, reading the disk copy or fetching from Etsy when it is missing or too old"""
+        if self._fresh() and not force:
+            return self.index
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._fresh() and not force:
+                return self.index
+
+            # Step 1: The disk copy, when it is recent enough
+            if self.index is None or force:
+                cached = await asyncio.to_thread(self._read)
+                if cached and cached.get("nodes"):
+                    await asyncio.to_thread(self._load, cached)
+                if self._fresh() and not force:
+                    return self.index
+
+            # Step 2: Fetch it again; the taxonomy is public, so no OAuth token is needed
+            try:
+                response = await etsy.get('/seller-taxonomy/nodes', auth=False)
+                cached = {"fetched_at": time.time(), "nodes": response.json()["results"]}
+                await asyncio.to_thread(self._load, cached)
+                await asyncio.to_thread(self._write, cached)
+            except (httpx.HTTPError, TokenError, KeyError, ValueError) as e:
+                logger.warning("Fetching the Etsy taxonomy failed, %s: %s",
+                               "keeping the cached copy" if self.index else "using defaults", e)
+                self._retry_at = time.time() + RETRY_AFTER_FAILURE
+            return self.index
+
+    async def classify(self, etsy, subjects: Optional[Iterable[str]]) -> Dict[str, Any]:
+        index = await self.ensure(etsy)
+        if index is None:
+            return {"taxonomy_id": ETSY_TAXONOMY_ROOT, "tags": list(DEFAULT_TAGS), "node": None}
+        return index.classify(subjects)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "loaded": self.index is not None,
+            "nodes": len(self.index.nodes) if self.index else 0,
+            "keywords": len(self.index.lookup) if self.index else 0,
+            "root_id": self.index.root_id if self.index else None,
+            "fetched_at": self.fetched_at,
+            "refresh": self.refresh,
+        }
+
+
+etsy_taxonomy = EtsyTaxonomy()
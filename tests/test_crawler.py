@@ -0,0 +1,83 @@
+"""
+Crawler runs against the local pdfdrive fake, in process.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_services import FakeServices, FakeSettings  # noqa: E402
+
+CATALOG_PAGES = 3
+BOOKS_PER_PAGE = 4
+
+
+@pytest.fixture
+def services():
+    with FakeServices(FakeSettings(latency=0.0, page_padding=0, catalog_pages=CATALOG_PAGES,
+                                   books_per_page=BOOKS_PER_PAGE)) as services:
+        yield services
+
+
+@pytest.fixture
+def crawler_module(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import crawler
+    return crawler
+
+
+def _crawler(crawler_module, tmp_path, submitted):
+    def submit(urls):
+        submitted.extend(urls)
+        return {"id": f"job-{len(submitted)}"}
+
+    return crawler_module.Crawler(submit, state=crawler_module.CrawlState(str(tmp_path / "crawler.db")),
+                                  limiter=crawler_module.HostLimiter(delay=0.0))
+
+
+async def _crawl(crawler, seeds):
+    await crawler.start(seeds)
+    await asyncio.wait_for(crawler._task, timeout=30)
+    return crawler.status()
+
+
+def test_recrawl_does_not_submit_books_again(services, crawler_module, tmp_path):
+    seed = f"{services.servers['pdfdrive'].url}/category/1"
+
+    async def main():
+        submitted = []
+        crawler = _crawler(crawler_module, tmp_path, submitted)
+        first = await _crawl(crawler, [seed])
+        assert len(submitted) == CATALOG_PAGES * BOOKS_PER_PAGE * 2  # the seed category and /category/7
+
+        # A new Crawler over the same state file, as after a restart
+        again = _crawler(crawler_module, tmp_path, submitted)
+        second = await _crawl(again, [seed])
+        return first, second, submitted
+
+    first, second, submitted = asyncio.run(main())
+    assert second["pages"] == first["pages"]
+    assert second["books_submitted"] == 0
+    assert len(submitted) == len(set(submitted))
+
+
+def test_page_that_raises_does_not_stop_the_crawl(services, crawler_module, tmp_path, monkeypatch):
+    base = services.servers['pdfdrive'].url
+    parse = crawler_module.parse_listing_page
+
+    def flaky_parse(html, base_url):
+        if base_url.endswith("page=2"):
+            raise ValueError("unparseable page")
+        return parse(html, base_url)
+
+    monkeypatch.setattr(crawler_module, "parse_listing_page", flaky_parse)
+    crawler = _crawler(crawler_module, tmp_path, [])
+    status = asyncio.run(_crawl(crawler, [f"{base}/category/1", f"{base}/category/2"]))
+
+    assert status["failed_pages"] == 3  # page 2 of /category/1, /category/2 and /category/7
+    assert status["finished_at"] is not None
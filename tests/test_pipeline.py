@@ -0,0 +1,186 @@
+"""
+End-to-end checks of the listing pipeline: the real app in a subprocess
+against the local Etsy, Open Library and pdfdrive fakes.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import AppProcess  # noqa: E402
+from fake_services import FakeServices, FakeSettings  # noqa: E402
+
+UNKNOWN_BOOK = 424242
+BROKEN_PDF_BOOK = 535353
+
+
+@pytest.fixture
+def services():
+    with FakeServices(FakeSettings(latency=0.0, pdf_size=256 * 1024, page_padding=1024,
+                                   unknown_books=[UNKNOWN_BOOK], broken_pdfs=[BROKEN_PDF_BOOK])) as services:
+        yield services
+
+
+def _app(env, workdir):
+    app = AppProcess(env, workdir).start()
+    try:
+        yield httpx.Client(base_url=app.url, timeout=60.0)
+    finally:
+        app.stop()
+
+
+@pytest.fixture
+def app(services, tmp_path):
+    yield from _app(services.env(), str(tmp_path))
+
+
+@pytest.fixture
+def stream_app(services, tmp_path):
+    yield from _app({**services.env(), "PDF_TRANSFER_MODE": "stream"}, str(tmp_path))
+
+
+def test_unknown_book_is_listed_under_its_scraped_title(stream_app, services):
+    # In stream mode there is no PDF metadata to fall back on, only the scraped title
+    result = stream_app.post("/listings/pipeline", json={"book_url": services.book_url(UNKNOWN_BOOK)}).json()
+
+    assert "error" not in result, result
+    assert result["book"] == {"title": f"Benchmark Book {UNKNOWN_BOOK}"}
+    listing = services.etsy.listings[result["listing_id"]]
+    assert listing["title"] == f"Benchmark Book {UNKNOWN_BOOK}"
+
+
+def _wait_for_job(app, job_id, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = app.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed", "cancelled"):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def test_rerun_of_a_finished_book_does_not_upload_again(app, services):
+    book_url = services.book_url(1001)
+    first = app.post("/listings/pipeline", json={"book_url": book_url}).json()
+    assert "error" not in first, first
+    assert services.etsy.uploads == {"images": 1, "files": 1}
+
+    again = app.post("/listings/pipeline", json={"book_url": book_url}).json()
+    assert "error" not in again, again
+    assert again["existing_listing"] is True
+    assert again["listing_id"] == first["listing_id"]
+    assert services.etsy.uploads == {"images": 1, "files": 1}
+
+
+def test_batch_with_a_repeated_book_uploads_once(app, services):
+    book_url = services.book_url(1002)
+    job = app.post("/jobs/batch", json={"book_urls": [book_url, book_url]}).json()
+    job = _wait_for_job(app, job["job_id"])
+
+    assert [item["status"] for item in job["items"]] == ["done", "done"]
+    assert len(services.etsy.listings) == 1
+    assert services.etsy.uploads == {"images": 1, "files": 1}
+
+
+def test_keyed_lock_is_kept_while_someone_waits(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from app import _keyed_lock
+
+    locks = {}
+    inside = []
+
+    async def hold(name, delay):
+        async with _keyed_lock(locks, "key"):
+            inside.append(name)
+            assert len(inside) == 1, inside
+            await asyncio.sleep(delay)
+            inside.remove(name)
+
+    async def main():
+        first = asyncio.create_task(hold("first", 0.05))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold("waiter", 0.05))
+        await first
+        # Arrives right after the release, while the waiter is about to take the lock
+        await asyncio.gather(waiter, hold("late", 0.0))
+
+    asyncio.run(main())
+    assert locks == {}
+
+
+def test_failing_pdf_source_is_reported_as_a_stage_error(stream_app, services):
+    result = stream_app.post("/listings/pipeline", json={"book_url": services.book_url(BROKEN_PDF_BOOK)}).json()
+
+    assert result["stage"] == "upload_file", result
+    assert "503" in result["error"]
+    assert result["details"] == "Fake source failure"
+    assert services.etsy.uploads["files"] == 0
+
+
+@pytest.fixture
+def slow_app(tmp_path):
+    # Etsy answers slowly enough for concurrent creates to overlap
+    with FakeServices(FakeSettings(latency=0.3)) as slow_services:
+        for client in _app(slow_services.env(), str(tmp_path)):
+            yield client, slow_services
+
+
+def test_differently_keyed_requests_for_one_book_create_one_listing(slow_app):
+    app, services = slow_app
+    requests = [
+        {"idempotency_key": "order-1", "source_url": "https://example.com/a", "isbn": "9780000000001"},
+        {"source_url": "https://example.com/a"},
+        {"source_url": "https://example.com/b", "isbn": "978-0-00-000000-1"},
+    ]
+
+    async def create(params, title):
+        async with httpx.AsyncClient(base_url=app.base_url, timeout=60.0) as client:
+            response = await client.get("/create-listing", params={"shop_id": 1, "title": title,
+                                                                   "description": "d", **params})
+            return response.json()
+
+    async def main():
+        return await asyncio.gather(*(create(params, f"Same Book, print {i}") for i, params in enumerate(requests)))
+
+    results = asyncio.run(main())
+    assert len(services.etsy.listings) == 1, results
+    assert len({result["listing_id"] for result in results}) == 1, results
+
+
+def _store_rows(workdir):
+    db = sqlite3.connect(os.path.join(workdir, "pdf_store", "index.db"))
+    try:
+        return db.execute("SELECT hash, refcount FROM blobs").fetchall(), dict(db.execute("SELECT key, hash FROM sources"))
+    finally:
+        db.close()
+
+
+def test_file_mode_pipeline_reuses_the_stored_pdf(app, services, tmp_path):
+    # File mode is the default: the pipeline goes through the PDF store
+    book_url = services.book_url(1003)
+    held = app.get("/get-book-pdf", params={"book_url": book_url}).json()
+    assert held["pdf"] and held["metadata"]["isbn"], held
+    served = services.pdfdrive.bytes_served
+    assert [refcount for _, refcount in _store_rows(tmp_path)[0]] == [1]
+
+    result = app.post("/listings/pipeline", json={"book_url": book_url}).json()
+    assert "error" not in result, result
+    # The stored copy was used, and the lookup went by the ISBN inside the PDF
+    assert services.pdfdrive.bytes_served == served
+    assert services.openlibrary.lookups == {"title": 0, "isbn": 1}
+    blobs, sources = _store_rows(tmp_path)
+    assert blobs == [(blobs[0][0], 1)]
+    assert sources[f"url:{book_url}"] == blobs[0][0]
+
+    assert app.get("/delete-pdf", params={"file_name": held["pdf"]}).json() == {"message": "PDF released successfully!"}
+    # Unreferenced, but kept for reuse while the store is under its quota
+    assert _store_rows(tmp_path)[0] == [(blobs[0][0], 0)]
+    assert os.path.exists(held["pdf"])
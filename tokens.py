@@ -0,0 +1,158 @@
+import asyncio
+import os
+import tempfile
+import time
+from typing import Dict, Optional
+
+import httpx
+
+ETSY_TOKEN_URL = os.getenv("ETSY_TOKEN_URL", "https://api.etsy.com/v3/public/oauth/token")
+
+# Refresh this many seconds before the access token actually expires
+TOKEN_REFRESH_MARGIN = int(os.getenv("ETSY_TOKEN_REFRESH_MARGIN", 300))
+
+TOKEN_KEYS = ("ETSY_ACCESS_TOKEN", "ETSY_REFRESH_TOKEN", "ETSY_TOKEN_EXPIRES_AT")
+
+
+class TokenError(Exception):
+    """Raised when no usable OAuth token is available"""
+
+
+class TokenManager:
+    """
+    Holds the Etsy OAuth tokens in memory.
+
+    The `.env` file is read once; after that the access token is served from
+    memory, refreshed shortly before `expires_in` runs out under a single-flight
+    lock, and written back atomically (temp file + rename).
+    """
+
+    def __init__(self, client_id: Optional[str], env_path: str = ".env", token_url: str = ETSY_TOKEN_URL,
+                 refresh_margin: int = TOKEN_REFRESH_MARGIN):
+        self.client_id = client_id
+        self.env_path = env_path
+        self.token_url = token_url
+        self.refresh_margin = refresh_margin
+        self.access_token: Optional[str] = None
+        self.refresh_token: Optional[str] = None
+        self.expires_at: Optional[float] = None
+        self.generation = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    def _read_env(self) -> Dict[str, str]:
+        values = {}
+        try:
+            with open(self.env_path, "r") as file:
+                for line in file:
+                    key, sep, value = line.partition("=")
+                    if sep:
+                        values[key.strip()] = value.strip()
+        except FileNotFoundError:
+            pass
+        return values
+
+    async def load(self):
+        values = await asyncio.to_thread(self._read_env)
+        self.access_token = values.get("ETSY_ACCESS_TOKEN") or None
+        self.refresh_token = values.get("ETSY_REFRESH_TOKEN") or None
+        expires_at = values.get("ETSY_TOKEN_EXPIRES_AT")
+        self.expires_at = float(expires_at) if expires_at else None
+        self._loaded = True
+
+    def _write_env(self):
+        try:
+            with open(self.env_path, "r") as file:
+                lines = [line for line in file if not line.startswith(tuple(f"{key}=" for key in TOKEN_KEYS))]
+        except FileNotFoundError:
+            lines = []
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+
+        lines.append(f"ETSY_ACCESS_TOKEN={self.access_token}\n")
+        if self.refresh_token:
+            lines.append(f"ETSY_REFRESH_TOKEN={self.refresh_token}\n")
+        if self.expires_at:
+            lines.append(f"ETSY_TOKEN_EXPIRES_AT={int(self.expires_at)}\n")
+
+        # Write next to the target and rename over it so readers never see a half-written file
+        directory = os.path.dirname(os.path.abspath(self.env_path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".env.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as file:
+                file.writelines(lines)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.env_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    async def _store(self, tokens: Dict):
+        self.access_token = tokens["access_token"]
+        self.refresh_token = tokens.get("refresh_token", self.refresh_token)
+        expires_in = tokens.get("expires_in")
+        self.expires_at = time.time() + float(expires_in) if expires_in else None
+        self.generation += 1
+        await asyncio.to_thread(self._write_env)
+
+    def _expiring(self) -> bool:
+        return self.expires_at is not None and time.time() >= self.expires_at - self.refresh_margin
+
+    async def get_access_token(self) -> str:
+        if not self._loaded:
+            async with self._lock:
+                if not self._loaded:
+                    await self.load()
+        if self._expiring() and self.refresh_token:
+            await self.refresh()
+        if not self.access_token:
+            raise TokenError("No Etsy access token, authorize the app first")
+        return self.access_token
+
+    async def refresh(self, force: bool = False, stale_token: Optional[str] = None) -> str:
+        """
+        Refresh the access token. Concurrent callers share a single refresh:
+        whoever gets the lock first does the exchange, the rest reuse its result.
+        Pass `stale_token` (the token a request was rejected with) to skip the
+        refresh when someone else already replaced it.
+        """
+        generation = self.generation
+        async with self._lock:
+            if not self._loaded:
+                await self.load()
+            if self.generation != generation or (not force and not self._expiring()):
+                return self.access_token
+            if stale_token and stale_token != self.access_token:
+                return self.access_token
+            if not self.refresh_token:
+                raise TokenError("No Etsy refresh token, authorize the app first")
+
+            data = {
+                "grant_type": "refresh_token",
+                "client_id": self.client_id,
+                "refresh_token": self.refresh_token,
+            }
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                response = await client.post(self.token_url, data=data)
+                response.raise_for_status()
+            await self._store(response.json())
+            return self.access_token
+
+    async def exchange_code(self, code: str, code_verifier: str, redirect_uri: str) -> Dict:
+        """Exchange an authorization code for tokens and keep them"""
+        data = {
+            "grant_type": "authorization_code",
+            "client_id": self.client_id,
+            "redirect_uri": redirect_uri,
+            "code": code,
+            "code_verifier": code_verifier,
+        }
+        async with self._lock:
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                response = await client.post(self.token_url, data=data)
+                response.raise_for_status()
+            tokens = response.json()
+            await self._store(tokens)
+            self._loaded = True
+        return tokens